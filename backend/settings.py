@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 from pathlib import Path
 import os
 from datetime import datetime
+
+from django.core.exceptions import ImproperlyConfigured
+
 # from graphql_jwt.settings import JWT_AUDIENCE, JWT_ISSUER, JWT_EXPIRATION_DELTA
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -89,12 +92,85 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_required(name):
+    value = os.environ.get(name)
+    if not value:
+        raise ImproperlyConfigured(f'Не задана переменная окружения {name}')
+    return value
+
+
+# База выбирается переменными окружения. По умолчанию — файл SQLite рядом с проектом,
+# при DATABASE_ENGINE=postgresql — Postgres с параметрами DATABASE_NAME, DATABASE_USER,
+# DATABASE_PASSWORD, DATABASE_HOST и DATABASE_PORT.
+# DATABASE_CONN_MAX_AGE — сколько секунд соединение переиспользуется между запросами
+# (0 — закрывается после каждого запроса); перед переиспользованием оно проверяется.
+# DATABASE_PGBOUNCER=1 — соединения идут через pgbouncer в режиме пула транзакций:
+# серверные курсоры iterator() (выгрузка каталога) не переживают конец транзакции и отключаются.
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+if DATABASE_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env_required('DATABASE_NAME'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'DISABLE_SERVER_SIDE_CURSORS': env_flag('DATABASE_PGBOUNCER'),
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DATABASE_CONNECT_TIMEOUT', 5)),
+            },
+        }
     }
-}
+else:
+    # SQLite под параллельными запросами (core.db.backends.sqlite3): журнал WAL, в котором
+    # читатели не ждут писателя; ожидание блокировки до 5 с вместо «database is locked»;
+    # synchronous=NORMAL — в режиме WAL fsync только на контрольных точках, без риска
+    # повредить базу; 256 МБ файла отображаются в память, кэш страниц 64 МБ на соединение.
+    # Транзакции начинаются с BEGIN IMMEDIATE, так что писатели встают в очередь сразу,
+    # а не сталкиваются на первой записи. DATABASE_SQLITE_TUNING=0 — стандартный бэкенд.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'core.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'pragmas': {
+                    'busy_timeout': 5000,
+                    'journal_mode': 'WAL',
+                    'synchronous': 'NORMAL',
+                    'mmap_size': 256 * 1024 * 1024,
+                    'cache_size': -64 * 1024,
+                },
+            },
+            # Тестовая база — файл, а не память: WAL и параллельные соединения проверяются тестами.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+    if not env_flag('DATABASE_SQLITE_TUNING', True):
+        DATABASES['default'].update(ENGINE='django.db.backends.sqlite3', OPTIONS={})
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+# Реплика для запросов чтения GraphQL (core.routers): DATABASE_REPLICA_HOST и при
+# необходимости DATABASE_REPLICA_PORT, DATABASE_REPLICA_NAME; остальное — как у основной.
+# Для проверки без Postgres достаточно указать копию файла SQLite в DATABASE_REPLICA_NAME.
+# Миграции на реплику не применяются, в тестах она указывает на тестовую основную базу.
+if os.environ.get('DATABASE_REPLICA_HOST') or os.environ.get('DATABASE_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('DATABASE_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.environ.get('DATABASE_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+        'PORT': os.environ.get('DATABASE_REPLICA_PORT', DATABASES['default'].get('PORT', '')),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
 
 # Email
 EMAIL_HOST_PASSWORD = ''
@@ -104,6 +180,27 @@ EMAIL_POST = 587
 EMAIL_HOST_USER = ''
 EMAIL_USE_TLS = True
 
+# Очередь писем (core.outbox, команда send_outbox)
+# Сколько писем отправляется через одно SMTP-соединение.
+OUTBOX_BATCH_SIZE = 50
+# После скольких неудачных попыток письмо перестает отправляться.
+OUTBOX_MAX_ATTEMPTS = 8
+# Задержка перед первой повторной попыткой, сек. Каждая следующая вдвое дольше.
+OUTBOX_RETRY_DELAY = 30
+# На сколько секунд отправитель забирает пачку писем: пока идет отправка, другие
+# процессы ее не берут, а после падения отправителя письма снова уходят в работу.
+OUTBOX_LEASE = 10 * 60
+
+# Пул ключей активации (core.keys.KeyPool)
+# Включает выдачу ключей из заранее зарезервированных в памяти процесса блоков.
+KEY_POOL_ENABLED = False
+# Сколько ключей продукта резервируется за один раз.
+KEY_POOL_BLOCK_SIZE = 100
+# При каком остатке в пуле запускается фоновое пополнение.
+KEY_POOL_LOW_WATER = 20
+# Через сколько секунд резерв считается брошенным (см. команду release_reserved_keys).
+KEY_POOL_RESERVATION_TTL = 60 * 60
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -143,16 +240,107 @@ AUTH_USER_MODEL = 'core.User'
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Загрузки хранятся под хэшем содержимого (core.storage): одинаковые файлы не
+# дублируются, а адреса неизменяемы и кэшируются клиентами бессрочно.
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+# Время кэширования в браузере производных файлов (вариантов изображений), которые
+# могут пересоздаваться под тем же именем; оригиналы кэшируются на год как immutable.
+MEDIA_VARIANT_MAX_AGE = 86400
+# LRU метаданных раздаваемых медиафайлов (core.media): число файлов и через сколько
+# секунд перепроверять файлы, которые могут измениться.
+MEDIA_STAT_CACHE_SIZE = 4096
+MEDIA_STAT_CACHE_TTL = 60
+# Варианты загруженных изображений (core.images): имя размера и рамка, в которую
+# вписывается изображение, выходные форматы, качество сжатия и число потоков,
+# в которых варианты создаются после сохранения.
+IMAGE_VARIANTS = {
+    'thumb': (160, 160),
+    'small': (320, 320),
+    'medium': (640, 640),
+    'large': (1280, 1280),
+}
+IMAGE_VARIANT_FORMATS = ('webp', 'jpeg')
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_WORKERS = 2
 # GRAPHENE GraphQL
 GRAPHENE = {
     "SCHEMA": "core.schema.schema",
     "MIDDLEWARE": [
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        "core.profiling.ProfilingMiddleware",
     ],
 }
 GRAPHQL_JWT = {
     "JWT_ALLOW_ARGUMENT": True,
 }
+# Размер страницы каталога (allProducts, productsSearch, productsByTag) по умолчанию и максимальный.
+PRODUCTS_PAGE_SIZE = 20
+PRODUCTS_MAX_PAGE_SIZE = 100
+# Подсказки productSuggest: максимальное число вариантов, период фоновой перестройки
+# индекса в секундах, минимальное триграммное сходство и минимальная длина запроса
+# для исправления опечаток.
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_INDEX_TTL = 300
+SUGGEST_SIMILARITY_THRESHOLD = 0.3
+SUGGEST_FUZZY_MIN_LENGTH = 4
+
+# Кэши. LocMemCache при превышении MAX_ENTRIES вытесняет давно не читанные записи (LRU).
+# Кэш ответов GraphQL хранит и версии моделей, поэтому он общий для всех процессов:
+# иначе сохранение в одном процессе не сбрасывало бы ответы, закэшированные другими.
+# По умолчанию — файлы в GRAPHQL_CACHE_DIR (общие для процессов одного сервера),
+# при GRAPHQL_CACHE_REDIS_URL — Redis (нужен пакет redis), общий и для нескольких серверов.
+if os.environ.get('GRAPHQL_CACHE_REDIS_URL'):
+    GRAPHQL_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['GRAPHQL_CACHE_REDIS_URL'],
+    }
+else:
+    GRAPHQL_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('GRAPHQL_CACHE_DIR', BASE_DIR / 'cache' / 'graphql'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'graphql': GRAPHQL_CACHE,
+}
+# Алиас кэша ответов GraphQL и время жизни ответа в секундах.
+GRAPHQL_CACHE_ALIAS = 'graphql'
+GRAPHQL_CACHE_TIMEOUT = 600
+# Сколько разобранных и проверенных документов GraphQL хранит процесс (core.persisted)
+# и регистрировать ли в базе persisted queries, присланные клиентами вместе с текстом.
+# По умолчанию реестр пополняется только командой register_queries при деплое.
+GRAPHQL_DOCUMENT_CACHE_SIZE = 1000
+GRAPHQL_PERSISTED_QUERIES_AUTO_REGISTER = False
+# Ограничения стоимости запросов GraphQL (core.cost): максимальная оценка стоимости
+# и глубины операции, предполагаемый размер списков без аргумента first/limit и
+# поминутный бюджет стоимости на один IP (None — без ограничения).
+GRAPHQL_MAX_QUERY_COST = 5000
+GRAPHQL_MAX_QUERY_DEPTH = 10
+GRAPHQL_COST_LIST_SIZE = 20
+GRAPHQL_COST_BUDGET = None
+# Профилирование запросов GraphQL (core.profiling): доля запросов, профиль которых
+# пишется в лог, токен заголовка X-GraphQL-Profile (без токена заголовок работает
+# только для сотрудников) и с какого числа повторов SQL-запрос считается дублем.
+GRAPHQL_PROFILE_SAMPLE_RATE = 0.0
+GRAPHQL_PROFILE_TOKEN = None
+GRAPHQL_PROFILE_DUPLICATE_THRESHOLD = 2
+# Размер пачки строк при импорте каталога и ключей (core.importer): столько строк
+# вставляется одним bulk_create в одной транзакции.
+CATALOG_IMPORT_BATCH_SIZE = 1000
+# Сколько строк выгрузки каталога (core.exporter) читается из базы за раз.
+CATALOG_EXPORT_CHUNK_SIZE = 2000
 
 # CORS
 # Определяет, должен ли Django быть полностью открыт или полностью закрыт по умолчанию.
@@ -13,17 +13,23 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
-from django.conf.urls.static import static
 from django.conf import settings
+from core import media
+from core.views import AsyncGraphQLView, CachedGraphQLView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True))),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("graphql", csrf_exempt(CachedGraphQLView.as_view(graphiql=True))),
+    # Асинхронный вариант для запуска под ASGI (backend/asgi.py).
+    path("graphql/async", csrf_exempt(AsyncGraphQLView.as_view())),
+    # Загруженные файлы: sendfile, условные запросы и Range (core.media).
+    re_path(r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")), media.serve),
+]
 
 admin.site.site_header = 'Административная панель Globus-IT'
 admin.site.site_title = 'Административная панель Globus-IT'
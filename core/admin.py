@@ -1,11 +1,18 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django import forms
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 # Register your models here.
-from core.models import Tag, Product, OperatingSystem, Company, User, ProductKey
+from core.models import Tag, Product, OperatingSystem, Company, User, ProductKey, OutboxMessage, PersistedQuery, Order, OrderItem
 from languages_plus.models import Language, CultureCode
 from countries_plus.models import Country
 from django.contrib.admin.sites import site
 from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from core import exporter
+from core.importer import ImportFileError, import_file
 
 admin.site.unregister(Language)
 admin.site.unregister(CultureCode)
@@ -23,6 +30,16 @@ class ProductKeyAdminForm(forms.ModelForm):
         fields = '__all__'
 
 
+class ImportCatalogForm(forms.Form):
+    """Загрузка файла импорта продуктов или ключей"""
+
+    kind = forms.ChoiceField(label="Что импортировать", choices=[
+        ("products", "Продукты"),
+        ("keys", "Ключи активации"),
+    ])
+    file = forms.FileField(label="Файл CSV или JSONL (можно сжатый .gz)")
+
+
 @admin.register(ProductKey)
 class ProductKeyAdmin(admin.ModelAdmin):
     model = ProductKey
@@ -53,6 +70,85 @@ class TagAdmin(admin.ModelAdmin):
     model = OperatingSystem
 
 
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    model = OutboxMessage
+    list_display = (
+        "to_email",
+        "subject",
+        "created_at",
+        "sent_at",
+        "attempts",
+    )
+    list_filter = (
+        "sent_at",
+    )
+    readonly_fields = (
+        "created_at",
+        "sent_at",
+        "attempts",
+        "next_attempt_at",
+        "last_error",
+    )
+
+
+class OrderItemInLine(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    can_delete = False
+    readonly_fields = (
+        "product",
+        "product_key",
+        "price",
+    )
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    model = Order
+    inlines = [OrderItemInLine, ]
+    list_display = (
+        "id",
+        "email",
+        "total",
+        "created_at",
+    )
+    list_filter = (
+        "created_at",
+    )
+    search_fields = (
+        "email",
+        "idempotency_key",
+    )
+    readonly_fields = (
+        "idempotency_key",
+        "request_hash",
+        "email",
+        "user",
+        "total",
+        "created_at",
+    )
+
+
+@admin.register(PersistedQuery)
+class PersistedQueryAdmin(admin.ModelAdmin):
+    model = PersistedQuery
+    list_display = (
+        "sha256",
+        "created_at",
+    )
+    search_fields = (
+        "sha256",
+    )
+    readonly_fields = (
+        "sha256",
+        "created_at",
+    )
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     model = Product
@@ -90,3 +186,76 @@ class ProductAdmin(admin.ModelAdmin):
 
     date_hierarchy = "publish_date"
     save_on_top = True
+    change_list_template = "admin/core/product/change_list.html"
+
+    def get_urls(self):
+        return [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_catalog_view),
+                name="core_product_import",
+            ),
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_catalog_view),
+                name="core_product_export",
+            ),
+        ] + super().get_urls()
+
+    def import_catalog_view(self, request):
+        """Импорт продуктов и ключей из файла (core.importer), как команда import_catalog"""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = ImportCatalogForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            try:
+                stats = import_file(upload.file, form.cleaned_data["kind"], name=upload.name)
+            except ImportFileError as error:
+                form.add_error("file", str(error))
+            else:
+                for line, message in stats.errors:
+                    self.message_user(request, f"Строка {line}: {message}", messages.WARNING)
+                self.message_user(request, f"Импорт завершен: {stats}", messages.SUCCESS)
+                return redirect("admin:core_product_changelist")
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Импорт каталога",
+            "form": form,
+        }
+        return TemplateResponse(request, "admin/core/product/import_catalog.html", context)
+
+    def has_export_permission(self, request, kind):
+        # Выгрузка ключей раскрывает непроданные ключи активации: нужен доступ к ним, а не к каталогу.
+        if kind == "keys":
+            return request.user.has_perm("core.view_productkey")
+        return self.has_view_permission(request)
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {
+            **(extra_context or {}),
+            "has_keys_export_permission": self.has_export_permission(request, "keys"),
+        }
+        return super().changelist_view(request, extra_context)
+
+    def export_catalog_view(self, request):
+        """
+        Потоковая выгрузка каталога или ключей (core.exporter), как команда
+        export_catalog. Параметры: kind, format и gzip.
+        """
+        kind = request.GET.get("kind", "products")
+        format = request.GET.get("format", "csv")
+        if kind not in exporter.EXPORTS or format not in exporter.FORMATS:
+            raise Http404
+        if not self.has_export_permission(request, kind):
+            raise PermissionDenied
+        compress = request.GET.get("gzip") == "1"
+        response = StreamingHttpResponse(
+            exporter.export(kind, format, compress),
+            content_type="application/gzip" if compress else (
+                "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson; charset=utf-8"
+            ),
+        )
+        response["Content-Disposition"] = f'attachment; filename="{exporter.filename(kind, format, compress)}"'
+        return response
@@ -0,0 +1,75 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db.models import QuerySet
+
+
+def is_async(info):
+    '''
+    Выполняется ли запрос асинхронным представлением (AsyncGraphQLView):
+    тогда резолверы могут возвращать корутины async ORM.
+    '''
+    return getattr(info.context, 'graphql_async', False)
+
+
+async def call_or_offload(function, *args, **kwargs):
+    '''
+    Вызывает синхронную функцию прямо в цикле событий, а если она обратилась
+    к базе (SynchronousOnlyOperation), повторяет вызов в потоке через
+    sync_to_async. Подходит только для функций без побочных эффектов до
+    первого запроса к базе.
+    '''
+    try:
+        return function(*args, **kwargs)
+    except SynchronousOnlyOperation:
+        return await sync_to_async(function)(*args, **kwargs)
+
+
+async def alist(queryset):
+    return [obj async for obj in queryset]
+
+
+class SyncFallbackMiddleware:
+    """
+    Middleware асинхронного выполнения. Синхронные резолверы, которые не
+    трогают базу (поля уже загруженных объектов, подгруженные связи), работают
+    прямо в цикле событий; резолвер, обратившийся к базе, повторяется в потоке.
+    Невычисленный QuerySet из резолвера загружается через async-итерацию,
+    иначе graphql-core вычислил бы его синхронно в цикле событий.
+    """
+
+    def resolve(self, next, root, info, **args):
+        try:
+            result = next(root, info, **args)
+        except SynchronousOnlyOperation:
+            return sync_to_async(_resolve_list)(next, root, info, **args)
+        if _is_lazy_queryset(result):
+            return alist(result)
+        if hasattr(result, 'then') and hasattr(result, 'get'):
+            # Promise из middleware ниже: исключение резолвера в нем уже превращено
+            # в отказ, а QuerySet внутри тоже нужно загрузить заранее. Promise
+            # ожидает future, а не корутину, отсюда ensure_future.
+            def loaded(value):
+                return asyncio.ensure_future(alist(value)) if _is_lazy_queryset(value) else value
+
+            def offloaded(error):
+                if isinstance(error, SynchronousOnlyOperation):
+                    return asyncio.ensure_future(sync_to_async(_resolve_list)(next, root, info, **args))
+                raise error
+
+            return result.then(loaded, offloaded)
+        return result
+
+
+def _is_lazy_queryset(value):
+    return isinstance(value, QuerySet) and value._result_cache is None
+
+
+def _resolve_list(next, root, info, **args):
+    result = next(root, info, **args)
+    if hasattr(result, 'get') and hasattr(result, 'then'):
+        result = result.get()
+    if isinstance(result, QuerySet):
+        result = list(result)
+    return result
@@ -1,6 +1,43 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
 
 
 class CoreConfig(AppConfig):
     name = 'core'
     verbose_name = "Основные настройки приложения"
+
+    def ready(self):
+        from core import signals
+        from core.images import IMAGE_FIELDS
+        from core.counters import COUNTED_FIELDS
+        from core.models import Product, ProductKey
+        from core.response_cache import VERSIONED_MODELS
+        from core.suggest import KINDS
+
+        post_migrate.connect(signals.restore_search_index, sender=self)
+        for model in KINDS:
+            post_save.connect(signals.update_suggest_index, sender=model)
+            post_delete.connect(signals.remove_from_suggest_index, sender=model)
+
+        # Счетчики product_count у тегов и ОС (core.counters).
+        for field_name in COUNTED_FIELDS:
+            m2m_changed.connect(signals.count_m2m_changes, sender=getattr(Product, field_name).through)
+        pre_save.connect(signals.remember_published, sender=Product)
+        post_save.connect(signals.count_published_toggle, sender=Product)
+        pre_delete.connect(signals.remember_counted_links, sender=Product)
+        post_delete.connect(signals.count_deleted_product, sender=Product)
+        # Остатки ключей Product.available_keys.
+        pre_save.connect(signals.remember_key_state, sender=ProductKey)
+        post_save.connect(signals.count_available_keys, sender=ProductKey)
+        post_delete.connect(signals.count_deleted_key, sender=ProductKey)
+
+        # Версии моделей для кэша ответов GraphQL (core.response_cache).
+        for model in VERSIONED_MODELS:
+            post_save.connect(signals.invalidate_cached_responses, sender=model)
+            post_delete.connect(signals.invalidate_cached_responses, sender=model)
+        for field in Product._meta.many_to_many:
+            m2m_changed.connect(signals.invalidate_cached_responses, sender=field.remote_field.through)
+
+        # Варианты изображений продуктов и аватаров (core.images).
+        for model in IMAGE_FIELDS:
+            post_save.connect(signals.schedule_image_variants, sender=model)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+
+from core.keys import claim_keys
+from core.models import Order, OrderItem, OutboxMessage
+
+
+class CheckoutError(Exception):
+    """ Заказ нельзя оформить или повторить с этим ключом идемпотентности """
+
+
+def request_hash(email, product_ids):
+    payload = json.dumps([email.strip().lower(), sorted({int(product_id) for product_id in product_ids})])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def checkout(idempotency_key, email, product_ids, user=None):
+    '''
+    Оформляет заказ: выдает по ключу на каждый продукт, записывает заказ с
+    позициями и ставит письмо с ключами в очередь — все в одной транзакции.
+
+    Повтор с тем же idempotency_key (клиент не дождался ответа) не выдает
+    ключи заново, а возвращает сохраненный заказ одним поиском по уникальному
+    индексу. Возвращает (заказ, True для нового заказа, False для повтора).
+    '''
+    if not idempotency_key or len(idempotency_key) > Order._meta.get_field('idempotency_key').max_length:
+        raise CheckoutError('Неверный ключ идемпотентности')
+    if not product_ids:
+        raise CheckoutError('Заказ пуст')
+    fingerprint = request_hash(email, product_ids)
+
+    order = Order.objects.filter(idempotency_key=idempotency_key).first()
+    if order is not None:
+        return _replayed(order, fingerprint), False
+
+    try:
+        with transaction.atomic():
+            # Заказ создается первым: параллельный повтор с тем же ключом упрется в
+            # уникальный индекс и дождется этой транзакции, не выдавая свои ключи.
+            order = Order.objects.create(
+                idempotency_key=idempotency_key,
+                request_hash=fingerprint,
+                email=email,
+                user=user if user is not None and user.is_authenticated else None,
+            )
+            keys = claim_keys(product_ids)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=key.product, product_key=key, price=key.product.price)
+                for key in keys
+            ])
+            order.total = sum(key.product.price for key in keys)
+            order.save(update_fields=['total'])
+            OutboxMessage.objects.enqueue(
+                subject='Globus-IT: Ваша покупка совершена успешно!',
+                message='Ваши ключи: \n' + ''.join(f'{key.product.title} - {key.product_key}\n' for key in keys),
+                to_email=email,
+            )
+    except IntegrityError:
+        order = Order.objects.filter(idempotency_key=idempotency_key).first()
+        if order is None:
+            raise
+        return _replayed(order, fingerprint), False
+    return order, True
+
+
+def _replayed(order, fingerprint):
+    if order.request_hash != fingerprint:
+        raise CheckoutError('Ключ идемпотентности уже использован для другого заказа')
+    return order
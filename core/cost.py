@@ -0,0 +1,165 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLNonNull, GraphQLObjectType, get_named_type
+
+logger = logging.getLogger(__name__)
+
+# Вес поля сверх умолчания (1 за поле с объектным типом, 0 за скаляр).
+FIELD_WEIGHTS = {
+    'Query.productsSearch': 10,
+    'Query.productsByTag': 2,
+    'Query.tagsWithCountOfProducts': 2,
+    'Query.operatingSystemsWithCountOfProducts': 2,
+    'ProductConnection.totalCount': 5,
+}
+
+
+class QueryCost:
+    """ Оценка стоимости операции: сумма весов полей с учетом размеров списков и глубина вложенности """
+
+    def __init__(self, cost, depth):
+        self.cost = cost
+        self.depth = depth
+
+
+def estimate(schema, document_ast, operation_name=None, variables=None):
+    '''
+    Оценивает стоимость операции до выполнения резолверов.
+
+    Стоимость поля — его вес плюс стоимость дочерних полей, умноженная на
+    ожидаемое число объектов: аргумент first/limit (или его значение по
+    умолчанию), для прочих списков — GRAPHQL_COST_LIST_SIZE. Служебные поля
+    (__schema, __typename) не учитываются.
+    '''
+    operation = None
+    fragments = {}
+    for definition in document_ast.definitions:
+        if isinstance(definition, ast.FragmentDefinition):
+            fragments[definition.name.value] = definition
+        elif isinstance(definition, ast.OperationDefinition):
+            if operation_name is None or (definition.name and definition.name.value == operation_name):
+                operation = operation or definition
+    if operation is None:
+        return QueryCost(0, 0)
+    root = {
+        'query': schema.get_query_type,
+        'mutation': schema.get_mutation_type,
+        'subscription': schema.get_subscription_type,
+    }[operation.operation]()
+    walker = _Walker(schema, fragments, variables or {})
+    return QueryCost(*walker.selection_cost(root, operation.selection_set, depth=1))
+
+
+class _Walker:
+
+    def __init__(self, schema, fragments, variables):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables
+
+    def selection_cost(self, parent_type, selection_set, depth):
+        cost, max_depth = 0, depth - 1
+        for field, field_type in self._fields(parent_type, selection_set):
+            field_def = field_type.fields.get(field.name.value)
+            if field_def is None:
+                continue
+            named_type = get_named_type(field_def.type)
+            weight = FIELD_WEIGHTS.get(
+                f'{field_type.name}.{field.name.value}',
+                1 if isinstance(named_type, GraphQLObjectType) else 0,
+            )
+            field_cost, field_depth = weight, depth
+            if field.selection_set:
+                children_cost, field_depth = self.selection_cost(named_type, field.selection_set, depth + 1)
+                field_cost += self._multiplier(field, field_def) * children_cost
+            cost += field_cost
+            max_depth = max(max_depth, field_depth)
+        return cost, max_depth
+
+    def _fields(self, parent_type, selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                if not selection.name.value.startswith('__'):
+                    yield selection, parent_type
+            else:
+                if isinstance(selection, ast.FragmentSpread):
+                    fragment = self.fragments.get(selection.name.value)
+                    if fragment is None:
+                        continue
+                else:
+                    fragment = selection
+                fragment_type = parent_type
+                if fragment.type_condition is not None:
+                    fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                yield from self._fields(fragment_type, fragment.selection_set)
+
+    def _multiplier(self, field, field_def):
+        pagination = {
+            'first': (settings.PRODUCTS_PAGE_SIZE, settings.PRODUCTS_MAX_PAGE_SIZE),
+            'limit': (10, settings.SUGGEST_MAX_LIMIT),
+        }
+        for name, (default, maximum) in pagination.items():
+            if name in field_def.args:
+                value = self._argument(field, name)
+                return max(0, min(default if value is None else value, maximum))
+        field_type = field_def.type.of_type if isinstance(field_def.type, GraphQLNonNull) else field_def.type
+        if isinstance(field_type, GraphQLList):
+            # Список ребер connection уже ограничен аргументом first самого connection.
+            return 1 if field.name.value == 'edges' else settings.GRAPHQL_COST_LIST_SIZE
+        return 1
+
+    def _argument(self, field, name):
+        for argument in field.arguments:
+            if argument.name.value != name:
+                continue
+            if isinstance(argument.value, ast.Variable):
+                value = self.variables.get(argument.value.name.value)
+            elif isinstance(argument.value, ast.IntValue):
+                value = argument.value.value
+            else:
+                return None
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+        return None
+
+
+def enforce(schema, document_ast, operation_name=None, variables=None, request=None):
+    '''
+    Проверяет оценку стоимости и глубины операции против GRAPHQL_MAX_QUERY_COST,
+    GRAPHQL_MAX_QUERY_DEPTH и поминутного бюджета клиента GRAPHQL_COST_BUDGET.
+    Стоимость пишется в лог и накапливается в request.graphql_cost.
+    Превышение лимита — GraphQLError, резолверы при этом не вызываются.
+    '''
+    estimation = estimate(schema, document_ast, operation_name, variables)
+    logger.info(
+        'graphql query cost',
+        extra={'operation_name': operation_name, 'cost': estimation.cost, 'depth': estimation.depth},
+    )
+    if request is not None:
+        request.graphql_cost = getattr(request, 'graphql_cost', 0) + estimation.cost
+
+    if estimation.depth > settings.GRAPHQL_MAX_QUERY_DEPTH:
+        raise GraphQLError(
+            f'Глубина запроса {estimation.depth} превышает допустимую {settings.GRAPHQL_MAX_QUERY_DEPTH}'
+        )
+    if estimation.cost > settings.GRAPHQL_MAX_QUERY_COST:
+        raise GraphQLError(
+            f'Стоимость запроса {estimation.cost} превышает допустимую {settings.GRAPHQL_MAX_QUERY_COST}'
+        )
+    if settings.GRAPHQL_COST_BUDGET and request is not None:
+        key = f'graphql:cost:{request.META.get("REMOTE_ADDR")}:{int(time.time() // 60)}'
+        cache.add(key, 0, timeout=60)
+        try:
+            spent = cache.incr(key, estimation.cost)
+        except ValueError:
+            spent = estimation.cost
+        if spent > settings.GRAPHQL_COST_BUDGET:
+            raise GraphQLError('Превышен поминутный бюджет стоимости запросов, повторите позже')
+    return estimation
@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core import response_cache
+from core.models import Product, ProductKey
+
+# Связи Product, по которым связанные модели хранят счетчик product_count.
+COUNTED_FIELDS = ('tags', 'operating_systems')
+
+
+def counted_field(through):
+    '''
+    Возвращает поле Product, которому принадлежит промежуточная таблица through.
+    '''
+    for field_name in COUNTED_FIELDS:
+        field = Product._meta.get_field(field_name)
+        if field.remote_field.through is through:
+            return field
+    return None
+
+
+def adjust(field, pks, delta, using=None):
+    '''
+    Атомарно сдвигает product_count у объектов pks на delta (UPDATE ... SET x = x + delta).
+    '''
+    if not pks or not delta:
+        return
+    field.related_model._default_manager.db_manager(using).filter(pk__in=pks).update(
+        product_count=F('product_count') + delta
+    )
+
+
+def linked_ids(product, field, using=None, among=None):
+    '''
+    Первичные ключи объектов, связанных с продуктом через field (при among — только из них).
+    '''
+    through = field.remote_field.through
+    rows = through._default_manager.db_manager(using).filter(**{field.m2m_field_name(): product.pk})
+    if among is not None:
+        rows = rows.filter(**{f'{field.m2m_reverse_field_name()}__in': among})
+    return list(rows.values_list(field.m2m_reverse_name(), flat=True))
+
+
+def published_count(field, product_ids, using=None, linked_to=None):
+    '''
+    Сколько продуктов из product_ids опубликовано (при linked_to — и связано с этим объектом).
+    '''
+    products = field.model._default_manager.db_manager(using).filter(pk__in=product_ids, published=True)
+    if linked_to is not None:
+        products = products.filter(**{field.name: linked_to})
+    return products.count()
+
+
+def recount(field, using=None):
+    '''
+    Пересчитывает product_count всех объектов связи field с нуля одним UPDATE
+    с коррелированным подзапросом по промежуточной таблице.
+    '''
+    through = field.remote_field.through
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    counts = (
+        through._default_manager.db_manager(using)
+            .filter(**{f'{source}__published': True, target: OuterRef('pk')})
+            .order_by()
+            .values(target)
+            .annotate(count=Count('*'))
+            .values('count')
+    )
+    return field.related_model._default_manager.db_manager(using).update(
+        product_count=Coalesce(Subquery(counts), 0)
+    )
+
+
+def adjust_available_keys(deltas, using=None):
+    '''
+    Атомарно сдвигает available_keys продуктов: deltas — {id продукта: сдвиг}.
+    Продукты с одинаковым сдвигом обновляются одним UPDATE. Кэш ответов
+    сбрасывается, только если продукт закончился или снова появился в продаже:
+    сам остаток в закэшированных ответах может отставать на GRAPHQL_CACHE_TIMEOUT.
+    '''
+    by_delta = defaultdict(list)
+    for product_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(product_id)
+    products = Product._default_manager.db_manager(using)
+    crossed = False
+    for delta, product_ids in by_delta.items():
+        products.filter(pk__in=product_ids).update(available_keys=F('available_keys') + delta)
+        # Продукт пересек ноль, если после уменьшения остаток стал 0, а после увеличения равен сдвигу.
+        if not crossed:
+            crossed = products.filter(pk__in=product_ids, available_keys=0 if delta < 0 else delta).exists()
+    if crossed:
+        response_cache.invalidate_on_commit([Product], using=using)
+
+
+def recount_available_keys(using=None):
+    '''
+    Пересчитывает available_keys всех продуктов с нуля одним UPDATE.
+    '''
+    counts = (
+        ProductKey._default_manager.db_manager(using)
+            .filter(product=OuterRef('pk'), is_deleted=False)
+            .order_by()
+            .values('product')
+            .annotate(count=Count('*'))
+            .values('count')
+    )
+    return Product._default_manager.db_manager(using).update(available_keys=Coalesce(Subquery(counts), 0))
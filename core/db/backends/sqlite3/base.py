@@ -0,0 +1,45 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# Параметры OPTIONS, которые обрабатывает этот бэкенд, а не sqlite3.connect().
+OWN_OPTIONS = ('pragmas', 'transaction_mode')
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite для работы под параллельной нагрузкой. Дополнительно к обычным
+    параметрам в DATABASES['...']['OPTIONS'] принимает:
+
+    pragmas — PRAGMA, выполняемые на каждом новом соединении по порядку
+    (journal_mode=WAL: читатели не ждут писателя; busy_timeout: сколько
+    миллисекунд ждать блокировку вместо немедленного «database is locked»);
+
+    transaction_mode — режим BEGIN для transaction.atomic(). При IMMEDIATE
+    транзакция берет блокировку на запись сразу. Иначе она начинается как
+    читающая, а при первой записи, если другое соединение уже пишет или успело
+    зафиксировать изменения, SQLite не ждет busy_timeout и сразу отвечает
+    «database is locked», потому что ожидание не помогло бы.
+    """
+
+    def get_connection_params(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'Неизвестный transaction_mode для SQLite: {mode!r}')
+        kwargs = super().get_connection_params()
+        for option in OWN_OPTIONS:
+            kwargs.pop(option, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f'BEGIN {mode.upper()}')
@@ -0,0 +1,116 @@
+import csv
+import json
+import zlib
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from core.models import Product, ProductKey
+
+FORMATS = ('csv', 'jsonl')
+# Выгрузка отдается блоками не меньше этого размера, а не по строке.
+BLOCK_SIZE = 64 * 1024
+
+
+def _products():
+    return (
+        Product.objects
+        .order_by('pk')
+        .annotate(
+            used_keys=Count('keys', filter=Q(keys__is_deleted=True)),
+            unused_keys=Count('keys', filter=Q(keys__is_deleted=False)),
+        )
+    )
+
+
+def _keys():
+    return ProductKey.objects.order_by('pk')
+
+
+# Вид выгрузки: queryset и выгружаемые колонки (пути values_list).
+EXPORTS = {
+    'products': (_products, (
+        'id', 'title', 'slug', 'price', 'published', 'publish_date',
+        'company__id', 'company__name', 'used_keys', 'unused_keys',
+    )),
+    'keys': (_keys, (
+        'id', 'product__id', 'product__slug', 'product_key', 'is_deleted', 'reserved_at',
+    )),
+}
+
+
+def rows(kind, chunk_size=None):
+    '''
+    Строки выгрузки кортежами values_list. Queryset читается через iterator():
+    строки не кэшируются, а из базы берутся порциями по chunk_size (в Postgres —
+    через серверный курсор), поэтому память не зависит от размера таблицы.
+    За pgbouncer серверные курсоры отключены (DATABASE_PGBOUNCER), и драйвер
+    получает результат целиком.
+    '''
+    queryset, columns = EXPORTS[kind]
+    return queryset().values_list(*columns).iterator(chunk_size=chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE)
+
+
+def columns(kind):
+    return [column.replace('__', '_') for column in EXPORTS[kind][1]]
+
+
+class _Line:
+    """ Файлоподобный объект для csv.writer: возвращает записанную строку вместо записи """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, values):
+    writer = csv.writer(_Line())
+    yield writer.writerow(header)
+    for row in values:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(header, values):
+    for row in values:
+        yield json.dumps(dict(zip(header, row)), ensure_ascii=False, default=str) + '\n'
+
+
+def blocks(chunks, size=BLOCK_SIZE):
+    '''
+    Склеивает мелкие куски байтов в блоки не меньше size, чтобы не писать в
+    сокет или файл на каждую строку.
+    '''
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        if chunk:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= size:
+                yield b''.join(buffer)
+                buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_stream(chunks):
+    '''
+    Сжимает поток байтов в формат gzip по мере чтения, без промежуточного файла.
+    '''
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def export(kind, format='csv', compress=False, chunk_size=None):
+    '''
+    Итератор байтов выгрузки kind в формате CSV или JSONL, при compress — в
+    gzip. Подходит и для записи в файл, и для StreamingHttpResponse.
+    '''
+    lines = csv_lines if format == 'csv' else jsonl_lines
+    chunks = (line.encode() for line in lines(columns(kind), rows(kind, chunk_size)))
+    return blocks(gzip_stream(chunks) if compress else chunks)
+
+
+def filename(kind, format, compress):
+    return f'{kind}.{format}' + ('.gz' if compress else '')
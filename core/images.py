@@ -0,0 +1,151 @@
+import atexit
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from core.models import Product, User
+
+logger = logging.getLogger(__name__)
+
+# Расширение и формат Pillow для каждого выходного формата вариантов.
+FORMATS = {
+    'webp': ('webp', 'WEBP'),
+    'jpeg': ('jpg', 'JPEG'),
+}
+
+# Поля изображений, для которых создаются варианты.
+IMAGE_FIELDS = {
+    Product: 'photo',
+    User: 'avatar',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Пары (имя оригинала, формат), для которых варианты точно есть: они пересоздаются
+# под тем же именем и не исчезают, поэтому хранилище не спрашивается повторно.
+_generated = set()
+
+
+def variant_name(name, size, format):
+    '''
+    Имя файла варианта рядом с оригиналом:
+    product_images/x/photo.jpg -> product_images/x/photo.thumb.webp.
+    '''
+    root, _ = posixpath.splitext(name)
+    return f'{root}.{size}.{FORMATS[format][0]}'
+
+
+def variant_urls(field_file, format='webp'):
+    '''
+    Размеры и адреса вариантов изображения. Пока вариантов нет (изображение
+    загружено до их появления, создание еще не завершилось или не удалось),
+    для всех размеров отдается адрес оригинала без размеров.
+    '''
+    if not field_file:
+        return []
+    if not has_variants(field_file, format):
+        url = field_file.storage.url(field_file.name)
+        return [(size, None, None, url) for size in settings.IMAGE_VARIANTS]
+    return [
+        (size, width, height, field_file.storage.url(variant_name(field_file.name, size, format)))
+        for size, (width, height) in settings.IMAGE_VARIANTS.items()
+    ]
+
+
+def render_variants(image):
+    '''
+    Уменьшенные копии изображения во всех размерах и форматах: словарь
+    {(размер, формат): байты}. Ориентация из EXIF применяется к пикселям, а
+    сами метаданные (EXIF, в том числе геометки камеры) в варианты не попадают.
+    '''
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    if has_alpha:
+        # JPEG не поддерживает прозрачность: фон заливается белым.
+        opaque = Image.new('RGB', image.size, (255, 255, 255))
+        opaque.paste(image, mask=image.getchannel('A'))
+    else:
+        opaque = image
+
+    variants = {}
+    for size, box in settings.IMAGE_VARIANTS.items():
+        for format in settings.IMAGE_VARIANT_FORMATS:
+            source = image if format == 'webp' else opaque
+            resized = source.copy()
+            resized.thumbnail(box, Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, FORMATS[format][1], quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+            variants[size, format] = buffer.getvalue()
+    return variants
+
+
+def generate_variants(storage, name):
+    '''
+    Создает варианты изображения name в хранилище storage, перезаписывая
+    прежние. Возвращает число записанных файлов.
+    '''
+    with storage.open(name, 'rb') as file:
+        with Image.open(file) as image:
+            variants = render_variants(image)
+    for (size, format), content in variants.items():
+        path = variant_name(name, size, format)
+        if hasattr(storage, 'save_as'):
+            # Хранилище по содержимому (core.storage) иначе переименовало бы вариант по хэшу.
+            storage.save_as(path, ContentFile(content))
+            continue
+        if storage.exists(path):
+            storage.delete(path)
+        storage.save(path, ContentFile(content))
+    _generated.update((name, format) for format in settings.IMAGE_VARIANT_FORMATS)
+    return len(variants)
+
+
+def has_variants(field_file, format=None):
+    '''
+    Созданы ли варианты изображения в формате format (по умолчанию — в
+    последнем из IMAGE_VARIANT_FORMATS, который пишется последним).
+    '''
+    format = format or settings.IMAGE_VARIANT_FORMATS[-1]
+    if (field_file.name, format) in _generated:
+        return True
+    if format not in settings.IMAGE_VARIANT_FORMATS:
+        return False
+    last_size = list(settings.IMAGE_VARIANTS)[-1]
+    if not field_file.storage.exists(variant_name(field_file.name, last_size, format)):
+        return False
+    _generated.add((field_file.name, format))
+    return True
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images')
+            atexit.register(_executor.shutdown)
+        return _executor
+
+
+def schedule_variants(field_file):
+    '''
+    Ставит генерацию вариантов в пул потоков после фиксации транзакции, чтобы
+    ресайз не задерживал ответ на сохранение в админке или мутацию.
+    '''
+    storage, name = field_file.storage, field_file.name
+    transaction.on_commit(lambda: get_executor().submit(_generate_logged, storage, name))
+
+
+def _generate_logged(storage, name):
+    try:
+        generate_variants(storage, name)
+    except Exception:
+        logger.exception('Не удалось создать варианты изображения %s', name)
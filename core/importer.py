@@ -0,0 +1,395 @@
+import csv
+import gzip
+import io
+import json
+import uuid
+import zlib
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from languages_plus.models import Language
+
+from core import counters, response_cache
+from core.models import Company, OperatingSystem, Product, ProductKey, Tag
+from core.suggest import KINDS, suggest_index
+
+# Разделитель нескольких значений в одной ячейке CSV (теги, ОС, языки).
+LIST_SEPARATOR = '|'
+# Сколько ошибок строк хранится для отчета; остальные только считаются.
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'jsonl')
+
+
+class ImportFileError(Exception):
+    """ Файл импорта нельзя прочитать целиком (неизвестный формат, нет обязательных колонок) """
+
+
+class ImportStats:
+    """ Итоги импорта: прочитано строк, создано записей, пропущено дублей и ошибки по строкам """
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self):
+        return f'строк: {self.rows}, создано: {self.created}, пропущено: {self.skipped}, ошибок: {self.failed}'
+
+
+def detect_format(name):
+    '''
+    Формат файла по расширению: .csv или .jsonl/.ndjson, в том числе сжатые gzip (.csv.gz).
+    '''
+    name = name.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ImportFileError(f'Не удалось определить формат файла {name}: укажите csv или jsonl')
+
+
+def read_rows(file, format, compressed=False):
+    '''
+    Построчно читает бинарный файл и возвращает пары (номер строки, словарь
+    значений). Файл не загружается в память целиком, поэтому размер импорта
+    ограничен только диском. Ошибки чтения файла целиком (не UTF-8, битый
+    gzip, испорченный CSV) выбрасываются как ImportFileError.
+    '''
+    if format not in FORMATS:
+        raise ImportFileError(f'Неизвестный формат: {format}')
+    try:
+        yield from _read_rows(file, format, compressed)
+    except UnicodeDecodeError:
+        raise ImportFileError('Файл должен быть в кодировке UTF-8')
+    except (gzip.BadGzipFile, EOFError, zlib.error):
+        raise ImportFileError('Файл поврежден или не сжат gzip')
+
+
+def _read_rows(file, format, compressed):
+    if compressed:
+        file = gzip.GzipFile(fileobj=file)
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as error:
+            raise ImportFileError(f'Ошибка CSV в строке {reader.line_num}: {error}')
+    else:
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                yield line_num, error
+                continue
+            yield line_num, row if isinstance(row, dict) else ValueError('строка должна быть объектом JSON')
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class NameCache:
+    """
+    Соответствие названий первичным ключам для справочников (компании, теги,
+    ОС, языки). Неизвестные названия ищутся в базе одним запросом на пачку
+    строк и, если справочник это допускает, создаются пакетной вставкой.
+    """
+
+    def __init__(self, model, field='name', create=True):
+        self.model = model
+        self.field = field
+        self.create = create
+        self.created = []
+        self._ids = {}
+
+    def resolve(self, names):
+        missing = {name for name in names if name not in self._ids}
+        if missing:
+            self._fetch(missing)
+            missing -= self._ids.keys()
+            if missing and self.create:
+                self.model.objects.bulk_create(
+                    [self.model(**{self.field: name}) for name in missing], ignore_conflicts=True,
+                )
+                # ignore_conflicts не возвращает первичные ключи, поэтому они перечитываются.
+                self._fetch(missing)
+                created = [(self._ids[name], name) for name in missing if name in self._ids]
+                # Созданное в откаченной пачке не должно попасть в индекс подсказок (см. finish импортера).
+                transaction.on_commit(lambda: self.created.extend(created))
+
+    def get(self, name):
+        return self._ids.get(name)
+
+    def _fetch(self, names):
+        lookup = {f'{self.field}__in': names}
+        self._ids.update(self.model.objects.filter(**lookup).values_list(self.field, 'pk'))
+
+
+def _names(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    return [str(name).strip() for name in value if str(name).strip()]
+
+
+def _text(row, column):
+    value = row.get(column)
+    return '' if value is None else str(value).strip()
+
+
+def _published(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'да')
+
+
+class ProductImporter:
+    """
+    Импорт продуктов. Колонки: title, slug (по умолчанию из title), price,
+    description, meta_description, publish_date, published, company, tags,
+    operating_systems, languages (названия на английском; несколько значений в
+    CSV разделяются «|»). Недостающие компании, теги и ОС создаются, неизвестные
+    языки пропускаются. Продукты с уже занятым slug или названием пропускаются
+    вместе со своими связями.
+    """
+
+    required = ('title', 'price')
+
+    def __init__(self):
+        self.companies = NameCache(Company)
+        self.tags = NameCache(Tag)
+        self.operating_systems = NameCache(OperatingSystem)
+        self.languages = NameCache(Language, field='name_en', create=False)
+        self.links = {
+            'tags': (self.tags, Product.tags.through, 'tag_id'),
+            'operating_systems': (self.operating_systems, Product.operating_systems.through, 'operatingsystem_id'),
+            'languages': (self.languages, Product.languages.through, 'language_id'),
+        }
+
+    def parse(self, row):
+        title = _text(row, 'title')
+        slug = _text(row, 'slug') or slugify(title)
+        if not title or not slug:
+            raise ValueError('не указано название или slug')
+        try:
+            price = Decimal(_text(row, 'price'))
+        except InvalidOperation:
+            raise ValueError(f'неверная цена: {row.get("price")!r}')
+        publish_date = None
+        if _text(row, 'publish_date'):
+            publish_date = parse_datetime(_text(row, 'publish_date'))
+            if publish_date is None:
+                raise ValueError(f'неверная дата публикации: {row.get("publish_date")!r}')
+        product = Product(
+            title=title,
+            slug=slug,
+            price=price,
+            description=_text(row, 'description'),
+            meta_description=_text(row, 'meta_description'),
+            publish_date=publish_date,
+            published=_published(row.get('published')),
+        )
+        product.full_clean(exclude=['company', 'tags', 'operating_systems', 'languages'], validate_unique=False)
+        return product, _text(row, 'company'), {field: _names(row.get(field)) for field in self.links}
+
+    def import_chunk(self, parsed, stats):
+        parsed = [value for _, value in parsed]
+        self.companies.resolve({company for _, company, _ in parsed if company})
+        for field, (cache, _, _) in self.links.items():
+            cache.resolve({name for _, _, links in parsed for name in links[field]})
+
+        slugs = [product.slug for product, _, _ in parsed]
+        existing = set(Product.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+        new = {}
+        for product, company, links in parsed:
+            if product.slug in existing or product.slug in new:
+                stats.skipped += 1
+                continue
+            product.company_id = self.companies.get(company) if company else None
+            new[product.slug] = (product, links)
+        Product.objects.bulk_create([product for product, _ in new.values()], ignore_conflicts=True)
+        # Строки, вставка которых пропущена из-за занятого названия, сюда не попадут.
+        ids = dict(Product.objects.filter(slug__in=new).values_list('slug', 'pk'))
+        stats.created += len(ids)
+        stats.skipped += len(new) - len(ids)
+
+        for field, (cache, through, column) in self.links.items():
+            rows = {
+                (ids[slug], cache.get(name))
+                for slug, (_, links) in new.items() if slug in ids
+                for name in links[field] if cache.get(name) is not None
+            }
+            through.objects.bulk_create(
+                [through(product_id=product_id, **{column: target_id}) for product_id, target_id in rows],
+                ignore_conflicts=True,
+            )
+        published = [
+            (ids[slug], product.title, product.slug)
+            for slug, (product, _) in new.items() if slug in ids and product.published
+        ]
+
+        def index_published():
+            for pk, title, slug in published:
+                suggest_index.upsert(KINDS[Product], pk, title, slug)
+
+        # Индекс подсказок в памяти не откатывается вместе с пачкой: продукты попадают в него после фиксации.
+        transaction.on_commit(index_published)
+
+    def finish(self):
+        '''
+        Пакетные вставки не посылают сигналов, поэтому счетчики, индекс подсказок и
+        кэш ответов обновляются один раз в конце импорта.
+        '''
+        for field_name in counters.COUNTED_FIELDS:
+            counters.recount(Product._meta.get_field(field_name))
+        for cache in (self.companies, self.tags, self.operating_systems):
+            for pk, name in cache.created:
+                suggest_index.upsert(KINDS[cache.model], pk, name)
+        response_cache.bump_versions(Product, Company, Tag, OperatingSystem)
+
+
+class KeyImporter:
+    """
+    Импорт ключей активации. Колонки: product (slug продукта) и необязательный
+    product_key (UUID, по умолчанию генерируется). Уже загруженные ключи
+    пропускаются, поэтому повторный запуск того же файла безопасен.
+    """
+
+    required = ('product',)
+
+    def __init__(self):
+        self.products = NameCache(Product, field='slug', create=False)
+
+    def parse(self, row):
+        product = _text(row, 'product')
+        if not product:
+            raise ValueError('не указан продукт')
+        try:
+            key = uuid.UUID(_text(row, 'product_key')) if _text(row, 'product_key') else uuid.uuid4()
+        except ValueError:
+            raise ValueError(f'неверный ключ: {row.get("product_key")!r}')
+        return product, key
+
+    def import_chunk(self, parsed, stats):
+        self.products.resolve({product for _, (product, _) in parsed})
+        keys = {}
+        for line, (product, key) in parsed:
+            product_id = self.products.get(product)
+            if product_id is None:
+                stats.error(line, f'продукт не найден: {product}')
+            elif key in keys:
+                stats.skipped += 1
+            else:
+                keys[key] = ProductKey(product_id=product_id, product_key=key)
+        # Параллельный импорт ключей тех же продуктов ждет эту транзакцию (в SQLite
+        # транзакции и так идут по одной), поэтому ключи, найденные ниже, — точно наши.
+        list(
+            Product.objects.select_for_update()
+                .filter(pk__in={key.product_id for key in keys.values()})
+                .order_by('pk')
+                .values_list('pk', flat=True)
+        )
+        existing = set(ProductKey.objects.filter(product_key__in=keys).values_list('product_key', flat=True))
+        new = {value: key for value, key in keys.items() if value not in existing}
+        ProductKey.objects.bulk_create(new.values(), ignore_conflicts=True)
+        # Строки, вставка которых пропущена из-за конфликта, сюда не попадут; ключ,
+        # занятый другим продуктом, отсеивается сравнением продукта.
+        inserted = [
+            product_id
+            for value, product_id in ProductKey.objects.filter(product_key__in=new).values_list('product_key', 'product_id')
+            if new[value].product_id == product_id
+        ]
+        stats.created += len(inserted)
+        stats.skipped += len(keys) - len(inserted)
+        # bulk_create не посылает сигналов: остатки продуктов сдвигаются в той же транзакции.
+        counters.adjust_available_keys(Counter(inserted))
+
+    def finish(self):
+        pass
+
+
+IMPORTERS = {
+    'products': ProductImporter,
+    'keys': KeyImporter,
+}
+
+
+def import_rows(kind, rows, batch_size=None, progress=None):
+    '''
+    Импортирует строки (пары номер строки, словарь) пачками по batch_size
+    (по умолчанию CATALOG_IMPORT_BATCH_SIZE). Каждая пачка вставляется в своей
+    транзакции, поэтому память не растет с размером файла, а прерванный импорт
+    можно просто запустить заново: загруженное пропускается. После каждой
+    пачки вызывается progress(stats). Строки с ошибками пропускаются и
+    попадают в отчет.
+    '''
+    importer = IMPORTERS[kind]()
+    stats = ImportStats()
+    try:
+        for chunk in chunked(rows, batch_size or settings.CATALOG_IMPORT_BATCH_SIZE):
+            parsed = []
+            for line, row in chunk:
+                stats.rows += 1
+                if isinstance(row, Exception):
+                    stats.error(line, str(row))
+                    continue
+                missing = [column for column in importer.required if not _text(row, column)]
+                if missing:
+                    stats.error(line, f'не заполнены колонки: {", ".join(missing)}')
+                    continue
+                try:
+                    parsed.append((line, importer.parse(row)))
+                except (ValueError, ValidationError) as error:
+                    stats.error(line, '; '.join(getattr(error, 'messages', None) or [str(error)]))
+            if parsed:
+                with transaction.atomic():
+                    importer.import_chunk(parsed, stats)
+            if progress is not None:
+                progress(stats)
+    finally:
+        # Уже загруженные пачки зафиксированы, даже если файл оборвался посередине.
+        importer.finish()
+    return stats
+
+
+def import_file(file, kind, format=None, name='', batch_size=None, progress=None):
+    '''
+    Импортирует бинарный файл CSV или JSONL (формат по умолчанию определяется
+    по имени файла, .gz распаковывается на лету).
+    '''
+    if kind not in IMPORTERS:
+        raise ImportFileError(f'Неизвестный вид данных: {kind}')
+    return import_rows(
+        kind,
+        read_rows(file, format or detect_format(name), compressed=name.lower().endswith('.gz')),
+        batch_size=batch_size,
+        progress=progress,
+    )
@@ -0,0 +1,29 @@
+from django.db import models
+from django.db.models import OrderBy
+
+
+class OrderedIndex(models.Index):
+    '''
+    Индекс по выражениям с направлением и положением NULL, как в ORDER BY
+    каталога (core.pagination): F('publish_date').desc(nulls_last=True).
+
+    Postgres без NULLS LAST в индексе не сможет прочитать его в порядке
+    ORDER BY ... DESC NULLS LAST и отсортирует строки сам. SQLite не допускает
+    NULLS FIRST/LAST в CREATE INDEX, но там NULL меньше любых значений, поэтому
+    при DESC и так идут в конце: для него модификатор отбрасывается.
+    '''
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'sqlite' and self.expressions:
+            index = self.clone()
+            index.expressions = tuple(_without_nulls(expression) for expression in self.expressions)
+            return models.Index.create_sql(index, model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
+def _without_nulls(expression):
+    if not isinstance(expression, OrderBy):
+        return expression
+    expression = expression.copy()
+    expression.nulls_first = expression.nulls_last = None
+    return expression
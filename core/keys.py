@@ -0,0 +1,322 @@
+import atexit
+import threading
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from core.counters import adjust_available_keys
+from core.models import ProductKey
+
+
+class KeyAllocationError(Exception):
+    """ Для одного или нескольких продуктов заказа не нашлось свободных ключей """
+
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f'Нет свободных ключей для продуктов: {", ".join(map(str, self.product_ids))}')
+
+
+def claim_keys(product_ids):
+    '''
+    Атомарно выдает по одному свободному ключу на каждый продукт заказа.
+
+    Сначала ключи берутся из пула процесса (если он включен), остальные
+    продукты добираются из базы. Все ключи помечаются использованными
+    фиксированным числом запросов, не зависящим от размера заказа. Если хотя бы
+    для одного продукта ключ не найден, транзакция откатывается и выбрасывается
+    KeyAllocationError. Возвращает список ключей с подгруженными продуктами.
+    '''
+    product_ids = {int(product_id) for product_id in product_ids}
+    if not product_ids:
+        return []
+
+    pool = get_key_pool()
+    pooled = {}
+    try:
+        with transaction.atomic():
+            key_ids = []
+            product_ids_left = product_ids
+            if pool is not None:
+                pooled = pool.take(product_ids)
+                if pooled and _claim_pooled(pooled):
+                    key_ids.extend(pooled.values())
+                    product_ids_left = product_ids - pooled.keys()
+                elif pooled:
+                    # Часть ключей пула уже продана в обход него; остальные по-прежнему
+                    # зарезервированы за процессом и без возврата в пул пролежали бы до истечения резерва.
+                    pool.put_back(_still_free(pooled))
+                    pooled = {}
+
+            if product_ids_left:
+                claim = _claim_skip_locked if connection.vendor == 'postgresql' else _claim_optimistic
+                claimed = claim(product_ids_left)
+                reserved_only = product_ids_left - claimed.keys()
+                if reserved_only:
+                    # Незарезервированных ключей не осталось: продаем зарезервированные
+                    # пулами (в том числе других и аварийно завершившихся процессов),
+                    # иначе продукт выглядел бы распроданным при ключах на складе.
+                    claimed.update(claim(reserved_only, reserved=True))
+                key_ids.extend(claimed.values())
+
+            keys = list(ProductKey.objects.select_related('product').filter(id__in=key_ids))
+            missing = product_ids - {key.product_id for key in keys}
+            if missing:
+                raise KeyAllocationError(missing)
+            adjust_available_keys({product_id: -1 for product_id in product_ids})
+    except Exception:
+        # Транзакция откатилась, ключи из пула снова свободны и зарезервированы за нами.
+        if pooled:
+            pool.put_back(pooled)
+        raise
+    return keys
+
+
+def _claim_pooled(pooled):
+    '''
+    Помечает использованными ключи, выданные пулом. Если какой-то из них уже
+    успели пометить в обход пула, точка сохранения откатывается, и весь заказ
+    добирается из базы.
+    '''
+    try:
+        with transaction.atomic():
+            updated = ProductKey.objects.filter(id__in=pooled.values(), is_deleted=False).update(
+                is_deleted=True, reserved_at=None,
+            )
+            if updated != len(pooled):
+                raise _ClaimConflict
+    except _ClaimConflict:
+        return False
+    return True
+
+
+def _still_free(pooled):
+    free = set(ProductKey.objects.filter(id__in=pooled.values(), is_deleted=False).values_list('id', flat=True))
+    return {product_id: key_id for product_id, key_id in pooled.items() if key_id in free}
+
+
+def _claim_skip_locked(product_ids, reserved=False):
+    '''
+    Postgres: один UPDATE ... RETURNING, в котором для каждого продукта берется
+    первый свободный ключ через FOR UPDATE SKIP LOCKED. Строки, уже захваченные
+    параллельными заказами, пропускаются, а не ожидаются. При reserved берутся
+    только ключи, зарезервированные пулами, иначе — только незарезервированные.
+    Возвращает словарь {id продукта: id ключа}.
+    '''
+    table = connection.ops.quote_name(ProductKey._meta.db_table)
+    reservation = 'IS NOT NULL' if reserved else 'IS NULL'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            UPDATE {table} SET is_deleted = TRUE, reserved_at = NULL
+            WHERE id IN (
+                SELECT free.id FROM unnest(%s::integer[]) AS ordered(product_id)
+                CROSS JOIN LATERAL (
+                    SELECT k.id FROM {table} k
+                    WHERE k.product_id = ordered.product_id AND NOT k.is_deleted AND k.reserved_at {reservation}
+                    ORDER BY k.id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                ) free
+            )
+            RETURNING product_id, id
+            ''',
+            [sorted(product_ids)],
+        )
+        return dict(cursor.fetchall())
+
+
+def _claim_optimistic(product_ids, reserved=False, attempts=3):
+    '''
+    SQLite и прочие базы без SKIP LOCKED: выбираем кандидатов одним запросом и
+    помечаем их одним UPDATE с условием is_deleted=False. reserved и результат —
+    как у _claim_skip_locked.
+
+    В SQLite гонки здесь нет: транзакция начинается с BEGIN IMMEDIATE
+    (core.db.backends.sqlite3) и держит блокировку на запись всей базы еще до
+    выбора кандидатов, так что параллельный заказ ждет ее завершения. Со
+    стандартным бэкендом SQLite конфликт проявился бы не здесь, а ошибкой
+    «database is locked» на UPDATE. Проверка числа обновленных строк с
+    повтором нужна базам с блокировкой строк (MySQL), где параллельный заказ
+    может забрать кандидата между SELECT и UPDATE: тогда точка сохранения
+    откатывается, и выбор повторяется.
+    '''
+    for _ in range(attempts):
+        try:
+            with transaction.atomic():
+                candidates = dict(
+                    ProductKey.objects.filter(
+                        product_id__in=product_ids, is_deleted=False, reserved_at__isnull=not reserved,
+                    )
+                        .order_by()
+                        .values('product_id')
+                        .annotate(key_id=Min('id'))
+                        .values_list('product_id', 'key_id')
+                )
+                updated = ProductKey.objects.filter(id__in=candidates.values(), is_deleted=False).update(
+                    is_deleted=True, reserved_at=None,
+                )
+                if updated != len(candidates):
+                    raise _ClaimConflict
+                return candidates
+        except _ClaimConflict:
+            continue
+    return {}
+
+
+def _reserve_block(product_id, size, attempts=3):
+    '''
+    Резервирует до size свободных ключей продукта за процессом: проставляет
+    reserved_at, после чего выдача из базы берет эти ключи, только когда
+    незарезервированных не осталось.
+    '''
+    now = timezone.now()
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(ProductKey._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                UPDATE {table} SET reserved_at = %s
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE product_id = %s AND NOT is_deleted AND reserved_at IS NULL
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+                ''',
+                [now, product_id, size],
+            )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    for _ in range(attempts):
+        try:
+            with transaction.atomic():
+                candidates = list(
+                    ProductKey.objects.filter(product_id=product_id, is_deleted=False, reserved_at__isnull=True)
+                        .order_by('id')
+                        .values_list('id', flat=True)[:size]
+                )
+                updated = ProductKey.objects.filter(
+                    id__in=candidates, is_deleted=False, reserved_at__isnull=True,
+                ).update(reserved_at=now)
+                if updated != len(candidates):
+                    raise _ClaimConflict
+                return candidates
+        except _ClaimConflict:
+            continue
+    return []
+
+
+def release_stale_reservations(max_age=None):
+    '''
+    Возвращает в продажу ключи, зарезервированные дольше max_age (по умолчанию
+    KEY_POOL_RESERVATION_TTL секунд) — например, пулами аварийно завершившихся
+    процессов. Возвращает количество освобожденных ключей.
+    '''
+    if max_age is None:
+        max_age = timedelta(seconds=settings.KEY_POOL_RESERVATION_TTL)
+    return ProductKey.objects.filter(
+        is_deleted=False, reserved_at__lt=timezone.now() - max_age,
+    ).update(reserved_at=None)
+
+
+class _ClaimConflict(Exception):
+    pass
+
+
+class KeyPool:
+    """
+    Пул заранее зарезервированных ключей в памяти процесса.
+
+    Ключи резервируются блоками по block_size на продукт. Когда в пуле продукта
+    остается меньше low_water ключей, фоновый поток резервирует следующий блок,
+    поэтому выдача ключа на горячих продуктах не ждет поиска по таблице ключей.
+    """
+
+    def __init__(self, block_size, low_water):
+        self.block_size = block_size
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        self._keys = defaultdict(deque)
+        self._refilling = set()
+
+    def take(self, product_ids):
+        '''
+        Забирает из пула по ключу на каждый продукт, для которого он есть.
+        Возвращает словарь {id продукта: id ключа}.
+        '''
+        taken = {}
+        with self._lock:
+            for product_id in product_ids:
+                keys = self._keys[product_id]
+                if keys:
+                    taken[product_id] = keys.popleft()
+                if len(keys) < self.low_water and product_id not in self._refilling:
+                    self._refilling.add(product_id)
+                    threading.Thread(target=self._refill, args=(product_id,), daemon=True).start()
+        return taken
+
+    def put_back(self, taken):
+        '''
+        Возвращает в пул ключи, выданные take(), если заказ не состоялся.
+        '''
+        with self._lock:
+            for product_id, key_id in taken.items():
+                self._keys[product_id].appendleft(key_id)
+
+    def size(self, product_id):
+        with self._lock:
+            return len(self._keys[product_id])
+
+    def refill(self, product_id):
+        '''
+        Синхронно резервирует блок ключей продукта и добавляет его в пул.
+        '''
+        key_ids = _reserve_block(product_id, self.block_size)
+        with self._lock:
+            self._keys[product_id].extend(key_ids)
+        return len(key_ids)
+
+    def release(self):
+        '''
+        Возвращает в продажу все ключи, которые пул зарезервировал, но не выдал.
+        '''
+        with self._lock:
+            key_ids = [key_id for keys in self._keys.values() for key_id in keys]
+            self._keys.clear()
+        if not key_ids:
+            return 0
+        return ProductKey.objects.filter(id__in=key_ids, is_deleted=False).update(reserved_at=None)
+
+    def _refill(self, product_id):
+        try:
+            self.refill(product_id)
+        finally:
+            with self._lock:
+                self._refilling.discard(product_id)
+            connection.close()
+
+
+_key_pool = None
+_key_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    '''
+    Возвращает пул ключей процесса или None, если KEY_POOL_ENABLED выключен.
+    При первом обращении регистрирует возврат нераспроданных ключей на выходе.
+    '''
+    global _key_pool
+    if not settings.KEY_POOL_ENABLED:
+        return None
+    if _key_pool is None:
+        with _key_pool_lock:
+            if _key_pool is None:
+                _key_pool = KeyPool(settings.KEY_POOL_BLOCK_SIZE, settings.KEY_POOL_LOW_WATER)
+                atexit.register(_key_pool.release)
+    return _key_pool
@@ -0,0 +1,165 @@
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+class ObjectLoader(DataLoader):
+    """ Загружает объекты модели по первичному ключу одним запросом pk IN (...) """
+
+    def __init__(self, model):
+        self.model = model
+        super().__init__()
+
+    def batch_load_fn(self, keys):
+        return _resolve(self._load, keys)
+
+    def _load(self, keys):
+        objects = self.model._default_manager.in_bulk(keys)
+        return [objects.get(key) for key in keys]
+
+
+class ReverseForeignKeyLoader(DataLoader):
+    """ Загружает объекты, ссылающиеся по ForeignKey на переданные ключи (например, product.keys) """
+
+    def __init__(self, field):
+        self.field = field
+        super().__init__()
+
+    def batch_load_fn(self, keys):
+        return _resolve(self._load, keys)
+
+    def _load(self, keys):
+        model = self.field.model
+        grouped = defaultdict(list)
+        queryset = model._default_manager.filter(**{f'{self.field.name}__in': keys})
+        for obj in queryset:
+            grouped[getattr(obj, self.field.attname)].append(obj)
+        return [grouped[key] for key in keys]
+
+
+class ManyToManyLoader(DataLoader):
+    """
+    Загружает связанные объекты ManyToManyField одним запросом к промежуточной
+    таблице с JOIN на связанную модель. Работает в обе стороны связи.
+    """
+
+    def __init__(self, field, reverse=False):
+        through = field.remote_field.through
+        self.through = through
+        if reverse:
+            self.source, self.target = field.m2m_reverse_field_name(), field.m2m_field_name()
+        else:
+            self.source, self.target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        self.target_model = through._meta.get_field(self.target).related_model
+        super().__init__()
+
+    def batch_load_fn(self, keys):
+        return _resolve(self._load, keys)
+
+    def _load(self, keys):
+        grouped = defaultdict(list)
+        ordering = [_prefixed(self.target, field) for field in self.target_model._meta.ordering]
+        queryset = (
+            self.through._default_manager.filter(**{f'{self.source}__in': keys})
+                .select_related(self.target)
+                .order_by(*ordering or [f'{self.target}__pk'])
+        )
+        for row in queryset:
+            grouped[getattr(row, f'{self.source}_id')].append(getattr(row, self.target))
+        return [grouped[key] for key in keys]
+
+
+def _resolve(load, keys):
+    '''
+    Выполняет пакетную загрузку. В цикле событий асинхронного представления
+    запрос к базе уходит в поток (sync_to_async), а DataLoader получает Promise,
+    который завершится вместе с ним.
+    '''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return Promise.resolve(load(keys))
+    return Promise.resolve(asyncio.ensure_future(sync_to_async(load)(keys)))
+
+
+class Loaders:
+    """
+    Реестр DataLoader'ов одного запроса. Создается лениво и хранится в
+    контексте запроса, поэтому кэш загрузчиков не переживает запрос.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+
+    def for_field(self, field):
+        if field not in self._loaders:
+            self._loaders[field] = self._create(field)
+        return self._loaders[field]
+
+    @staticmethod
+    def _create(field):
+        if field.many_to_many:
+            if field.concrete:
+                return ManyToManyLoader(field)
+            return ManyToManyLoader(field.remote_field, reverse=True)
+        if field.one_to_many:
+            return ReverseForeignKeyLoader(field.remote_field)
+        return ObjectLoader(field.related_model)
+
+
+def get_loaders(info):
+    '''
+    Возвращает реестр загрузчиков текущего запроса (info.context).
+    '''
+    context = info.context
+    if context is None:
+        return Loaders()
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
+
+
+def load_related(root, info, field_name):
+    '''
+    Разрешает связь field_name объекта root через DataLoader запроса.
+
+    Все объекты, запросившие одну и ту же связь в рамках запроса, получают
+    данные одним запросом IN (...). Если связь уже подгружена через
+    select_related/prefetch_related, база не трогается вовсе.
+    '''
+    field = root._meta.get_field(field_name)
+    if field.many_to_one or (field.one_to_one and field.concrete):
+        if field.is_cached(root):
+            return getattr(root, field.name)
+        pk = getattr(root, field.attname)
+        if pk is None:
+            return None
+        return get_loaders(info).for_field(field).load(pk)
+
+    accessor = field.name if field.concrete else field.get_accessor_name()
+    prefetched = getattr(root, '_prefetched_objects_cache', {})
+    cache_name = _prefetch_cache_name(getattr(root, accessor))
+    if cache_name in prefetched:
+        return list(prefetched[cache_name])
+    return get_loaders(info).for_field(field).load(root.pk)
+
+
+def _prefetch_cache_name(manager):
+    cache_name = getattr(manager, 'prefetch_cache_name', None)
+    if cache_name is None:
+        # Менеджер обратной связи ForeignKey хранит префетч под именем аксессора.
+        cache_name = manager.field.remote_field.get_cache_name()
+    return cache_name
+
+
+def _prefixed(prefix, ordering):
+    if hasattr(ordering, 'resolve_expression'):
+        return ordering
+    if ordering.startswith('-'):
+        return f'-{prefix}__{ordering[1:]}'
+    return f'{prefix}__{ordering}'
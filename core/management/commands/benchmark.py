@@ -0,0 +1,266 @@
+import io
+import json
+import random
+import statistics
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from languages_plus.models import Language
+
+from core.models import Company, OperatingSystem, Product, ProductKey, Tag
+
+WORDS = (
+    'office', 'studio', 'antivirus', 'photo', 'video', 'editor', 'cloud', 'backup', 'server', 'player',
+    'офис', 'редактор', 'антивирус', 'облако', 'архив', 'браузер', 'видео', 'фото', 'музыка', 'игра',
+)
+
+SCENARIOS = {
+    'allProducts': '''
+        query AllProducts($tag: ID) {
+            allProducts(tag: $tag, first: 20) {
+                edges { cursor node { title slug price company { name } tags { name } } }
+                pageInfo { hasNextPage }
+            }
+        }
+    ''',
+    'productsSearch': '''
+        query Search($query: String) {
+            productsSearch(query: $query, first: 20) { edges { node { title slug price } } }
+        }
+    ''',
+    'productBySlug': '''
+        query Product($slug: String) {
+            productBySlug(slug: $slug) {
+                title description price company { name } tags { name } operatingSystems { name } languages { nameEn }
+            }
+        }
+    ''',
+    'tagsWithCountOfProducts': '''
+        query Sidebar { tagsWithCountOfProducts { name countProducts } }
+    ''',
+    'orderPayment': '''
+        query Order($email: String, $ids: [ID]) { orderPayment(email: $email, ids: $ids) }
+    ''',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест API GraphQL: создает временную базу с синтетическим каталогом, '
+        'прогоняет типовые запросы через тестовый клиент Django с заданной параллельностью '
+        'и выводит JSON с пропускной способностью, перцентилями задержки и числом SQL-запросов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='Число продуктов')
+        parser.add_argument('--keys-per-product', type=int, default=5, help='Ключей на продукт')
+        parser.add_argument('--tags', type=int, default=50, help='Число тегов')
+        parser.add_argument('--oses', type=int, default=5, help='Число операционных систем')
+        parser.add_argument('--languages', type=int, default=10, help='Число языков')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--concurrency', type=int, default=4, help='Параллельных клиентов')
+        parser.add_argument(
+            '--scenario', action='append', choices=sorted(SCENARIOS), dest='scenarios',
+            help='Сценарий (можно указать несколько раз), по умолчанию все',
+        )
+        parser.add_argument('--no-response-cache', action='store_true', help='Отключить кэш ответов GraphQL')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency и --requests должны быть положительными')
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor == 'sqlite':
+            # База в памяти не переживает несколько потоков с записью, нужен файл.
+            connection.settings_dict['TEST']['NAME'] = str(settings.BASE_DIR / 'benchmark.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            overrides = {}
+            if options['no_response_cache']:
+                overrides['CACHES'] = {
+                    **settings.CACHES,
+                    settings.GRAPHQL_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                }
+            with override_settings(**overrides):
+                report = self.run_benchmark(connection, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_benchmark(self, connection, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        catalogue = self.seed(rng, options)
+        report = {
+            'database': connection.vendor,
+            'options': {
+                name: options[name] for name in (
+                    'products', 'keys_per_product', 'tags', 'oses', 'languages',
+                    'requests', 'concurrency', 'no_response_cache', 'seed',
+                )
+            },
+            'seed_seconds': round(time.perf_counter() - started, 3),
+            'scenarios': {},
+        }
+        for name in options['scenarios'] or SCENARIOS:
+            report['scenarios'][name] = self.run_scenario(name, catalogue, rng, options)
+        return report
+
+    def seed(self, rng, options):
+        '''
+        Заполняет временную базу синтетическим каталогом пакетными вставками.
+        Сигналы при этом не срабатывают, поэтому счетчики пересчитываются командой recount.
+        '''
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        languages = Language.objects.bulk_create([
+            Language(
+                iso_639_1=letters[i // 26] + letters[i % 26],
+                iso_639_2T=f'{letters[i // 26]}{letters[i % 26]}t',
+                iso_639_2B=f'{letters[i // 26]}{letters[i % 26]}b',
+                name_en=f'Language {i}',
+                name_native=f'Язык {i}',
+                family='Synthetic',
+            )
+            for i in range(min(options['languages'], 26 * 26))
+        ])
+        tags = Tag.objects.bulk_create([Tag(name=f'tag-{i}') for i in range(options['tags'])])
+        oses = OperatingSystem.objects.bulk_create([OperatingSystem(name=f'os-{i}') for i in range(options['oses'])])
+        companies = Company.objects.bulk_create([
+            Company(name=f'company-{i}') for i in range(max(1, options['products'] // 20))
+        ])
+
+        now = timezone.now()
+        products = Product.objects.bulk_create([
+            Product(
+                title=f'{" ".join(rng.sample(WORDS, 2)).capitalize()} {i}',
+                slug=f'product-{i}',
+                description=' '.join(rng.choices(WORDS, k=30)),
+                price=Decimal(rng.randint(100, 999999)) / 100,
+                publish_date=now - timedelta(minutes=i),
+                company=rng.choice(companies),
+            )
+            for i in range(options['products'])
+        ], batch_size=500)
+
+        through_rows = {
+            Product.tags.through: ('tag_id', tags, 3),
+            Product.operating_systems.through: ('operatingsystem_id', oses, 2),
+            Product.languages.through: ('language_id', languages, 2),
+        }
+        for through, (column, targets, per_product) in through_rows.items():
+            through.objects.bulk_create([
+                through(product_id=product.pk, **{column: target.pk})
+                for product in products
+                for target in rng.sample(targets, min(per_product, len(targets)))
+            ], batch_size=1000)
+        ProductKey.objects.bulk_create([
+            ProductKey(product=product) for product in products for _ in range(options['keys_per_product'])
+        ], batch_size=1000)
+        call_command('recount', stdout=io.StringIO())
+        return {'products': products, 'tags': tags}
+
+    def variables(self, name, catalogue, rng):
+        if name == 'allProducts':
+            return {'tag': rng.choice(catalogue['tags']).pk if catalogue['tags'] and rng.random() < 0.5 else None}
+        if name == 'productsSearch':
+            return {'query': rng.choice(WORDS)}
+        if name == 'productBySlug':
+            return {'slug': rng.choice(catalogue['products']).slug}
+        if name == 'orderPayment':
+            products = rng.sample(catalogue['products'], min(rng.randint(1, 3), len(catalogue['products'])))
+            return {'email': 'benchmark@example.com', 'ids': [product.pk for product in products]}
+        return {}
+
+    def run_scenario(self, name, catalogue, rng, options):
+        concurrency = options['concurrency']
+        total = options['requests']
+        plans = [
+            [self.variables(name, catalogue, rng) for _ in range(total // concurrency + (worker < total % concurrency))]
+            for worker in range(concurrency)
+        ]
+        results = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(concurrency + 1)
+
+        def worker(plan):
+            client = Client()
+            samples = []
+            queries = [0]
+
+            def count(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            barrier.wait()
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(count))
+                    for variables in plan:
+                        queries[0] = 0
+                        start = time.perf_counter()
+                        response = client.post(
+                            '/graphql',
+                            json.dumps({'query': SCENARIOS[name], 'variables': variables}),
+                            content_type='application/json',
+                        )
+                        elapsed = time.perf_counter() - start
+                        ok = (
+                            response.status_code == 200
+                            and response['Content-Type'].startswith('application/json')
+                            and 'errors' not in response.json()
+                        )
+                        samples.append((elapsed, queries[0], ok))
+            finally:
+                connections.close_all()
+                with lock:
+                    results.extend(samples)
+
+        threads = [threading.Thread(target=worker, args=(plan,)) for plan in plans]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(sample[0] * 1000 for sample in results)
+        return {
+            'requests': len(results),
+            'errors': sum(1 for sample in results if not sample[2]),
+            'throughput_rps': round(len(results) / elapsed, 2) if elapsed else None,
+            'mean_ms': round(statistics.fmean(latencies), 3) if latencies else None,
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'p99_ms': _percentile(latencies, 99),
+            'queries_per_request': round(statistics.fmean(sample[1] for sample in results), 2) if results else None,
+        }
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return round(values[index], 3)
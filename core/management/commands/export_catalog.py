@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exporter import EXPORTS, FORMATS, export
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково выгружает каталог (продукты с компанией и числом использованных и свободных '
+        'ключей) или все ключи активации в CSV/JSONL, при --gzip сжимая на лету. '
+        'Память не зависит от размера выгрузки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help='Что выгружать')
+        parser.add_argument('--format', choices=FORMATS, default='csv', help='Формат выгрузки')
+        parser.add_argument('--gzip', action='store_true', help='Сжать выгрузку gzip')
+        parser.add_argument('--chunk-size', type=int, help='Строк, читаемых из базы за раз')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным')
+        chunks = export(options['kind'], options['format'], options['gzip'], options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        written = 0
+        with open(options['output'], 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Выгружено в {options["output"]}: {written} байт'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from core.images import IMAGE_FIELDS, generate_variants, has_variants
+
+
+class Command(BaseCommand):
+    help = 'Создает варианты (уменьшенные копии WebP/JPEG) уже загруженных фото продуктов и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать и существующие варианты')
+
+    def handle(self, *args, **options):
+        created = failed = 0
+        for model, field_name in IMAGE_FIELDS.items():
+            names = (
+                model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True).distinct().iterator()
+            )
+            field = model._meta.get_field(field_name)
+            for name in names:
+                field_file = field.attr_class(None, field, name)
+                if not options['force'] and has_variants(field_file):
+                    continue
+                try:
+                    generate_variants(field_file.storage, name)
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                else:
+                    created += 1
+                    self.stdout.write(name)
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {created}, с ошибками: {failed}'))
@@ -0,0 +1,61 @@
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import FORMATS, IMPORTERS, ImportFileError, import_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково импортирует продукты или ключи активации из файлов CSV/JSONL (в том числе .gz). '
+        'Строки вставляются пачками в отдельных транзакциях, уже загруженные записи пропускаются, '
+        'поэтому прерванный импорт можно запустить повторно. Путь «-» читает stdin.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='Что импортировать')
+        parser.add_argument('paths', nargs='+', help='Файлы для импорта')
+        parser.add_argument('--format', choices=FORMATS, help='Формат файлов (по умолчанию по расширению)')
+        parser.add_argument('--batch-size', type=int, help='Строк в одной пачке')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        if '-' in options['paths'] and not options['format']:
+            raise CommandError('Для stdin укажите --format')
+
+        failed = 0
+        for path in options['paths']:
+            self.stdout.write(f'{path}:')
+            try:
+                if path == '-':
+                    stats = self.import_from(sys.stdin.buffer, path, options)
+                else:
+                    if not Path(path).is_file():
+                        raise CommandError(f'Файл не найден: {path}')
+                    with open(path, 'rb') as file:
+                        stats = self.import_from(file, path, options)
+            except ImportFileError as error:
+                raise CommandError(f'{path}: {error}')
+            for line, message in stats.errors:
+                self.stderr.write(f'  строка {line}: {message}')
+            if stats.failed > len(stats.errors):
+                self.stderr.write(f'  ... и еще ошибок: {stats.failed - len(stats.errors)}')
+            self.stdout.write(f'  {stats}')
+            failed += stats.failed
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Импорт завершен, строк с ошибками: {failed}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Импорт завершен'))
+
+    def import_from(self, file, path, options):
+        return import_file(
+            file,
+            options['kind'],
+            format=options['format'],
+            name=path,
+            batch_size=options['batch_size'],
+            progress=lambda stats: self.stdout.write(f'  {stats}', ending='\r' if self.stdout.isatty() else '\n'),
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.search import install_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Пересоздает поисковый индекс каталога (FTS5 в SQLite, search_vector в Postgres)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        with transaction.atomic(using=options['database']):
+            install_search_index(connection)
+            rebuild_search_index(connection)
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс пересоздан'))
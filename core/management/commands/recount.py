@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from core.counters import COUNTED_FIELDS, recount, recount_available_keys
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики опубликованных продуктов у тегов и ОС и остатки ключей продуктов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            for field_name in COUNTED_FIELDS:
+                field = Product._meta.get_field(field_name)
+                updated = recount(field, using=options['database'])
+                self.stdout.write(f'{field.related_model._meta.verbose_name_plural}: {updated}')
+            updated = recount_available_keys(using=options['database'])
+            self.stdout.write(f'{Product._meta.verbose_name_plural} (остатки ключей): {updated}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.persisted import register
+from core.schema import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Регистрирует известные операции витрины как persisted queries. Принимает файлы '
+        '.graphql/.gql или каталоги с ними; хэш считается по тексту файла как есть, поэтому '
+        'клиент должен отправлять тот же текст.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файлы или каталоги с запросами')
+
+    def handle(self, *args, **options):
+        files = []
+        for path in map(Path, options['paths']):
+            if path.is_dir():
+                files.extend(sorted(file for file in path.rglob('*') if file.suffix in ('.graphql', '.gql')))
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError(f'Файл не найден: {path}')
+
+        with transaction.atomic():
+            for file in files:
+                try:
+                    sha256 = register(file.read_text(encoding='utf-8'), schema=schema)
+                except ValueError as error:
+                    raise CommandError(f'{file}: {error}')
+                self.stdout.write(f'{sha256}  {file}')
+        self.stdout.write(self.style.SUCCESS(f'Зарегистрировано запросов: {len(files)}'))
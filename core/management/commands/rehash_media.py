@@ -0,0 +1,52 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import response_cache
+from core.images import IMAGE_FIELDS, generate_variants, has_variants
+from core.storage import parse_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит загруженные ранее фото и аватары в хранилище по содержимому (core.storage): '
+        'файлы сохраняются под хэшем, одинаковые схлопываются, ссылки в базе обновляются. '
+        'Старые файлы не удаляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет перенесено')
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, 'save_as'):
+            self.stderr.write('Хранилище по умолчанию не адресуется по содержимому, переносить некуда')
+            return
+        moved = set()
+        for model, field_name in IMAGE_FIELDS.items():
+            names = (
+                model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True).distinct()
+            )
+            upload_to = model._meta.get_field(field_name).upload_to
+            for name in list(names):
+                if parse_name(name) is not None:
+                    continue
+                if not default_storage.exists(name):
+                    self.stderr.write(f'{name}: файл не найден')
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                    continue
+                with default_storage.open(name, 'rb') as file:
+                    new_name = default_storage.save(upload_to + name.rsplit('/', 1)[-1], file)
+                with transaction.atomic():
+                    # update() без сигналов: изменилось только имя файла, не содержимое.
+                    model._default_manager.filter(**{field_name: name}).update(**{field_name: new_name})
+                field_file = getattr(model(**{field_name: new_name}), field_name)
+                if not has_variants(field_file):
+                    generate_variants(default_storage, new_name)
+                moved.add(new_name)
+                self.stdout.write(f'{name} -> {new_name}')
+        if moved:
+            response_cache.bump_versions(*IMAGE_FIELDS)
+        self.stdout.write(self.style.SUCCESS(f'Перенесено файлов: {len(moved)}'))
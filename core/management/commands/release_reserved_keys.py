@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.keys import release_stale_reservations
+
+
+class Command(BaseCommand):
+    help = 'Возвращает в продажу ключи, зарезервированные пулами процессов, но так и не проданные'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=settings.KEY_POOL_RESERVATION_TTL,
+            help='Освобождать резервы старше указанного числа секунд',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Освободить все резервы (запускать, когда все воркеры остановлены)',
+        )
+
+    def handle(self, *args, **options):
+        max_age = timedelta(0) if options['all'] else timedelta(seconds=options['max_age'])
+        released = release_stale_reservations(max_age)
+        self.stdout.write(self.style.SUCCESS(f'Освобождено ключей: {released}'))
@@ -0,0 +1,197 @@
+import mimetypes
+import os
+import re
+import stat
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from core import storage
+
+# Год — максимум, который ожидают браузеры и CDN для неизменяемых ресурсов.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+FileInfo = namedtuple('FileInfo', 'path size mtime etag content_type encoding cache_control')
+
+
+class StatCache:
+    """
+    LRU метаданных файлов (размер, время изменения, ETag, тип), чтобы горячие
+    изображения не вызывали stat() на каждый запрос. Файлы по содержимому
+    (core.storage) не меняются, остальные перепроверяются раз в ttl секунд.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(path)
+            if item is not None:
+                info, checked_at = item
+                if info.cache_control[1] or now - checked_at < self.ttl:
+                    self._items.move_to_end(path)
+                    return info
+        info = _stat(path)
+        with self._lock:
+            self._items[path] = (info, now)
+            self._items.move_to_end(path)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return info
+
+    def discard(self, path):
+        with self._lock:
+            self._items.pop(path, None)
+
+
+def _stat(path):
+    full_path = safe_join(settings.MEDIA_ROOT, path)
+    result = os.stat(full_path)
+    if not stat.S_ISREG(result.st_mode):
+        raise FileNotFoundError(full_path)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    parsed = storage.parse_name(path)
+    if parsed is None:
+        etag = f'"{result.st_size:x}-{result.st_mtime_ns:x}"'
+        cache_control = (settings.MEDIA_VARIANT_MAX_AGE, False)
+    else:
+        # Хэш в имени — тот же ETag на всех серверах, независимо от mtime копии файла.
+        etag = f'"{parsed[0]}{".v" + format(result.st_mtime_ns, "x") if parsed[1] else ""}"'
+        # Варианты изображений пересоздаются под тем же именем, поэтому кэшируются ограниченно.
+        cache_control = (settings.MEDIA_VARIANT_MAX_AGE, False) if parsed[1] else (IMMUTABLE_MAX_AGE, True)
+    return FileInfo(
+        full_path, result.st_size, int(result.st_mtime), etag,
+        content_type or 'application/octet-stream', encoding, cache_control,
+    )
+
+
+stat_cache = StatCache(settings.MEDIA_STAT_CACHE_SIZE, settings.MEDIA_STAT_CACHE_TTL)
+
+
+class _RangeFile:
+    """ Чтение не дальше конца диапазона; без fileno(), чтобы сервер не отдал файл целиком через sendfile """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    '''
+    Один диапазон байтов из заголовка Range: (начало, конец включительно),
+    None — если заголовок не поддерживается и надо отдать файл целиком,
+    False — если диапазон не пересекается с файлом (ответ 416).
+    '''
+    match = RANGE_HEADER.match(header.strip())
+    if match is None:
+        # Несколько диапазонов (multipart/byteranges) не поддерживаются: отдается весь файл.
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, info):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == info.etag
+    return parse_http_date_safe(if_range) == info.mtime
+
+
+@require_safe
+def serve(request, path):
+    """
+    Отдает загруженные файлы из MEDIA_ROOT.
+
+    Файл отдается через FileResponse: WSGI-сервер с wsgi.file_wrapper (gunicorn,
+    uWSGI) передает его через sendfile без копирования в Python. Поддерживаются
+    условные запросы (If-None-Match, If-Modified-Since — ответ 304 без открытия
+    файла) и один диапазон байтов (Range, If-Range). Метаданные горячих файлов
+    берутся из LRU (stat_cache).
+    """
+    try:
+        info = stat_cache.get(path)
+    except (FileNotFoundError, NotADirectoryError, SuspiciousFileOperation):
+        raise Http404('Файл не найден')
+
+    response = get_conditional_response(request, etag=info.etag, last_modified=info.mtime)
+    if response is None:
+        response = _file_response(request, path, info)
+    response['Accept-Ranges'] = 'bytes'
+    if response.status_code not in (200, 206, 304):
+        return response
+    response['ETag'] = info.etag
+    response['Last-Modified'] = http_date(info.mtime)
+    max_age, immutable = info.cache_control
+    patch_cache_control(response, public=True, max_age=max_age, **({'immutable': True} if immutable else {}))
+    return response
+
+
+def _file_response(request, path, info):
+    byte_range = None
+    if request.META.get('HTTP_RANGE') and _if_range_matches(request, info):
+        byte_range = parse_range(request.META['HTTP_RANGE'], info.size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{info.size}'
+            return response
+    start, end = byte_range or (0, info.size - 1)
+    length = max(0, end - start + 1)
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=info.content_type)
+    else:
+        try:
+            file = open(info.path, 'rb')
+        except FileNotFoundError:
+            stat_cache.discard(path)
+            raise Http404('Файл не найден')
+        if start:
+            file.seek(start)
+        if byte_range and end < info.size - 1:
+            file = _RangeFile(file, length)
+        response = FileResponse(file, content_type=info.content_type)
+    if info.encoding:
+        response['Content-Encoding'] = info.encoding
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{info.size}'
+    return response
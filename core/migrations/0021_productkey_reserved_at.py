@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_rename_is_delete_productkey_is_deleted_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productkey',
+            name='reserved_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Зарезервирован в пул'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:25
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+from core.search import install_search_index, rebuild_search_index
+
+
+def create_search_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+    rebuild_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'postgresql':
+            cursor.execute('DROP TRIGGER IF EXISTS core_product_search_vector_trigger ON core_product')
+            cursor.execute('DROP FUNCTION IF EXISTS core_product_search_vector_update()')
+        elif schema_editor.connection.vendor == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS core_product_fts_{trigger}')
+            cursor.execute('DROP TABLE IF EXISTS core_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_product_count(apps, schema_editor):
+    # Исторические модели вместо core.counters: код приложения может измениться
+    # после этой миграции, а она должна работать со схемой на этот момент.
+    Product = apps.get_model('core', 'Product')
+    using = schema_editor.connection.alias
+    for field_name in ('tags', 'operating_systems'):
+        field = Product._meta.get_field(field_name)
+        through = field.remote_field.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        counts = (
+            through.objects.using(using)
+                .filter(**{f'{source}__published': True, target: OuterRef('pk')})
+                .order_by()
+                .values(target)
+                .annotate(count=Count('*'))
+                .values('count')
+        )
+        field.related_model.objects.using(using).update(product_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operatingsystem',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Опубликованных продуктов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Опубликованных продуктов'),
+        ),
+        migrations.RunPython(fill_product_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_product_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersistedQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 текста запроса')),
+                ('query', models.TextField(verbose_name='Текст запроса')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время регистрации')),
+            ],
+            options={
+                'verbose_name': 'Сохраненный запрос GraphQL',
+                'verbose_name_plural': 'Сохраненные запросы GraphQL',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_persistedquery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='photo',
+            field=models.ImageField(blank=True, upload_to='product_images/', verbose_name='Фото продукта'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_available_keys(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    ProductKey = apps.get_model('core', 'ProductKey')
+    using = schema_editor.connection.alias
+    counts = (
+        ProductKey.objects.using(using)
+            .filter(product=OuterRef('pk'), is_deleted=False)
+            .order_by()
+            .values('product')
+            .annotate(count=Count('*'))
+            .values('count')
+    )
+    Product.objects.using(using).update(available_keys=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_product_photo_upload_to'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_keys',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Свободных ключей'),
+        ),
+        migrations.RunPython(fill_available_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:56
+
+import core.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_order'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=core.indexes.OrderedIndex(models.F('published'), models.OrderBy(models.F('publish_date'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='product_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productkey',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['product', 'id'], name='productkey_unused_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='tag_name_lower_idx'),
+        ),
+    ]
@@ -3,12 +3,37 @@ import uuid
 from backend import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Lower
 from django.core.mail import send_mail
 from django.contrib.auth.models import PermissionsMixin
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.base_user import AbstractBaseUser
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from languages_plus.models import Language
 
+from core.indexes import OrderedIndex
+
+
+class CounterFieldsMixin:
+    """
+    Модель со счетчиками, которые ведутся атомарными UPDATE с F() (core.counters).
+    Обычное сохранение существующего объекта не записывает счетчики из памяти:
+    значение в экземпляре, загруженном раньше, могло устареть, и save() затер бы
+    изменения, сделанные сигналами после загрузки.
+    """
+    counter_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if update_fields is None and not force_insert and not self._state.adding and self.pk is not None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields and field.attname not in deferred
+            ]
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+
 
 class Company(models.Model):
     name = models.CharField(verbose_name="Название создателя ПО", max_length=240, blank=True, unique=True)
@@ -21,19 +46,31 @@ class Company(models.Model):
         verbose_name_plural = 'Компании'
 
 
-class Tag(models.Model):
+class Tag(CounterFieldsMixin, models.Model):
     name = models.CharField(verbose_name="Название тега", max_length=50, unique=True)
+    # Число опубликованных продуктов с тегом, ведется сигналами (см. core.counters).
+    product_count = models.PositiveIntegerField(verbose_name="Опубликованных продуктов", default=0, editable=False)
+
+    counter_fields = ('product_count',)
 
     def __str__(self):
         return self.name
 
     class Meta:
+        indexes = [
+            # Поиск тега без учета регистра: Lower(name) = Lower(%s), см. core.schema.
+            models.Index(Lower("name"), name="tag_name_lower_idx"),
+        ]
         verbose_name = 'Тег'
         verbose_name_plural = 'Теги'
 
 
-class OperatingSystem(models.Model):
+class OperatingSystem(CounterFieldsMixin, models.Model):
     name = models.CharField(verbose_name="Название операционный системы", max_length=50, unique=True)
+    # Число опубликованных продуктов для ОС, ведется сигналами (см. core.counters).
+    product_count = models.PositiveIntegerField(verbose_name="Опубликованных продуктов", default=0, editable=False)
+
+    counter_fields = ('product_count',)
 
     def __str__(self):
         return self.name
@@ -43,9 +80,26 @@ class OperatingSystem(models.Model):
         verbose_name_plural = 'Операционные системы'
 
 
-class Product(models.Model):
+class ProductManager(models.Manager):
+
+    def published(self):
+        '''
+        Опубликованные продукты для витрины. Условие пишется как published = true,
+        а не как голая колонка (WHERE published, что Django выдает для published=True):
+        иначе SQLite не распознает равенство и не использует product_listing_idx.
+        '''
+        return self.filter(published=Value(True))
+
+
+class Product(CounterFieldsMixin, models.Model):
     class Meta:
         ordering = ["-publish_date"]
+        indexes = [
+            # Витрина: published = true в порядке постраничной выдачи (core.pagination.PRODUCT_ORDERING).
+            OrderedIndex(
+                F("published"), F("publish_date").desc(nulls_last=True), F("id").desc(), name="product_listing_idx",
+            ),
+        ]
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
 
@@ -54,7 +108,7 @@ class Product(models.Model):
     description = models.TextField(verbose_name="Описание ПО", blank=True)
     meta_description = models.CharField(verbose_name="Мета-Описание ПО", max_length=150, blank=True)
     price = models.DecimalField(verbose_name="Цена", decimal_places=2, max_digits=6)
-    photo = models.ImageField(verbose_name="Фото продукта", blank=True, upload_to=f"product_images/{uuid.uuid4()}")
+    photo = models.ImageField(verbose_name="Фото продукта", blank=True, upload_to="product_images/")
     languages = models.ManyToManyField(Language, verbose_name="Языки", related_name="products", blank=True)
     date_created = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
     date_modified = models.DateTimeField(verbose_name="Дата последнего обновления", auto_now=True)
@@ -63,6 +117,16 @@ class Product(models.Model):
     operating_systems = models.ManyToManyField(OperatingSystem, verbose_name="Операционные системы", related_name="products", blank=True)
     company = models.ForeignKey(Company, verbose_name="Создатель ПО", on_delete=models.PROTECT, blank=True, null=True)
     tags = models.ManyToManyField(Tag, verbose_name="Теги", related_name="products", blank=True, null=True)
+    # Поисковый вектор по названию и описанию. Заполняется триггером Postgres (см. core.search),
+    # в SQLite не используется: там поиск идет по FTS5-таблице core_product_fts.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Число неиспользованных ключей. Ведется атомарными UPDATE с F() при загрузке,
+    # выдаче и возврате ключей (см. core.counters), чтобы не считать COUNT(*) по ключам.
+    available_keys = models.PositiveIntegerField(verbose_name="Свободных ключей", default=0, editable=False)
+
+    objects = ProductManager()
+
+    counter_fields = ('available_keys',)
 
     def __str__(self):
         """ Строковое представление модели (отображается в консоли) """
@@ -73,9 +137,16 @@ class ProductKey(models.Model):
     product = models.ForeignKey(Product, verbose_name="Продукт", on_delete=models.PROTECT, related_name="keys")
     product_key = models.UUIDField(verbose_name="Ключ активации продукта", unique=True, default=uuid.uuid4, editable=False)
     is_deleted = models.BooleanField(verbose_name="Использован?", default=False)
+    # Время, когда ключ был зарезервирован в пул процесса (см. core.keys.KeyPool).
+    reserved_at = models.DateTimeField(verbose_name="Зарезервирован в пул", blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ["-product"]
+        indexes = [
+            # Только свободные ключи: выдача берет наименьший id среди них по продукту (core.keys),
+            # а использованные, которых со временем большинство, в индекс не попадают.
+            models.Index(fields=["product", "id"], condition=Q(is_deleted=False), name="productkey_unused_idx"),
+        ]
         verbose_name = 'Ключ активации продукта'
         verbose_name_plural = 'Ключи активации продуктов'
 
@@ -159,3 +230,101 @@ class User(AbstractBaseUser, PermissionsMixin):
         Отправляет электронное письмо этому пользователю.
         '''
         send_mail(subject, message, from_email, [to_email], **kwargs)
+
+
+class OutboxMessageManager(models.Manager):
+
+    def enqueue(self, subject, message, to_email, from_email=None):
+        '''
+        Ставит письмо в очередь на отправку. Вызывается в той же транзакции,
+        что и изменения, о которых сообщает письмо: если транзакция откатится,
+        письмо не уйдет.
+        '''
+        return self.create(subject=subject, body=message, to_email=to_email, from_email=from_email or '')
+
+    def due(self):
+        '''
+        Неотправленные письма, время очередной попытки которых уже наступило.
+        '''
+        return self.filter(sent_at__isnull=True, next_attempt_at__lte=timezone.now())
+
+
+class OutboxMessage(models.Model):
+    subject = models.CharField(verbose_name="Тема", max_length=255)
+    body = models.TextField(verbose_name="Текст письма")
+    from_email = models.CharField(verbose_name="Отправитель", max_length=254, blank=True)
+    to_email = models.EmailField(verbose_name="Получатель")
+    created_at = models.DateTimeField(verbose_name="Время создания", auto_now_add=True)
+    next_attempt_at = models.DateTimeField(verbose_name="Следующая попытка", default=timezone.now)
+    sent_at = models.DateTimeField(verbose_name="Время отправки", blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(verbose_name="Попыток отправки", default=0)
+    last_error = models.TextField(verbose_name="Последняя ошибка", blank=True)
+
+    objects = OutboxMessageManager()
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["sent_at", "next_attempt_at"], name="outbox_due_idx"),
+        ]
+        verbose_name = 'Письмо в очереди'
+        verbose_name_plural = 'Очередь писем'
+
+    def __str__(self):
+        """ Строковое представление модели (отображается в консоли) """
+        return f'{self.to_email}: {self.subject}'
+
+
+class PersistedQuery(models.Model):
+    sha256 = models.CharField(verbose_name="SHA-256 текста запроса", max_length=64, unique=True)
+    query = models.TextField(verbose_name="Текст запроса")
+    created_at = models.DateTimeField(verbose_name="Время регистрации", auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Сохраненный запрос GraphQL'
+        verbose_name_plural = 'Сохраненные запросы GraphQL'
+
+    def __str__(self):
+        """ Строковое представление модели (отображается в консоли) """
+        return self.sha256
+
+
+class Order(models.Model):
+    # Ключ идемпотентности от клиента: повтор запроса с тем же ключом возвращает этот заказ.
+    idempotency_key = models.CharField(verbose_name="Ключ идемпотентности", max_length=64, unique=True)
+    # SHA-256 параметров запроса, чтобы повтор с тем же ключом и другим составом не прошел.
+    request_hash = models.CharField(verbose_name="Хэш запроса", max_length=64, editable=False)
+    email = models.EmailField(verbose_name="Email покупателя")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, verbose_name="Покупатель", on_delete=models.SET_NULL,
+        blank=True, null=True, related_name="orders",
+    )
+    total = models.DecimalField(verbose_name="Сумма", decimal_places=2, max_digits=10, default=0)
+    created_at = models.DateTimeField(verbose_name="Время создания", auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = 'Заказ'
+        verbose_name_plural = 'Заказы'
+
+    def __str__(self):
+        """ Строковое представление модели (отображается в консоли) """
+        return f'{self.pk}: {self.email}'
+
+
+class OrderItem(models.Model):
+    order = models.ForeignKey(Order, verbose_name="Заказ", on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, verbose_name="Продукт", on_delete=models.PROTECT, related_name="order_items")
+    product_key = models.OneToOneField(
+        ProductKey, verbose_name="Выданный ключ", on_delete=models.PROTECT, related_name="order_item",
+    )
+    price = models.DecimalField(verbose_name="Цена на момент покупки", decimal_places=2, max_digits=6)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = 'Позиция заказа'
+        verbose_name_plural = 'Позиции заказов'
+
+    def __str__(self):
+        """ Строковое представление модели (отображается в консоли) """
+        return f'{self.order_id}: {self.product_key}'
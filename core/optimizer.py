@@ -0,0 +1,118 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import ast
+
+# Колонки, нужные вычисляемым полям схемы, которых нет среди полей модели:
+# {(модель, имя поля в snake_case): (колонки,)}. Заполняется через computed_field().
+_COMPUTED_FIELDS = {}
+
+
+def computed_field(model, name, *columns):
+    '''
+    Сообщает оптимизатору, что вычисляемое поле name типа модели читает
+    колонки columns, чтобы only() их не откладывал.
+    '''
+    _COMPUTED_FIELDS[model, name] = columns
+
+
+def optimize(queryset, info, path=()):
+    '''
+    Подстраивает queryset под запрошенные клиентом поля.
+
+    Обходит набор выборки текущего поля (info.field_asts) и строит only() для
+    запрошенных колонок, select_related() для ForeignKey и Prefetch() для
+    ManyToMany и обратных связей — рекурсивно, с тем же отбором колонок внутри
+    связанных выборок. path позволяет спуститься к вложенному уровню выборки,
+    например ('edges', 'node') для connection-полей.
+    '''
+    selections = _children(info.field_asts, info)
+    for name in path:
+        selections = _children(selections.get(name, []), info)
+    plan = _plan(queryset.model, selections, info)
+    return plan.apply(queryset)
+
+
+class _Plan:
+
+    def __init__(self, model):
+        self.only = {model._meta.pk.attname}
+        self.select_related = []
+        self.prefetches = []
+
+    def merge(self, prefix, other):
+        self.only.update(f'{prefix}__{name}' for name in other.only)
+        self.select_related.extend(f'{prefix}__{name}' for name in other.select_related)
+        for prefetch in other.prefetches:
+            self.prefetches.append(Prefetch(f'{prefix}__{prefetch.prefetch_through}', queryset=prefetch.queryset))
+
+    def apply(self, queryset):
+        queryset = queryset.only(*self.only)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetches:
+            queryset = queryset.prefetch_related(*self.prefetches)
+        return queryset
+
+
+def _plan(model, selections, info):
+    plan = _Plan(model)
+    for name, nodes in selections.items():
+        field = _model_field(model, to_snake_case(name))
+        if field is None:
+            # Вычисляемые поля типа (аннотации, __typename и т.п.).
+            plan.only.update(_COMPUTED_FIELDS.get((model, to_snake_case(name)), ()))
+            continue
+
+        if not field.is_relation:
+            plan.only.add(field.attname)
+        elif field.many_to_one or (field.one_to_one and field.concrete):
+            plan.only.add(field.attname)
+            plan.select_related.append(field.name)
+            plan.merge(field.name, _plan(field.related_model, _children(nodes, info), info))
+        elif field.one_to_one:
+            plan.select_related.append(field.get_accessor_name())
+            plan.merge(field.get_accessor_name(), _plan(field.related_model, _children(nodes, info), info))
+        else:
+            related_plan = _plan(field.related_model, _children(nodes, info), info)
+            if field.one_to_many:
+                # Django сопоставляет объекты обратной связи по внешнему ключу.
+                related_plan.only.add(field.remote_field.attname)
+            accessor = field.name if field.concrete else field.get_accessor_name()
+            related = related_plan.apply(field.related_model._default_manager.all())
+            plan.prefetches.append(Prefetch(accessor, queryset=related))
+    return plan
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+    # Обратные связи без related_name видны в схеме под именем аксессора (product_set).
+    for field in model._meta.related_objects:
+        if field.get_accessor_name() == name:
+            return field
+    return None
+
+
+def _children(field_nodes, info):
+    '''
+    Собирает дочерние поля набора AST-узлов с раскрытием фрагментов.
+    Возвращает словарь {имя поля в схеме: [AST-узлы]}.
+    '''
+    children = {}
+    for node in field_nodes:
+        if node.selection_set:
+            _collect(node.selection_set, info, children)
+    return children
+
+
+def _collect(selection_set, info, children):
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            children.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, ast.FragmentSpread):
+            _collect(info.fragments[selection.name.value].selection_set, info, children)
+        elif isinstance(selection, ast.InlineFragment):
+            _collect(selection.selection_set, info, children)
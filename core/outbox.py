@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import OutboxMessage
+
+
+def send_pending(batch_size=None):
+    '''
+    Отправляет очередную пачку писем из очереди через одно SMTP-соединение.
+
+    Пачка забирается короткой транзакцией: next_attempt_at сдвигается на
+    OUTBOX_LEASE секунд вперед, и параллельные отправители ее не видят. Сама
+    отправка идет вне транзакции, чтобы не держать блокировку базы (в SQLite —
+    блокировку на запись всей базы) на время обмена с SMTP-сервером; результаты
+    записываются второй короткой транзакцией. Если процесс упадет посреди
+    отправки, письма снова станут доступны по истечении аренды.
+
+    Письма, которые не удалось отправить, откладываются с экспоненциально
+    растущей задержкой; после OUTBOX_MAX_ATTEMPTS попыток письмо больше не
+    берется в работу. Возвращает пару (отправлено, с ошибкой).
+    '''
+    batch = _lease(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for message in batch:
+            _mark_failed(message, e)
+        failed = len(batch)
+    else:
+        try:
+            for message in batch:
+                email = EmailMessage(
+                    subject=message.subject,
+                    body=message.body,
+                    from_email=message.from_email or None,
+                    to=[message.to_email],
+                    connection=connection,
+                )
+                try:
+                    connection.send_messages([email])
+                except Exception as e:
+                    _mark_failed(message, e)
+                    failed += 1
+                else:
+                    message.attempts += 1
+                    message.sent_at = timezone.now()
+                    message.last_error = ''
+                    sent += 1
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        OutboxMessage.objects.bulk_update(batch, ['attempts', 'sent_at', 'next_attempt_at', 'last_error'])
+    return sent, failed
+
+
+def _lease(batch_size):
+    '''
+    Забирает до batch_size писем, которым пора уйти, и откладывает их на время
+    аренды, чтобы другие отправители их не взяли.
+    '''
+    with transaction.atomic():
+        batch = list(
+            OutboxMessage.objects.due()
+                .filter(attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+                .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if batch:
+            leased_until = timezone.now() + timedelta(seconds=settings.OUTBOX_LEASE)
+            OutboxMessage.objects.filter(pk__in=[message.pk for message in batch]).update(next_attempt_at=leased_until)
+            for message in batch:
+                message.next_attempt_at = leased_until
+    return batch
+
+
+def retry_delay(attempts):
+    '''
+    Задержка перед следующей попыткой: OUTBOX_RETRY_DELAY * 2^(attempts - 1).
+    '''
+    return timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _mark_failed(message, error):
+    message.attempts += 1
+    message.last_error = f'{type(error).__name__}: {error}'
+    message.next_attempt_at = timezone.now() + retry_delay(message.attempts)
@@ -0,0 +1,168 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import math
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models
+from django.db.models import F, Q
+from django.utils.dateparse import parse_date, parse_datetime
+from graphene.relay import PageInfo
+
+# Порядок каталога: Product.Meta.ordering плюс id для однозначности.
+PRODUCT_ORDERING = (("publish_date", True), ("id", True))
+# Порядок результатов поиска: по убыванию релевантности (аннотация rank из core.search).
+SEARCH_ORDERING = (("rank", True), ("id", True))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def paginate(connection_type, queryset, first=None, after=None, ordering=PRODUCT_ORDERING):
+    '''
+    Постраничная выдача по ключу (keyset) в виде relay-connection.
+
+    Вместо OFFSET следующая страница отбирается условием «строго после
+    курсора» по полям ordering, поэтому глубина листания не влияет на
+    стоимость запроса. Для hasNextPage выбирается одна лишняя строка,
+    COUNT(*) выполняется, только если клиент запросил totalCount.
+    ordering — последовательность пар (поле, по убыванию?), последним должно
+    идти уникальное поле. NULL считаются идущими в конце в обоих направлениях.
+    '''
+    page, first = _page(queryset, first, after, ordering)
+    return _connection(connection_type, queryset, list(page[:first + 1]), first, after, ordering)
+
+
+async def apaginate(connection_type, queryset, first=None, after=None, ordering=PRODUCT_ORDERING):
+    '''
+    То же, что paginate, но строки страницы загружаются через async ORM
+    (для асинхронного представления GraphQL).
+    '''
+    page, first = _page(queryset, first, after, ordering)
+    rows = [row async for row in page[:first + 1]]
+    return _connection(connection_type, queryset, rows, first, after, ordering)
+
+
+def _page(queryset, first, after, ordering):
+    if first is None:
+        first = settings.PRODUCTS_PAGE_SIZE
+    first = max(0, min(first, settings.PRODUCTS_MAX_PAGE_SIZE))
+
+    page = queryset.order_by(*[
+        F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True)
+        for name, descending in ordering
+    ])
+    # Значения курсора должны прийти тем же запросом, даже если optimize() их не выбрал.
+    loaded, deferred = page.query.deferred_loading
+    if loaded and not deferred:
+        page = page.only(*loaded, *[name for name, _ in ordering if _is_field(queryset.model, name)])
+    if after:
+        page = page.filter(_after(ordering, decode_cursor(queryset.model, ordering, after)))
+    return page, first
+
+
+def _connection(connection_type, queryset, rows, first, after, ordering):
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+
+    edges = [
+        connection_type.Edge(node=row, cursor=encode_cursor(row, ordering))
+        for row in rows
+    ]
+    connection = connection_type(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=bool(after),
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
+    # Нужен только для totalCount.
+    connection.queryset = queryset
+    return connection
+
+
+def encode_cursor(row, ordering):
+    values = [getattr(row, name) for name, _ in ordering]
+    raw = json.dumps(values, default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _json_default(value):
+    # DjangoJSONEncoder обрезает микросекунды, а курсору нужна точная позиция.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'Неподдерживаемое значение курсора: {value!r}')
+
+
+def decode_cursor(model, ordering, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor('Некорректный курсор')
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor('Некорректный курсор')
+    return [_parse_value(model, name, value) for (name, _), value in zip(ordering, values)]
+
+
+def _is_field(model, name):
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def _parse_value(model, name, value):
+    if value is None:
+        return None
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        field = None
+    try:
+        if field is None:
+            # Аннотации в порядках курсоров — числа (ранг поиска).
+            parsed = float(value)
+            if not math.isfinite(parsed):
+                parsed = None
+        elif isinstance(field, models.DateTimeField):
+            parsed = parse_datetime(value)
+        elif isinstance(field, models.DateField):
+            parsed = parse_date(value)
+        else:
+            parsed = field.to_python(value)
+    except (TypeError, ValueError, ValidationError):
+        parsed = None
+    if parsed is None:
+        raise InvalidCursor('Некорректный курсор')
+    return parsed
+
+
+def _after(ordering, values):
+    '''
+    Условие «строка идет строго после курсора» для составного ключа:
+    (k1 после v1) ИЛИ (k1 = v1 И k2 после v2) ИЛИ ...
+    '''
+    conditions = []
+    equal = Q()
+    for (name, descending), value in zip(ordering, values):
+        if value is None:
+            # После NULL в порядке NULLS LAST по этому полю идут только такие же NULL.
+            equal &= Q(**{f'{name}__isnull': True})
+            continue
+        lookup = 'lt' if descending else 'gt'
+        conditions.append(equal & (Q(**{f'{name}__{lookup}': value}) | Q(**{f'{name}__isnull': True})))
+        equal &= Q(**{name: value})
+    if not conditions:
+        return Q(pk__in=[])
+    return reduce(or_, conditions)
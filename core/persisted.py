@@ -0,0 +1,141 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
+from graphene_django.views import HttpError
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.language.base import parse
+from graphql.validation import validate
+
+from core import cost
+from core.models import PersistedQuery
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class CachedDocumentBackend(GraphQLCoreBackend):
+    """
+    Бэкенд graphql-core, который хранит разобранные и проверенные документы
+    в ограниченном LRU по SHA-256 текста запроса. Повторный запрос с тем же
+    текстом (или persisted query по хэшу) выполняется без лексера, парсера и
+    валидации: проверка схемой делается один раз при разборе. Перед каждым
+    выполнением проверяется стоимость операции (core.cost): она зависит от
+    переменных, поэтому не кэшируется.
+    """
+
+    def __init__(self, max_size, executor=None):
+        super().__init__(executor)
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, sha256):
+        with self._lock:
+            document = self._documents.get((schema, sha256))
+            if document is not None:
+                self._documents.move_to_end((schema, sha256))
+            return document
+
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super().document_from_string(schema, document_string)
+        key = query_hash(document_string)
+        document = self.get(schema, key)
+        if document is not None:
+            return document
+
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+        if errors:
+            # Невалидные документы не кэшируются, чтобы не вытеснять ими рабочие.
+            return GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=lambda *args, **kwargs: ExecutionResult(errors=errors, invalid=True),
+            )
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(self._execute, schema, document_ast),
+        )
+        with self._lock:
+            self._documents[(schema, key)] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
+
+    def _execute(self, schema, document_ast, **options):
+        try:
+            cost.enforce(
+                schema,
+                document_ast,
+                options.get('operation_name'),
+                options.get('variable_values'),
+                options.get('context_value'),
+            )
+        except GraphQLError as error:
+            return ExecutionResult(errors=[error], invalid=True)
+        return execute(schema, document_ast, **{**self.execute_params, **options})
+
+
+document_backend = CachedDocumentBackend(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+
+def register(query, schema=None):
+    '''
+    Регистрирует текст запроса как persisted query и возвращает его хэш.
+    При переданной схеме запрос предварительно проверяется.
+    '''
+    if schema is not None:
+        errors = validate(schema, parse(query))
+        if errors:
+            raise ValueError('; '.join(error.message for error in errors))
+    sha256 = query_hash(query)
+    PersistedQuery.objects.get_or_create(sha256=sha256, defaults={'query': query})
+    return sha256
+
+
+def resolve_query(schema, query, extensions):
+    '''
+    Возвращает текст запроса с учетом расширения persistedQuery (протокол
+    Automatic Persisted Queries клиента Apollo): клиент присылает только хэш,
+    а текст берется из LRU документов или из реестра PersistedQuery.
+    '''
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+    persisted = (extensions or {}).get('persistedQuery')
+    if not persisted:
+        return query
+
+    sha256 = persisted.get('sha256Hash')
+    if persisted.get('version') != 1 or not isinstance(sha256, str):
+        raise HttpError(HttpResponseBadRequest('Unsupported persisted query.'))
+    if query:
+        if query_hash(query) != sha256:
+            raise HttpError(HttpResponseBadRequest('provided sha does not match query'))
+        if settings.GRAPHQL_PERSISTED_QUERIES_AUTO_REGISTER:
+            register(query)
+        return query
+
+    document = document_backend.get(schema, sha256)
+    if document is not None:
+        return document.document_string
+    query = PersistedQuery.objects.filter(sha256=sha256).values_list('query', flat=True).first()
+    if query is None:
+        # По этой ошибке клиент Apollo повторяет запрос вместе с текстом.
+        raise HttpError(HttpResponse(status=200), 'PersistedQueryNotFound')
+    return query
@@ -0,0 +1,123 @@
+import contextvars
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Заголовок запроса, включающий блок extensions.profile в ответе.
+PROFILE_HEADER = 'HTTP_X_GRAPHQL_PROFILE'
+# Путь для SQL, выполненного вне резолверов (пакетные загрузки DataLoader).
+LOADERS_PATH = '(dataloader)'
+
+_current_path = contextvars.ContextVar('graphql_profile_path', default=None)
+
+
+class Profile:
+    """
+    Профиль выполнения одного запроса GraphQL: время и число SQL-запросов по
+    путям резолверов и повторяющиеся SQL-запросы (признак N+1).
+    """
+
+    def __init__(self, respond):
+        # respond — вернуть профиль клиенту в extensions.profile, а не только в лог.
+        self.respond = respond
+        self.started = time.perf_counter()
+        self.resolvers = defaultdict(lambda: {'calls': 0, 'time_ms': 0.0, 'queries': 0})
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            path = _current_path.get() or LOADERS_PATH
+            self.queries.append((sql, path, time.perf_counter() - start))
+            self.resolvers[path]['queries'] += 1
+
+    @contextmanager
+    def capture(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def record_resolver(self, path, duration):
+        stats = self.resolvers[path]
+        stats['calls'] += 1
+        stats['time_ms'] += duration * 1000
+
+    def report(self, operation_name=None, cost=None):
+        by_sql = defaultdict(lambda: {'count': 0, 'paths': set()})
+        for sql, path, _ in self.queries:
+            by_sql[sql]['count'] += 1
+            by_sql[sql]['paths'].add(path)
+        return {
+            'operation': operation_name,
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'cost': cost,
+            'queries': len(self.queries),
+            'sql_ms': round(sum(duration for _, _, duration in self.queries) * 1000, 3),
+            'resolvers': sorted(
+                (
+                    {'path': path, 'calls': stats['calls'], 'time_ms': round(stats['time_ms'], 3), 'queries': stats['queries']}
+                    for path, stats in self.resolvers.items()
+                ),
+                key=lambda item: -item['time_ms'],
+            ),
+            'duplicates': [
+                {'sql': sql[:300], 'count': stats['count'], 'paths': sorted(stats['paths'])}
+                for sql, stats in sorted(by_sql.items(), key=lambda item: -item[1]['count'])
+                if stats['count'] >= settings.GRAPHQL_PROFILE_DUPLICATE_THRESHOLD
+            ],
+        }
+
+
+def start(request):
+    '''
+    Решает, профилировать ли запрос: по заголовку X-GraphQL-Profile (значение
+    должно совпасть с GRAPHQL_PROFILE_TOKEN, а без токена — только для
+    сотрудников) либо выборочно с вероятностью GRAPHQL_PROFILE_SAMPLE_RATE.
+    '''
+    header = request.META.get(PROFILE_HEADER)
+    if header:
+        token = settings.GRAPHQL_PROFILE_TOKEN
+        if (token and header == token) or (not token and request.user.is_staff):
+            return Profile(respond=True)
+    if random.random() < settings.GRAPHQL_PROFILE_SAMPLE_RATE:
+        return Profile(respond=False)
+    return None
+
+
+def emit(profile, operation_name=None, cost=None):
+    report = profile.report(operation_name, cost)
+    logger.info('graphql profile %s', json.dumps(report, ensure_ascii=False), extra={'profile': report})
+    return report
+
+
+class ProfilingMiddleware:
+    """
+    Middleware graphene: замеряет время каждого резолвера и относит к его пути
+    SQL-запросы, выполненные во время его работы. Работает, только если
+    представление начало профиль запроса (request.graphql_profile).
+    """
+
+    def resolve(self, next, root, info, **args):
+        profile = getattr(info.context, 'graphql_profile', None)
+        if profile is None:
+            return next(root, info, **args)
+        # Индексы списков не нужны: все элементы списка агрегируются в один путь.
+        path = '.'.join(str(key) for key in info.path if not isinstance(key, int))
+        token = _current_path.set(path)
+        start = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            profile.record_resolver(path, time.perf_counter() - start)
+            _current_path.reset(token)
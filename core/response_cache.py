@@ -0,0 +1,172 @@
+import hashlib
+import json
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.language.visitor import TypeInfoVisitor, Visitor, visit
+from graphql.type import get_named_type
+from graphql.utils.type_info import TypeInfo
+from languages_plus.models import Language
+
+from core.models import Company, OperatingSystem, Product, Tag
+from core.persisted import document_backend
+
+# Модели, от которых может зависеть закэшированный ответ. Ответ, затрагивающий
+# другие модели (пользователь, ключи), не кэшируется.
+VERSIONED_MODELS = (Product, Tag, Company, OperatingSystem, Language)
+
+# Типы схемы без модели, чьи данные все же строятся из моделей каталога.
+TYPE_DEPENDENCIES = {
+    'SuggestionType': (Product, Tag, Company, OperatingSystem),
+}
+
+# Поля Query с побочными эффектами или зависящие от токена в аргументах.
+UNCACHEABLE_FIELDS = {'orderPayment', 'viewer'}
+
+
+def get_cache():
+    return caches[settings.GRAPHQL_CACHE_ALIAS]
+
+
+def _version_key(model):
+    return f'graphql:version:{model._meta.label_lower}'
+
+
+def bump_versions(*models):
+    '''
+    Увеличивает версии моделей: все ответы, построенные по их прежним данным,
+    перестают находиться в кэше. Вытесненная версия заново заводится от
+    текущего времени, чтобы не совпасть ни с одной из прежних.
+    '''
+    cache = get_cache()
+    for model in models:
+        try:
+            cache.incr(_version_key(model))
+        except ValueError:
+            cache.set(_version_key(model), time.time_ns(), timeout=None)
+
+
+def invalidate_on_commit(models, using=None):
+    # До фиксации транзакции другие запросы видят старые данные, и старая версия им соответствует.
+    transaction.on_commit(lambda: bump_versions(*models), using=using)
+
+
+def models_invalidated_by(sender):
+    '''
+    Модели, ответы по которым устаревают при изменении объекта sender
+    (модели или промежуточной таблицы ManyToMany).
+    '''
+    if sender is Product:
+        # Публикация и удаление продукта меняют счетчики product_count тегов и ОС.
+        return Product, Tag, OperatingSystem
+    for field in Product._meta.many_to_many:
+        if field.remote_field.through is sender:
+            return Product, field.related_model
+    return sender,
+
+
+class Document:
+    """ Результат разбора текста запроса, достаточный для построения ключа кэша """
+
+    def __init__(self, normalized, operations, models, cacheable, root_fields=frozenset()):
+        self.normalized = normalized
+        self.operations = operations
+        self.models = models
+        self.cacheable = cacheable
+        # Поля Query, запрошенные в документе (во всех операциях и фрагментах).
+        self.root_fields = root_fields
+
+    def operation_type(self, operation_name):
+        if operation_name is None and len(self.operations) == 1:
+            return next(iter(self.operations.values()))
+        return self.operations.get(operation_name)
+
+
+class _DependencyCollector(Visitor):
+
+    def __init__(self, type_info, query_type):
+        self.type_info = type_info
+        self.query_type = query_type
+        self.models = set()
+        self.cacheable = True
+        self.root_fields = set()
+
+    def enter_Field(self, node, *args):
+        if self.type_info.get_parent_type() is self.query_type:
+            self.root_fields.add(node.name.value)
+            if node.name.value in UNCACHEABLE_FIELDS:
+                self.cacheable = False
+        named_type = get_named_type(self.type_info.get_type())
+        if named_type is None:
+            return
+        if named_type.name in TYPE_DEPENDENCIES:
+            self.models.update(TYPE_DEPENDENCIES[named_type.name])
+            return
+        meta = getattr(getattr(named_type, 'graphene_type', None), '_meta', None)
+        model = getattr(meta, 'model', None)
+        if model is not None:
+            if model in VERSIONED_MODELS:
+                self.models.add(model)
+            else:
+                self.cacheable = False
+
+
+@lru_cache(maxsize=512)
+def analyze(schema, query):
+    '''
+    Разбирает текст запроса: нормализованный текст (без комментариев и
+    лишних пробелов), типы операций и модели, от которых зависит ответ.
+    '''
+    document = document_backend.document_from_string(schema, query).document_ast
+    operations = {
+        definition.name.value if definition.name else None: definition.operation
+        for definition in document.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    }
+    type_info = TypeInfo(schema)
+    collector = _DependencyCollector(type_info, schema.get_query_type())
+    visit(document, TypeInfoVisitor(type_info, collector))
+    return Document(
+        print_ast(document), operations, frozenset(collector.models), collector.cacheable,
+        frozenset(collector.root_fields),
+    )
+
+
+def response_key(schema, request, query, variables, operation_name, extra=None):
+    '''
+    Ключ кэша ответа на запрос либо None, если ответ кэшировать нельзя:
+    пользователь аутентифицирован, операция не является чтением или затрагивает
+    данные вне каталога.
+    '''
+    if request.user.is_authenticated or 'HTTP_AUTHORIZATION' in request.META:
+        return None
+    if settings.GRAPHQL_JWT.get('JWT_COOKIE_NAME', 'JWT') in request.COOKIES:
+        return None
+    if not query:
+        return None
+    try:
+        document = analyze(schema, query)
+    except Exception:
+        # Ошибку разбора вернет сам GraphQLView.
+        return None
+    if not document.cacheable or document.operation_type(operation_name) != 'query':
+        return None
+
+    models = sorted(document.models, key=lambda model: model._meta.label_lower)
+    cache = get_cache()
+    versions = cache.get_many([_version_key(model) for model in models])
+    for model in models:
+        if _version_key(model) not in versions:
+            cache.add(_version_key(model), time.time_ns(), timeout=None)
+            versions[_version_key(model)] = cache.get(_version_key(model))
+    raw = json.dumps(
+        [document.normalized, operation_name, variables, sorted(versions.items()), extra],
+        sort_keys=True,
+        default=str,
+    )
+    return 'graphql:response:' + hashlib.sha256(raw.encode()).hexdigest()
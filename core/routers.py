@@ -0,0 +1,79 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Алиас реплики в DATABASES (задается переменными окружения, см. backend.settings).
+REPLICA_ALIAS = 'replica'
+
+# Поля Query, которые всегда читают с основной базы: orderPayment пишет заказ,
+# viewer должен сразу видеть только что измененного пользователя.
+PRIMARY_FIELDS = {'orderPayment', 'viewer'}
+
+
+class _ReplicaScope:
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=None)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    '''
+    Разрешает читать с реплики внутри блока. Состояние блока хранится в
+    contextvar, поэтому действует и в потоках sync_to_async, и в задачах
+    asyncio, созданных внутри блока, но не в чужих запросах и фоновых пулах.
+    Запись внутри блока выключает реплику до его конца (см. ReplicaRouter).
+    '''
+    token = _replica_reads.set(_ReplicaScope(enabled))
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+class ReplicaRouter:
+    """
+    Направляет чтения на реплику только там, где это явно разрешено
+    (replica_reads — запросы чтения GraphQL, см. core.views). Все записи,
+    чтения в транзакции основной базы и чтения после записи в том же запросе
+    идут на основную базу: реплика может отставать, а транзакция должна видеть
+    собственные изменения.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not replica_configured():
+            return None
+        scope = _replica_reads.get()
+        if scope is None or not scope.enabled or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Явно, а не None: иначе Django прочитал бы связанные объекты из базы экземпляра-подсказки.
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Меняется состояние блока replica_reads, а не сам contextvar: запрет
+        # виден и в контексте, из которого вызван sync_to_async, и снимается
+        # вместе с блоком, не затрагивая код после него.
+        scope = _replica_reads.get()
+        if scope is not None:
+            scope.enabled = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной базы: объекты из обеих можно связывать.
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит репликацией с основной базы.
+        if db == REPLICA_ALIAS:
+            return False
+        return None
@@ -1,26 +1,102 @@
+import uuid
+
 from backend import settings
-from django.db.models import Count
 from graphene_django import DjangoObjectType
 from core import models
-from django.db.models import F, Q, QuerySet
+from core.aio import is_async
+from core.images import variant_urls
+from core.checkout import CheckoutError, checkout
+from core.keys import KeyAllocationError
+from core.loaders import load_related
+from core.optimizer import computed_field, optimize
+from core.pagination import SEARCH_ORDERING, apaginate, paginate
+from core.search import search_products
+from core.suggest import suggest_index
+from django.db.models import F, Q, QuerySet, Value
+from django.db.models.functions import Lower
 import graphene
+from graphql import GraphQLError
 from graphql_jwt.decorators import login_required
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+
+
+class ImageVariantType(graphene.ObjectType):
+    # Рамка, в которую вписан вариант изображения (пропорции сохраняются).
+    size = graphene.String()
+    width = graphene.Int()
+    height = graphene.Int()
+    url = graphene.String()
+
+
+def resolve_image_variants(field_file, format):
+    return [
+        ImageVariantType(size=size, width=width, height=height, url=url)
+        for size, width, height, url in variant_urls(field_file, format)
+    ]
+
+
+class ImageFormat(graphene.Enum):
+    WEBP = 'webp'
+    JPEG = 'jpeg'
 
 
 class UserType(DjangoObjectType):
+    avatar_variants = graphene.List(ImageVariantType, format=ImageFormat(default_value='webp'))
+
     class Meta:
         model = models.User
 
+    def resolve_avatar_variants(self, info, format='webp'):
+        return resolve_image_variants(self.avatar, format)
+
 
 class CompanyType(DjangoObjectType):
     class Meta:
         model = models.Company
 
+    def resolve_product_set(self, info):
+        return load_related(self, info, 'product')
+
 
 class ProductType(DjangoObjectType):
+    # Уменьшенные копии фото (core.images) для списков и карточек вместо оригинала.
+    photo_variants = graphene.List(ImageVariantType, format=ImageFormat(default_value='webp'))
+
     class Meta:
         model = models.Product
+        exclude = ("search_vector", "order_items")
+
+    def resolve_photo_variants(self, info, format='webp'):
+        return resolve_image_variants(self.photo, format)
+
+    # Связи разрешаются через DataLoader запроса (core.loaders): одна выборка IN (...) на связь.
+    def resolve_company(self, info):
+        return load_related(self, info, 'company')
+
+    def resolve_tags(self, info):
+        return load_related(self, info, 'tags')
+
+    def resolve_operating_systems(self, info):
+        return load_related(self, info, 'operating_systems')
+
+    def resolve_languages(self, info):
+        return load_related(self, info, 'languages')
+
+
+computed_field(models.Product, 'photo_variants', 'photo')
+computed_field(models.User, 'avatar_variants', 'avatar')
+
+
+class ProductConnection(graphene.relay.Connection):
+    total_count = graphene.Int()
+
+    class Meta:
+        node = ProductType
+
+    def resolve_total_count(self, info):
+        # COUNT(*) выполняется, только если клиент запросил totalCount.
+        if is_async(info):
+            return self.queryset.order_by().acount()
+        return self.queryset.order_by().count()
 
 
 class TagType(DjangoObjectType):
@@ -30,6 +106,9 @@ class TagType(DjangoObjectType):
     class Meta:
         model = models.Tag
 
+    def resolve_products(self, info):
+        return load_related(self, info, 'products')
+
     def resolve_name_tag(self, info):
         # Returns last message only if the object was annotated
         return getattr(self, 'name_tag', None)
@@ -46,6 +125,9 @@ class OperatingSystemType(DjangoObjectType):
     class Meta:
         model = models.OperatingSystem
 
+    def resolve_products(self, info):
+        return load_related(self, info, 'products')
+
     def resolve_name_system(self, info):
         # Returns last message only if the object was annotated
         return getattr(self, 'name_system', None)
@@ -59,87 +141,114 @@ class LanguageType(DjangoObjectType):
     class Meta:
         model = models.Language
 
+    def resolve_products(self, info):
+        return load_related(self, info, 'products')
+
+
+class SuggestionType(graphene.ObjectType):
+    kind = graphene.String()
+    id = graphene.ID()
+    text = graphene.String()
+    slug = graphene.String()
+    score = graphene.Float()
+
+
+def catalog_products(info):
+    # Витрина показывает только опубликованные продукты (индекс product_listing_idx).
+    return optimize(models.Product.objects.published(), info, path=('edges', 'node'))
+
+
+def filter_in_stock(products, in_stock):
+    # Фильтр по счетчику available_keys, без подсчета ключей (core.counters).
+    if in_stock is None:
+        return products
+    return products.filter(available_keys__gt=0) if in_stock else products.filter(available_keys=0)
+
 
 class Query(graphene.ObjectType):
-    all_products = graphene.List(ProductType, tag=graphene.ID())
+    all_products = graphene.Field(
+        ProductConnection, tag=graphene.ID(), in_stock=graphene.Boolean(), first=graphene.Int(), after=graphene.String(),
+    )
     company_by_id = graphene.Field(CompanyType, id=graphene.ID())
     product_by_slug = graphene.Field(ProductType, slug=graphene.String())
     products_by_author = graphene.List(ProductType, id=graphene.ID())
-    products_by_tag = graphene.List(ProductType, tag=graphene.String())
+    products_by_tag = graphene.Field(
+        ProductConnection, tag=graphene.String(), in_stock=graphene.Boolean(), first=graphene.Int(), after=graphene.String(),
+    )
     tags_with_count_of_products = graphene.List(TagType)
     operating_systems_with_count_of_products = graphene.List(OperatingSystemType)
     viewer = graphene.Field(UserType, token=graphene.String(required=True))
-    products_search = graphene.List(ProductType, query=graphene.String())
-    order_payment = graphene.String(email=graphene.String(), ids=graphene.List(graphene.ID))
+    products_search = graphene.Field(
+        ProductConnection, query=graphene.String(), in_stock=graphene.Boolean(), first=graphene.Int(), after=graphene.String(),
+    )
+    product_suggest = graphene.List(SuggestionType, prefix=graphene.String(required=True), limit=graphene.Int())
+    order_payment = graphene.String(
+        email=graphene.String(), ids=graphene.List(graphene.ID),
+        deprecation_reason='Используйте мутацию checkout с ключом идемпотентности.',
+    )
 
     @login_required
     def resolve_viewer(self, info, **kwargs):
         return info.context.user
 
     def resolve_order_payment(self, info, email, ids, **kwargs):
-        products_in_order = models.Product.objects.filter(id__in=ids)
-        subject = 'Globus-IT: Ваша покупка совершена успешно!'
-        message = 'Ваши ключи: \n'
-        for product in products_in_order:
-            key = product.keys.first()
-            message += f'{product.title} - {key.product_key}\n'
-            key.is_deleted = True
-            key.save()
-        o = models.User.email_user(subject=subject, to_email=email, message=message)
-        print(o, subject, email, message)
+        # Старый способ оформления без повтора: каждый вызов — новый заказ.
+        checkout(uuid.uuid4().hex, email, ids, user=info.context.user)
         return 'Complete'
 
     def resolve_tags_with_count_of_products(self, info):
         return (
-            models.Tag.objects.annotate(name_tag=F('name'), count_products=Count('products')).order_by('name_tag')
+            optimize(models.Tag.objects.all(), info)
+                .annotate(name_tag=F('name'), count_products=F('product_count'))
+                .order_by('name_tag')
         )
 
-    def resolve_products_search(self, info, query=''):
-        products = models.Product.objects.prefetch_related("tags", "operating_systems", "languages").select_related("company")
+    def resolve_products_search(self, info, query='', in_stock=None, first=None, after=None):
+        products = filter_in_stock(catalog_products(info), in_stock)
+        return paginate(ProductConnection, search_products(products, query), first, after, ordering=SEARCH_ORDERING)
 
-        query_filter = Q()
-        for word in query.split(' '):
-            query_filter |= Q(title__icontains=word)
-            query_filter |= Q(description__icontains=word)
-            query_filter |= Q(price__icontains=word)
-        return products.filter(query_filter)
+    def resolve_product_suggest(self, info, prefix, limit=10):
+        # Ответ строится из индекса в памяти процесса (core.suggest), без запросов к базе.
+        return suggest_index.suggest(prefix, max(0, min(limit, settings.SUGGEST_MAX_LIMIT)))
 
     def resolve_operating_systems_with_count_of_products(self, info):
         return (
-            models.OperatingSystem.objects.annotate(name_system=F('name'), count_products=Count('products'))
+            optimize(models.OperatingSystem.objects.all(), info)
+                .annotate(name_system=F('name'), count_products=F('product_count'))
         )
 
-    def resolve_all_products(self, info, tag=None):
-        products = models.Product.objects.prefetch_related("tags", "operating_systems", "languages").select_related("company")
+    def resolve_all_products(self, info, tag=None, in_stock=None, first=None, after=None):
+        products = filter_in_stock(catalog_products(info), in_stock)
         if tag:
-           return (products.filter(tags=tag))
-        return (products.all())
+            products = products.filter(tags=tag)
+        if is_async(info):
+            return apaginate(ProductConnection, products, first, after)
+        return paginate(ProductConnection, products, first, after)
 
     def resolve_company_by_id(self, info, id):
-        return models.Profile.objects.get(
+        companies = optimize(models.Company.objects.all(), info)
+        if is_async(info):
+            return companies.aget(id=id)
+        return companies.get(
             id=id
         )
 
     def resolve_product_by_slug(self, info, slug):
-        return (
-            models.Product.objects.prefetch_related("tags")
-                .select_related("author")
-                .get(slug=slug)
-        )
-
-    def resolve_products_by_company(self, info, id):
-        return (
-            models.Product.objects.prefetch_related("tags")
-                .select_related("company")
-                .filter(company__id=id)
-        )
-
-    def resolve_products_by_tag(self, info, tag):
-        return (
-            models.Product.objects.prefetch_related("tags")
-                .select_related("author")
-                .filter(tags__name__iexact=tag)
-        )
+        products = optimize(models.Product.objects.all(), info)
+        if is_async(info):
+            return products.aget(slug=slug)
+        return products.get(slug=slug)
+
+    def resolve_products_by_author(self, info, id):
+        return optimize(models.Product.objects.all(), info).filter(company__id=id)
+
+    def resolve_products_by_tag(self, info, tag, in_stock=None, first=None, after=None):
+        # Lower с обеих сторон, а не iexact: так сравнение попадает в индекс tag_name_lower_idx.
+        tags = models.Tag.objects.alias(name_lower=Lower('name')).filter(name_lower=Lower(Value(tag)))
+        products = filter_in_stock(catalog_products(info).filter(tags__in=tags), in_stock)
+        if is_async(info):
+            return apaginate(ProductConnection, products, first, after)
+        return paginate(ProductConnection, products, first, after)
 
 import graphql_jwt
 
@@ -163,6 +272,51 @@ class UserMutation(graphene.Mutation):
         return UserMutation(user=user)
 
 
+class OrderItemType(DjangoObjectType):
+    product_key = graphene.UUID()
+
+    class Meta:
+        model = models.OrderItem
+        fields = ("id", "product", "product_key", "price")
+
+    def resolve_product_key(self, info):
+        return self.product_key.product_key
+
+
+class OrderType(DjangoObjectType):
+    class Meta:
+        model = models.Order
+        fields = ("id", "email", "total", "created_at", "items")
+
+    def resolve_items(self, info):
+        return self.items.select_related("product", "product_key")
+
+
+class CheckoutMutation(graphene.Mutation):
+    """
+    Оформление заказа (core.checkout). Клиент передает ключ идемпотентности
+    (например, UUID) и при обрыве соединения повторяет запрос с тем же ключом:
+    повтор возвращает сохраненный заказ, а не выдает ключи второй раз.
+    """
+
+    class Arguments:
+        idempotency_key = graphene.String(required=True)
+        email = graphene.String(required=True)
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    order = graphene.Field(OrderType)
+    # True, если заказ уже был оформлен раньше с этим ключом.
+    replayed = graphene.Boolean()
+
+    @classmethod
+    def mutate(cls, root, info, idempotency_key, email, ids):
+        try:
+            order, created = checkout(idempotency_key, email, ids, user=info.context.user)
+        except (CheckoutError, KeyAllocationError) as error:
+            raise GraphQLError(str(error))
+        return CheckoutMutation(order=order, replayed=not created)
+
+
 class Mutation(graphene.ObjectType):
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
     verify_token = graphql_jwt.Verify.Field()
@@ -172,6 +326,7 @@ class Mutation(graphene.ObjectType):
     # Long running refresh tokens
     delete_refresh_token_cookie = graphql_jwt.DeleteRefreshTokenCookie.Field()
     register_user = UserMutation.Field()
+    checkout = CheckoutMutation.Field()
 
 
 schema = graphene.Schema(query=Query, mutation=Mutation)
@@ -0,0 +1,124 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Конфигурация полнотекстового поиска Postgres. В конфигурации russian латиница
+# обрабатывается английским стеммером, поэтому подходит для смешанного каталога.
+SEARCH_CONFIG = 'russian'
+
+FTS_TABLE = 'core_product_fts'
+
+_POSTGRES_INDEX_SQL = [
+    f'''
+    CREATE OR REPLACE FUNCTION core_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS core_product_search_vector_trigger ON core_product',
+    '''
+    CREATE TRIGGER core_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON core_product
+    FOR EACH ROW EXECUTE FUNCTION core_product_search_vector_update()
+    ''',
+    'CREATE INDEX IF NOT EXISTS core_product_search_vector_idx ON core_product USING gin (search_vector)',
+]
+
+_SQLITE_INDEX_SQL = [
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(title, description, tokenize = 'unicode61 remove_diacritics 2')
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS core_product_fts_insert AFTER INSERT ON core_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS core_product_fts_delete AFTER DELETE ON core_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS core_product_fts_update AFTER UPDATE OF title, description ON core_product BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, description = new.description WHERE rowid = old.id;
+    END
+    ''',
+]
+
+
+def install_search_index(using_connection):
+    '''
+    Создает поисковый индекс и триггеры, которые его поддерживают: GIN-индекс по
+    search_vector в Postgres, FTS5-таблицу в SQLite. Операция идемпотентна и
+    повторяется после каждого migrate: SQLite при пересоздании таблицы
+    core_product миграциями удаляет ее триггеры.
+    '''
+    if using_connection.vendor == 'postgresql':
+        statements = _POSTGRES_INDEX_SQL
+    elif using_connection.vendor == 'sqlite':
+        statements = _SQLITE_INDEX_SQL
+    else:
+        return
+    with using_connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(using_connection):
+    '''
+    Полностью пересчитывает поисковый индекс по текущему содержимому каталога.
+    '''
+    with using_connection.cursor() as cursor:
+        if using_connection.vendor == 'postgresql':
+            cursor.execute('UPDATE core_product SET title = title')
+        elif using_connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, title, description) SELECT id, title, description FROM core_product'
+            )
+
+
+def search_products(queryset, query):
+    '''
+    Отбирает продукты, подходящие под поисковую строку, и аннотирует их полем
+    rank (чем больше, тем релевантнее). Слова запроса объединяются через ИЛИ и
+    ищутся по префиксу. Пустой запрос возвращает весь queryset с нулевым рангом.
+    '''
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(' | '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(rank=SearchRank(F('search_vector'), search_query))
+
+    if connection.vendor == 'sqlite':
+        match = ' OR '.join(f'"{word}"*' for word in words)
+        # Совпадения и их ранг отбираются подзапросами к FTS5 внутри запроса к
+        # каталогу, поэтому фильтры queryset (published, inStock) и пагинация
+        # работают по всем совпадениям, как в Postgres.
+        # bm25: чем меньше, тем лучше; совпадение в названии весит в 10 раз больше описания.
+        product_id = f'{connection.ops.quote_name(queryset.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]),
+        ).annotate(rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {product_id}',
+            [match],
+            output_field=FloatField(),
+        ))
+
+    query_filter = Q()
+    for word in words:
+        query_filter |= Q(title__icontains=word)
+        query_filter |= Q(description__icontains=word)
+    return queryset.filter(query_filter).annotate(rank=Value(0.0, output_field=FloatField()))
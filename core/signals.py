@@ -0,0 +1,153 @@
+from django.db import connections
+
+from core import counters, images, response_cache
+from core.models import Product
+
+from core.search import FTS_TABLE, install_search_index
+from core.suggest import KINDS, suggest_index
+
+
+def restore_search_index(sender, using, **kwargs):
+    '''
+    После migrate заново ставит триггеры поискового индекса: SQLite удаляет их,
+    когда миграция пересоздает таблицу core_product.
+    '''
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+        if 'core_product' not in tables:
+            return
+        if connection.vendor == 'sqlite' and FTS_TABLE not in tables:
+            return
+        if connection.vendor == 'postgresql':
+            columns = [column.name for column in connection.introspection.get_table_description(cursor, 'core_product')]
+            if 'search_vector' not in columns:
+                return
+    install_search_index(connection)
+
+
+def update_suggest_index(sender, instance, **kwargs):
+    """ Обновляет запись индекса подсказок после сохранения объекта """
+    kind = KINDS[sender]
+    if sender is Product:
+        if instance.published:
+            suggest_index.upsert(kind, instance.pk, instance.title, instance.slug)
+        else:
+            suggest_index.remove(kind, instance.pk)
+    else:
+        suggest_index.upsert(kind, instance.pk, instance.name)
+
+
+def remove_from_suggest_index(sender, instance, **kwargs):
+    """ Удаляет объект из индекса подсказок """
+    suggest_index.remove(KINDS[sender], instance.pk)
+
+
+def count_m2m_changes(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """
+    Ведет product_count тегов и ОС при изменении связей продукта с любой стороны
+    (product.tags.add(...) и tag.products.add(...)). Удаляемые связи
+    запоминаются до удаления: в pk_set для remove могут быть и несвязанные объекты.
+    """
+    field = counters.counted_field(sender)
+    if not hasattr(instance, '_counter_pending'):
+        instance._counter_pending = {}
+    pending = instance._counter_pending
+    if not reverse:
+        if not instance.published:
+            return
+        if action == 'post_add':
+            counters.adjust(field, pk_set, 1, using)
+        elif action in ('pre_remove', 'pre_clear'):
+            pending[field.name] = counters.linked_ids(instance, field, using, among=pk_set)
+        elif action in ('post_remove', 'post_clear'):
+            counters.adjust(field, pending.pop(field.name, ()), -1, using)
+        return
+
+    if action == 'post_add':
+        counters.adjust(field, [instance.pk], counters.published_count(field, pk_set, using), using)
+    elif action == 'pre_remove':
+        pending[field.name] = counters.published_count(field, pk_set, using, linked_to=instance)
+    elif action == 'post_remove':
+        counters.adjust(field, [instance.pk], -pending.pop(field.name, 0), using)
+    elif action == 'post_clear':
+        field.related_model._default_manager.db_manager(using).filter(pk=instance.pk).update(product_count=0)
+
+
+def remember_published(sender, instance, raw, using, update_fields, **kwargs):
+    """ Запоминает прежнее значение published, чтобы после сохранения сдвинуть счетчики """
+    if raw or instance._state.adding or (update_fields is not None and 'published' not in update_fields):
+        instance._was_published = None
+        return
+    instance._was_published = (
+        sender._default_manager.db_manager(using).filter(pk=instance.pk).values_list('published', flat=True).first()
+    )
+
+
+def count_published_toggle(sender, instance, created, using, **kwargs):
+    """ Публикация и снятие с публикации сдвигают счетчики всех тегов и ОС продукта """
+    was_published = getattr(instance, '_was_published', None)
+    if created or was_published is None or was_published == instance.published:
+        return
+    delta = 1 if instance.published else -1
+    for field_name in counters.COUNTED_FIELDS:
+        field = sender._meta.get_field(field_name)
+        counters.adjust(field, counters.linked_ids(instance, field, using), delta, using)
+
+
+def remember_counted_links(sender, instance, using, **kwargs):
+    """
+    Запоминает теги и ОС удаляемого опубликованного продукта: связи удаляются
+    вместе с ним без сигнала m2m_changed.
+    """
+    instance._counted_links = {}
+    if instance.published:
+        for field_name in counters.COUNTED_FIELDS:
+            field = sender._meta.get_field(field_name)
+            instance._counted_links[field_name] = counters.linked_ids(instance, field, using)
+
+
+def count_deleted_product(sender, instance, using, **kwargs):
+    for field_name, pks in getattr(instance, '_counted_links', {}).items():
+        counters.adjust(sender._meta.get_field(field_name), pks, -1, using)
+
+
+def remember_key_state(sender, instance, raw, using, **kwargs):
+    """ Запоминает прежние продукт и is_deleted ключа, чтобы после сохранения сдвинуть остатки """
+    instance._was_available = None
+    if raw or instance._state.adding:
+        return
+    instance._was_available = (
+        sender._default_manager.db_manager(using).filter(pk=instance.pk).values_list('product_id', 'is_deleted').first()
+    )
+
+
+def count_available_keys(sender, instance, created, using, **kwargs):
+    """ Ведет Product.available_keys при создании ключа, смене продукта и пометке использованным или возврате """
+    deltas = {}
+    previous = getattr(instance, '_was_available', None)
+    if previous is not None and not previous[1]:
+        deltas[previous[0]] = -1
+    if (created or previous is not None) and not instance.is_deleted:
+        deltas[instance.product_id] = deltas.get(instance.product_id, 0) + 1
+    counters.adjust_available_keys(deltas, using)
+
+
+def count_deleted_key(sender, instance, using, **kwargs):
+    if not instance.is_deleted:
+        counters.adjust_available_keys({instance.product_id: -1}, using)
+
+
+def invalidate_cached_responses(sender, using, **kwargs):
+    """ Повышает версии моделей, ответы по которым устарели (core.response_cache) """
+    response_cache.invalidate_on_commit(response_cache.models_invalidated_by(sender), using=using)
+
+
+def schedule_image_variants(sender, instance, raw, update_fields, **kwargs):
+    """ Запускает в фоне создание вариантов нового изображения (core.images) """
+    field_name = images.IMAGE_FIELDS[sender]
+    if raw or (update_fields is not None and field_name not in update_fields):
+        return
+    field_file = getattr(instance, field_name)
+    if field_file and not images.has_variants(field_file):
+        images.schedule_variants(field_file)
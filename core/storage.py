@@ -0,0 +1,97 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+
+# Имя файла в хранилище по содержимому: <каталог>/<2 символа хэша>/<sha256>[.<вариант>].<расширение>.
+CONTENT_ADDRESSED_NAME = re.compile(r'(?:^|/)[0-9a-f]{2}/(?P<hash>[0-9a-f]{64})(?P<variant>\.[\w-]+)?\.\w+$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def parse_name(name):
+    '''
+    Хэш содержимого и признак варианта для имени из хранилища по содержимому:
+    (sha256, True для производного файла вроде <sha256>.thumb.webp) или None.
+    '''
+    match = CONTENT_ADDRESSED_NAME.search(name)
+    if match is None:
+        return None
+    return match.group('hash'), bool(match.group('variant'))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, в котором загруженный файл лежит под SHA-256 своего
+    содержимого в каталоге upload_to поля: product_images/3f/3fa4….jpg.
+    Одинаковые загрузки для разных продуктов занимают на диске один файл, а
+    содержимое по адресу никогда не меняется, поэтому его можно кэшировать
+    в браузере и CDN бессрочно (см. core.media.serve).
+
+    Производные файлы (варианты изображений, core.images) пишутся под точным
+    именем через save_as.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        _, extension = posixpath.splitext(filename)
+        sha256 = content_hash(content)
+        name = posixpath.join(directory, sha256[:2], sha256 + extension.lower())
+        return self._save(name, content)
+
+    def save_as(self, name, content):
+        '''
+        Записывает файл под именем name, заменяя прежний.
+        '''
+        self._write(name, content)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым: существующий файл с этим именем — тот же самый.
+        return name
+
+    def _save(self, name, content):
+        if not self.exists(name):
+            self._write(name, content)
+        return name
+
+    def _write(self, name, content):
+        '''
+        Пишет во временный файл рядом и атомарно переименовывает: параллельные
+        загрузки одного содержимого не видят недописанный файл.
+        '''
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, self.directory_permissions_mode or 0o777, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    file.write(chunk)
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
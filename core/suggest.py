@@ -0,0 +1,227 @@
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+
+from core.models import Company, OperatingSystem, Product, Tag
+
+Suggestion = namedtuple('Suggestion', 'kind id text slug score')
+
+# Модели, попадающие в подсказки, и их вид в ответе.
+KINDS = {
+    Product: 'product',
+    Tag: 'tag',
+    Company: 'company',
+    OperatingSystem: 'operating_system',
+}
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+@lru_cache(maxsize=65536)
+def trigrams(text):
+    padded = f'  {text} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class SuggestIndex:
+    """
+    Префиксный индекс по названиям продуктов, тегов, компаний и ОС в памяти процесса.
+
+    Для префиксного поиска хранятся отсортированные списки названий и их
+    хвостов, начинающихся с нового слова (поиск через bisect), для поиска с опечатками — словарь слов
+    названий и инвертированный индекс их триграмм. Индекс строится лениво при первом обращении, обновляется
+    сигналами моделей и перестраивается в фоне раз в SUGGEST_INDEX_TTL секунд,
+    чтобы подхватить изменения, сделанные другими процессами.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        # Ключи префиксного поиска: названия целиком и хвосты названий со второго
+        # слова. Списки раздельные: совпадения с началом названия ранжируются
+        # выше и не должны вытесняться хвостами, идущими раньше по алфавиту.
+        self._titles = []
+        self._tails = []
+        self._words = {}
+        self._trigrams = {}
+        self._built_at = None
+        self._rebuilding = False
+
+    def suggest(self, prefix, limit=10):
+        query = normalize(prefix)
+        if not query:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            found = {}
+            # Совпадение с началом всего названия выше совпадения с началом слова.
+            for keys, score in ((self._titles, 2.0), (self._tails, 1.0)):
+                position = bisect_left(keys, (query,))
+                while position < len(keys) and len(found) < limit:
+                    key, entry_key = keys[position]
+                    if not key.startswith(query):
+                        break
+                    found.setdefault(entry_key, score)
+                    position += 1
+            if len(found) < limit and len(query) >= settings.SUGGEST_FUZZY_MIN_LENGTH:
+                for entry_key, similarity in self._similar(query):
+                    if len(found) >= limit:
+                        break
+                    found.setdefault(entry_key, similarity)
+            results = [self._entries[entry_key]._replace(score=score) for entry_key, score in found.items()]
+        results.sort(key=lambda suggestion: (-suggestion.score, suggestion.text))
+        return results
+
+    def _similar(self, query):
+        """
+        Продукты, слова которых похожи на слова запроса (опечатки). Триграммы
+        индексируются по словарю слов, а не по названиям целиком: словарь
+        заметно меньше каталога, а «ofice» похоже на «office», но не на
+        «microsoft office 2021».
+        """
+        threshold = settings.SUGGEST_SIMILARITY_THRESHOLD
+        query_words = query.split(' ')
+        best = {}
+        for position, word in enumerate(query_words):
+            word_trigrams = trigrams(word)
+            # Сходство не ниже threshold невозможно при меньшем числе общих триграмм,
+            # поэтому при поиске кандидатов можно пропустить skip самых частых
+            # триграмм запроса: у подходящего слова найдется общая среди остальных.
+            min_shared = threshold * len(word_trigrams) / (1 + threshold)
+            skip = max(0, math.ceil(min_shared) - 1)
+            postings = sorted((self._trigrams.get(trigram, ()) for trigram in word_trigrams), key=len)
+            candidates = set().union(*postings[:len(postings) - skip])
+            for candidate in candidates:
+                count = len(word_trigrams & trigrams(candidate))
+                if count < min_shared:
+                    continue
+                # Коэффициент Жаккара по множествам триграмм, как similarity() в pg_trgm.
+                similarity = count / (len(word_trigrams) + len(trigrams(candidate)) - count)
+                if similarity < threshold:
+                    continue
+                for entry_key in self._words[candidate]:
+                    scores = best.setdefault(entry_key, [0.0] * len(query_words))
+                    scores[position] = max(scores[position], similarity)
+        scored = [(entry_key, sum(scores) / len(scores)) for entry_key, scores in best.items()]
+        scored = [item for item in scored if item[1] >= threshold]
+        scored.sort(key=lambda item: -item[1])
+        return scored
+
+    def upsert(self, kind, pk, text, slug=None):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove((kind, pk))
+            self._add(Suggestion(kind, pk, text, slug, 0.0))
+
+    def remove(self, kind, pk):
+        with self._lock:
+            if self._built_at is not None:
+                self._remove((kind, pk))
+
+    def rebuild(self):
+        entries = []
+        for model, kind in KINDS.items():
+            queryset = model._default_manager.order_by()
+            if model is Product:
+                rows = queryset.filter(published=True).values_list('id', 'title', 'slug')
+            else:
+                rows = ((pk, name, None) for pk, name in queryset.values_list('id', 'name'))
+            entries.extend(Suggestion(kind, pk, text, slug, 0.0) for pk, text, slug in rows if text)
+
+        titles, tails = [], []
+        words = {}
+        for entry in entries:
+            title, *entry_tails = self._keys_for(entry)
+            titles.append(title)
+            tails.extend(entry_tails)
+            for word in normalize(entry.text).split(' '):
+                words.setdefault(word, set()).add((entry.kind, entry.id))
+        titles.sort()
+        tails.sort()
+        trigram_index = {}
+        for word in words:
+            for trigram in trigrams(word):
+                trigram_index.setdefault(trigram, set()).add(word)
+
+        with self._lock:
+            self._entries = {(entry.kind, entry.id): entry for entry in entries}
+            self._titles = titles
+            self._tails = tails
+            self._words = words
+            self._trigrams = trigram_index
+            self._built_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if self._built_at is None:
+                self.rebuild()
+                return
+            if self._rebuilding or time.monotonic() - self._built_at < settings.SUGGEST_INDEX_TTL:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _add(self, entry):
+        entry_key = (entry.kind, entry.id)
+        self._entries[entry_key] = entry
+        title, *tails = self._keys_for(entry)
+        insort(self._titles, title)
+        for key in tails:
+            insort(self._tails, key)
+        for word in normalize(entry.text).split(' '):
+            if word not in self._words:
+                self._words[word] = set()
+                for trigram in trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+            self._words[word].add(entry_key)
+
+    def _remove(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        title, *tails = self._keys_for(entry)
+        _discard(self._titles, title)
+        for key in tails:
+            _discard(self._tails, key)
+        for word in normalize(entry.text).split(' '):
+            entry_keys = self._words.get(word, set())
+            entry_keys.discard(entry_key)
+            if not entry_keys and word in self._words:
+                del self._words[word]
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].discard(word)
+
+    @staticmethod
+    def _keys_for(entry):
+        '''
+        Ключи префиксного поиска: первым — название целиком, затем каждый его
+        хвост, начинающийся с нового слова («office 2021» для «microsoft office 2021»).
+        '''
+        words = normalize(entry.text).split(' ')
+        entry_key = (entry.kind, entry.id)
+        return [(' '.join(words[i:]), entry_key) for i in range(len(words))]
+
+
+def _discard(keys, key):
+    position = bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
+
+
+suggest_index = SuggestIndex()
@@ -1,3 +1,1176 @@
-from django.test import TestCase
+import base64
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import uuid
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Min, Value
+from django.db.models.functions import Lower
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from graphql.language.parser import parse
+from PIL import Image
+from promise import Promise
+
+from core import cost, exporter, images, media, persisted, response_cache, storage
+from core.checkout import CheckoutError, checkout
+from core.importer import ImportFileError, import_file
+from core.keys import KeyAllocationError, KeyPool, claim_keys
+from core.loaders import load_related
+from core.models import Company, OperatingSystem, Order, OrderItem, OutboxMessage, PersistedQuery, Product, ProductKey, Tag, User
+from core.outbox import send_pending
+from core.pagination import PRODUCT_ORDERING, SEARCH_ORDERING, InvalidCursor, _page, decode_cursor, encode_cursor
+from core.routers import REPLICA_ALIAS, ReplicaRouter, replica_reads
+from core.schema import schema
+from core.search import search_products
+from core.storage import ContentAddressedStorage
+from core.suggest import SuggestIndex, suggest_index
+
+
+class IndexUsageTests(TestCase):
+    '''
+    Планировщик должен выбирать индексы из Meta.indexes для горячих запросов
+    (SQLite и Postgres). В Postgres на пустых тестовых таблицах полный просмотр
+    дешевле любого индекса, поэтому он запрещается: проверяется, что индекс
+    вообще применим к запросу, а не что он выгоднее на этих данных.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Антивирусы')
+        cls.product = Product.objects.create(
+            title='Продукт', slug='product', price=100, publish_date=timezone.now(),
+        )
+        cls.product.tags.add(cls.tag)
+        ProductKey.objects.create(product=cls.product)
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest('Планы проверяются только для SQLite и Postgres')
+
+    def assertUsesIndex(self, queryset, name):
+        plan = queryset.explain()
+        self.assertIn(name, plan)
+        return plan
+
+    def assertNoSort(self, plan):
+        # Порядок должен браться из индекса, без сортировки строк после выборки.
+        self.assertNotIn('TEMP B-TREE' if connection.vendor == 'sqlite' else 'Sort', plan)
+
+    def test_listing_page(self):
+        page, first = _page(Product.objects.published(), 20, None, PRODUCT_ORDERING)
+        plan = self.assertUsesIndex(page[:first + 1], 'product_listing_idx')
+        self.assertNoSort(plan)
+
+    def test_listing_page_after_cursor(self):
+        cursor = encode_cursor(self.product, PRODUCT_ORDERING)
+        page, first = _page(Product.objects.published(), 20, cursor, PRODUCT_ORDERING)
+        plan = self.assertUsesIndex(page[:first + 1], 'product_listing_idx')
+        self.assertNoSort(plan)
+
+    def test_unused_keys_of_product(self):
+        keys = (
+            ProductKey.objects.filter(product_id__in=[self.product.pk], is_deleted=False, reserved_at__isnull=True)
+                .order_by()
+                .values('product_id')
+                .annotate(key_id=Min('id'))
+        )
+        self.assertUsesIndex(keys, 'productkey_unused_idx')
+
+    def test_tag_name_case_insensitive(self):
+        tags = Tag.objects.alias(name_lower=Lower('name')).filter(name_lower=Lower(Value('антивирусы')))
+        self.assertUsesIndex(tags, 'tag_name_lower_idx')
+
+
+@mock.patch('core.routers.replica_configured', return_value=True)
+class ReplicaRouterTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_use_primary_by_default(self, configured):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_in_block_use_replica(self, configured):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Product), REPLICA_ALIAS)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_in_transaction_use_primary(self, configured):
+        with replica_reads(), transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_after_write_use_primary(self, configured):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_write_does_not_outlive_block(self, configured):
+        self.router.db_for_write(Product)
+        with replica_reads():
+            self.router.db_for_write(Product)
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Product), REPLICA_ALIAS)
+
+    def test_write_in_copied_context_reaches_caller(self, configured):
+        # Так sync_to_async выполняет функцию в потоке: в копии контекста вызывающего.
+        with replica_reads():
+            contextvars.copy_context().run(self.router.db_for_write, Product)
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_without_replica_router_does_not_choose(self, configured):
+        configured.return_value = False
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(Product))
+
+
+class ConcurrentKeyClaimTests(TransactionTestCase):
+    '''
+    Выдача ключей под параллельной нагрузкой на настоящих соединениях из
+    разных потоков (в базе в памяти соединения делят один кэш и не проверяют
+    ни WAL, ни блокировки, поэтому там тесты пропускаются).
+    '''
+
+    THREADS = 4
+    KEYS = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Нужна файловая тестовая база SQLite')
+        self.product = Product.objects.create(title='Продукт', slug='product', price=100)
+        for _ in range(self.KEYS):
+            ProductKey.objects.create(product=self.product)
+
+    def run_threads(self, *targets, timeout=10):
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        return threads, errors
+
+    def unused_keys(self):
+        return ProductKey.objects.filter(product=self.product, is_deleted=False).count()
+
+    def test_sqlite_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Только для SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_readers_proceed_while_writer_claims_keys(self):
+        claimed = threading.Event()
+        release = threading.Event()
+        reads = []
+
+        def writer():
+            try:
+                with transaction.atomic():
+                    claim_keys([self.product.pk])
+                    claimed.set()
+                    release.wait(10)
+            finally:
+                claimed.set()
+
+        def reader():
+            claimed.wait(10)
+            started = time.monotonic()
+            reads.append((self.unused_keys(), time.monotonic() - started))
+
+        (writer_thread, *readers), errors = self.run_threads(writer, *[reader] * self.THREADS)
+        for thread in readers:
+            thread.join(10)
+        # Писатель все еще держит транзакцию открытой: читатели завершились, не дожидаясь ее.
+        self.assertTrue(writer_thread.is_alive())
+        release.set()
+        writer_thread.join(10)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(reads), self.THREADS)
+        for unused, elapsed in reads:
+            # Читатели видят последнее зафиксированное состояние, без незафиксированной выдачи.
+            self.assertEqual(unused, self.KEYS)
+            self.assertLess(elapsed, 1)
+        self.assertEqual(self.unused_keys(), self.KEYS - 1)
+
+    def test_concurrent_writers_wait_instead_of_failing(self):
+        barrier = threading.Barrier(self.THREADS)
+        claimed = []
+
+        def writer():
+            barrier.wait(10)
+            with transaction.atomic():
+                claimed.extend(key.pk for key in claim_keys([self.product.pk]))
+                # Транзакции пересекаются по времени: следующий писатель приходит, пока эта открыта.
+                time.sleep(0.05)
+
+        threads, errors = self.run_threads(*[writer] * self.THREADS)
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(claimed)), self.THREADS)
+        self.assertEqual(self.unused_keys(), self.KEYS - self.THREADS)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_keys, self.KEYS - self.THREADS)
+
+
+class OutboxTests(TransactionTestCase):
+
+    def test_sends_without_open_transaction(self):
+        OutboxMessage.objects.enqueue('Тема', 'Текст', 'buyer@example.com')
+        in_transaction = []
+        send_messages = mail.get_connection().__class__.send_messages
+
+        def spy(backend, messages):
+            in_transaction.append(connection.in_atomic_block)
+            return send_messages(backend, messages)
+
+        with mock.patch.object(mail.get_connection().__class__, 'send_messages', spy):
+            self.assertEqual(send_pending(), (1, 0))
+        # SMTP-обмен не должен держать блокировку базы.
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(OutboxMessage.objects.get().sent_at)
+        self.assertEqual(send_pending(), (0, 0))
+
+    def test_failed_message_is_postponed(self):
+        OutboxMessage.objects.enqueue('Тема', 'Текст', 'buyer@example.com')
+        with mock.patch.object(mail.get_connection().__class__, 'send_messages', side_effect=OSError('нет связи')):
+            self.assertEqual(send_pending(), (0, 1))
+        message = OutboxMessage.objects.get()
+        self.assertIsNone(message.sent_at)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('нет связи', message.last_error)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+
+
+class CounterFieldsTests(TestCase):
+    '''
+    Счетчики ведутся UPDATE с F(); сохранение экземпляра, загруженного до
+    изменения счетчика, не должно возвращать старое значение.
+    '''
+
+    def test_stale_tag_save_keeps_product_count(self):
+        tag = Tag.objects.create(name='Офис')
+        system = OperatingSystem.objects.create(name='Linux')
+        product = Product.objects.create(title='Продукт', slug='product', price=100)
+        product.tags.add(tag)
+        product.operating_systems.add(system)
+
+        tag.name = 'Офисные программы'
+        tag.save()
+        system.name = 'GNU/Linux'
+        system.save()
+
+        tag.refresh_from_db()
+        system.refresh_from_db()
+        self.assertEqual((tag.name, tag.product_count), ('Офисные программы', 1))
+        self.assertEqual((system.name, system.product_count), ('GNU/Linux', 1))
+
+    def test_stale_product_save_keeps_available_keys(self):
+        product = Product.objects.create(title='Продукт', slug='product', price=100)
+        ProductKey.objects.create(product=product)
+        ProductKey.objects.create(product=product)
+
+        product.title = 'Продукт 2'
+        product.save()
+
+        product.refresh_from_db()
+        self.assertEqual((product.title, product.available_keys), ('Продукт 2', 2))
+        self.assertTrue(Product.objects.filter(pk=product.pk, available_keys__gt=0).exists())
+
+
+
+class CounterSignalTests(TestCase):
+
+    def setUp(self):
+        self.office, self.games = Tag.objects.create(name='Офис'), Tag.objects.create(name='Игры')
+        self.linux = OperatingSystem.objects.create(name='Linux')
+        self.product = Product.objects.create(title='Продукт', slug='product', price=100)
+        self.hidden = Product.objects.create(title='Скрытый', slug='hidden', price=100, published=False)
+
+    def assertProductCounts(self, office, games, linux=None):
+        counts = dict(Tag.objects.values_list('name', 'product_count'))
+        self.assertEqual((counts['Офис'], counts['Игры']), (office, games))
+        if linux is not None:
+            self.assertEqual(OperatingSystem.objects.get().product_count, linux)
+
+    def test_forward_m2m(self):
+        self.product.tags.add(self.office, self.games)
+        self.hidden.tags.add(self.office)
+        self.assertProductCounts(1, 1)
+        # remove с несвязанным тегом не уводит счетчик ниже реального.
+        self.product.tags.remove(self.office)
+        self.product.tags.remove(self.office)
+        self.assertProductCounts(0, 1)
+        self.product.tags.set([self.office])
+        self.assertProductCounts(1, 0)
+        self.product.tags.clear()
+        self.assertProductCounts(0, 0)
+
+    def test_reverse_m2m(self):
+        self.office.products.add(self.product, self.hidden)
+        self.linux.products.add(self.product)
+        self.assertProductCounts(1, 0, linux=1)
+        self.office.products.remove(self.hidden)
+        self.assertProductCounts(1, 0)
+        self.office.products.remove(self.product)
+        self.assertProductCounts(0, 0)
+        self.office.products.add(self.product)
+        self.office.products.clear()
+        self.linux.products.clear()
+        self.assertProductCounts(0, 0, linux=0)
+
+    def test_publish_toggle(self):
+        self.hidden.tags.add(self.office)
+        self.hidden.operating_systems.add(self.linux)
+        self.hidden.published = True
+        self.hidden.save()
+        self.assertProductCounts(1, 0, linux=1)
+        # Сохранение без published не трогает счетчики.
+        self.hidden.save(update_fields=['title'])
+        self.assertProductCounts(1, 0, linux=1)
+        self.hidden.published = False
+        self.hidden.save()
+        self.assertProductCounts(0, 0, linux=0)
+
+    def test_delete_product(self):
+        self.product.tags.add(self.office, self.games)
+        self.hidden.tags.add(self.office)
+        self.product.delete()
+        self.hidden.delete()
+        self.assertProductCounts(0, 0)
+
+    def test_available_keys(self):
+        def available():
+            return dict(Product.objects.values_list('slug', 'available_keys'))
+
+        first, second = ProductKey.objects.create(product=self.product), ProductKey.objects.create(product=self.product)
+        self.assertEqual(available(), {'product': 2, 'hidden': 0})
+        first.is_deleted = True
+        first.save()
+        self.assertEqual(available(), {'product': 1, 'hidden': 0})
+        second.product = self.hidden
+        second.save()
+        self.assertEqual(available(), {'product': 0, 'hidden': 1})
+        first.is_deleted = False
+        first.save()
+        self.assertEqual(available(), {'product': 1, 'hidden': 1})
+        first.is_deleted = True
+        first.save()
+        first.delete()
+        second.delete()
+        self.assertEqual(available(), {'product': 0, 'hidden': 0})
+
+class ImportFileErrorTests(TestCase):
+    '''
+    Файл, который нельзя прочитать, дает ImportFileError: команда печатает
+    сообщение, админка показывает ошибку формы, а не 500.
+    '''
+
+    CP1251_CSV = 'title,slug,price\nПродукт,product,100\n'.encode('cp1251')
+
+    def test_not_utf8(self):
+        with self.assertRaisesMessage(ImportFileError, 'UTF-8'):
+            import_file(io.BytesIO(self.CP1251_CSV), 'products', name='products.csv')
+
+    def test_broken_gzip(self):
+        with self.assertRaises(ImportFileError):
+            import_file(io.BytesIO(b'not gzip at all'), 'products', name='products.csv.gz')
+
+    def test_broken_csv(self):
+        # Поле длиннее csv.field_size_limit() (128 КБ по умолчанию).
+        with self.assertRaisesMessage(ImportFileError, 'Ошибка CSV'):
+            import_file(io.BytesIO(b'title,slug,price\n' + b'x' * 200_000 + b',a,1\n'), 'products', name='products.csv')
+
+    def test_admin_shows_form_error(self):
+        self.client.force_login(User.objects.create_superuser('admin@example.com', 'password'))
+        response = self.client.post(reverse('admin:core_product_import'), {
+            'kind': 'products',
+            'file': SimpleUploadedFile('products.csv', self.CP1251_CSV, content_type='text/csv'),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'file', 'Файл должен быть в кодировке UTF-8')
+        self.assertFalse(Product.objects.exists())
+
+
+
+class ProductImportTests(TransactionTestCase):
+
+    def test_rolled_back_chunk_stays_out_of_suggest_index(self):
+        suggest_index.rebuild()
+        rows = 'title,price,tags\nVisio Standard,100,Офис\nVisio Professional,200,Графика\n'.encode()
+        bulk_create = Product.tags.through.objects.bulk_create
+        calls = []
+
+        def failing_second_chunk(objs, **kwargs):
+            calls.append(objs)
+            if len(calls) == 2:
+                raise DatabaseError('диск заполнен')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Product.tags.through.objects, 'bulk_create', failing_second_chunk), \
+                self.assertRaises(DatabaseError):
+            import_file(io.BytesIO(rows), 'products', name='products.csv', batch_size=1)
+
+        self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['Visio Standard'])
+        self.assertEqual([suggestion.text for suggestion in suggest_index.suggest('visio')], ['Visio Standard'])
+        self.assertEqual([suggestion.text for suggestion in suggest_index.suggest('офис')], ['Офис'])
+        self.assertEqual(suggest_index.suggest('графика'), [])
+
+class KeyImportTests(TestCase):
+
+    def test_counts_only_inserted_keys(self):
+        product = Product.objects.create(title='Продукт', slug='product', price=100)
+        other = Product.objects.create(title='Другой', slug='other', price=100)
+        taken, free = uuid.uuid4(), uuid.uuid4()
+        bulk_create = ProductKey.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # Параллельный импорт успел загрузить один из ключей для другого продукта.
+            ProductKey.objects.create(product=other, product_key=taken)
+            return bulk_create(objs, **kwargs)
+
+        rows = f'product,product_key\nproduct,{taken}\nproduct,{free}\n'.encode()
+        with mock.patch.object(ProductKey.objects, 'bulk_create', racing_bulk_create):
+            stats = import_file(io.BytesIO(rows), 'keys', name='keys.csv')
+
+        self.assertEqual((stats.created, stats.skipped), (1, 1))
+        product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(product.available_keys, 1)
+        self.assertEqual(other.available_keys, 1)
+
+
+class KeyPoolTests(TestCase):
+
+    def test_conflict_returns_free_pooled_keys(self):
+        first = Product.objects.create(title='Первый', slug='first', price=100)
+        second = Product.objects.create(title='Второй', slug='second', price=100)
+        for product in (first, second):
+            ProductKey.objects.create(product=product)
+            ProductKey.objects.create(product=product)
+        pool = KeyPool(block_size=1, low_water=0)
+        sold, free = pool.refill(first.pk), pool.refill(second.pk)
+        self.assertEqual((sold, free), (1, 1))
+        # Ключ первого продукта из пула продан в обход пула.
+        ProductKey.objects.filter(product=first, reserved_at__isnull=False).update(is_deleted=True)
+
+        with mock.patch('core.keys.get_key_pool', return_value=pool):
+            keys = claim_keys([first.pk, second.pk])
+
+        self.assertEqual({key.product_id for key in keys}, {first.pk, second.pk})
+        self.assertTrue(all(key.reserved_at is None for key in keys))
+        # Свободный ключ второго продукта вернулся в пул, а не застрял в резерве.
+        self.assertEqual(pool.size(second.pk), 1)
+        self.assertEqual(pool.size(first.pk), 0)
+
+    def test_keys_reserved_by_another_pool_are_sold(self):
+        product = Product.objects.create(title='Продукт', slug='product', price=100)
+        for _ in range(3):
+            ProductKey.objects.create(product=product)
+        # Пул другого процесса зарезервировал все ключи продукта.
+        other = KeyPool(block_size=3, low_water=0)
+        self.assertEqual(other.refill(product.pk), 3)
+        pool = KeyPool(block_size=1, low_water=0)
+
+        with mock.patch('core.keys.get_key_pool', return_value=pool):
+            sold = claim_keys([product.pk])
+        with mock.patch('core.keys.get_key_pool', return_value=other):
+            sold += claim_keys([product.pk]) + claim_keys([product.pk])
+            with self.assertRaises(KeyAllocationError):
+                claim_keys([product.pk])
+
+        self.assertEqual(len({key.pk for key in sold}), 3)
+        product.refresh_from_db()
+        self.assertEqual(product.available_keys, 0)
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Скрытые продукты со словом в названии ранжируются выше опубликованных,
+        # где оно только в описании, и их больше, чем помещается на страницу.
+        Product.objects.bulk_create([
+            Product(
+                title=f'Антивирус {number}', slug=f'hidden-{number}', price=100,
+                description='антивирус', published=False,
+            )
+            for number in range(250)
+        ])
+        cls.products = Product.objects.bulk_create([
+            Product(title=f'Офис {number}', slug=f'office-{number}', price=100, description='антивирус в комплекте')
+            for number in range(3)
+        ])
+
+    def test_filters_apply_to_all_matches(self):
+        found = search_products(Product.objects.published(), 'антивирус')
+        self.assertEqual(found.count(), 3)
+        self.assertCountEqual([product.pk for product in found], [product.pk for product in self.products])
+
+    def test_pages_follow_rank(self):
+        found = search_products(Product.objects.all(), 'антивирус')
+        seen, after = [], None
+        while True:
+            page, first = _page(found, 100, after, SEARCH_ORDERING)
+            rows = list(page[:first])
+            if not rows:
+                break
+            seen += rows
+            after = encode_cursor(rows[-1], SEARCH_ORDERING)
+        self.assertEqual(len(seen), 253)
+        self.assertEqual(len({product.pk for product in seen}), 253)
+        self.assertEqual([product.rank for product in seen], sorted((product.rank for product in seen), reverse=True))
+        self.assertTrue(seen[-1].published)
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(title='Продукт', slug='product', price=100)
+        for _ in range(3):
+            ProductKey.objects.create(product=self.product)
+
+    def test_replay_returns_same_order(self):
+        order, created = checkout('order-1', 'buyer@example.com', [self.product.pk])
+        replayed, replay_created = checkout('order-1', ' Buyer@Example.com', [str(self.product.pk)])
+
+        self.assertEqual((created, replay_created), (True, False))
+        self.assertEqual(replayed.pk, order.pk)
+        # Повтор не выдает ключ и не ставит письмо второй раз.
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 1)
+        self.assertEqual(ProductKey.objects.filter(is_deleted=False).count(), 2)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_conflicting_idempotency_key(self):
+        checkout('order-1', 'buyer@example.com', [self.product.pk])
+        with self.assertRaises(CheckoutError):
+            checkout('order-1', 'other@example.com', [self.product.pk])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(ProductKey.objects.filter(is_deleted=False).count(), 2)
+
+
+class CursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        published = timezone.now()
+        # Одинаковые даты и NULL: порядок держится на id и NULLS LAST.
+        for number, publish_date in enumerate([published, published, None, published.replace(microsecond=1), None]):
+            Product.objects.create(title=f'Продукт {number}', slug=f'product-{number}', price=100, publish_date=publish_date)
+
+    def test_pages_cover_catalog_in_order(self):
+        expected, _ = _page(Product.objects.all(), 100, None, PRODUCT_ORDERING)
+        seen, after = [], None
+        while True:
+            page, first = _page(Product.objects.all(), 2, after, PRODUCT_ORDERING)
+            rows = list(page[:first])
+            if not rows:
+                break
+            seen += [row.pk for row in rows]
+            after = encode_cursor(rows[-1], PRODUCT_ORDERING)
+            self.assertEqual(decode_cursor(Product, PRODUCT_ORDERING, after), [rows[-1].publish_date, rows[-1].pk])
+        self.assertEqual(seen, [row.pk for row in expected])
+
+    def test_invalid_cursor(self):
+        cursors = ['не base64', 'e30=']
+        cursors += [
+            base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            for values in ([1], ['вчера', 1], [None, 'один'], [None, [1]])
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                decode_cursor(Product, PRODUCT_ORDERING, cursor)
+
+    def test_invalid_search_cursor(self):
+        for values in ([{'a': 1}, 1], ['abc', 1], ['nan', 1], [[0.5], 1], [0.5, 'один']):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                decode_cursor(Product, SEARCH_ORDERING, cursor)
+        cursor = base64.urlsafe_b64encode(json.dumps(['0.5', 1]).encode()).decode()
+        self.assertEqual(decode_cursor(Product, SEARCH_ORDERING, cursor), [0.5, 1])
+
+
+def post_graphql(client, query, path='/graphql', **data):
+    response = client.post(path, {'query': query, **data}, content_type='application/json')
+    return response, response.json()
+
+
+class ResponseCacheTests(TestCase):
+    QUERY = '{ productBySlug(slug: "product") { title tags { name } } }'
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.product = Product.objects.create(title='Продукт', slug='product', price=100)
+
+    def product_data(self):
+        return post_graphql(self.client, self.QUERY)[1]['data']['productBySlug']
+
+    def test_cached_until_save(self):
+        self.assertEqual(self.product_data()['title'], 'Продукт')
+        # Обход ORM: сигналов нет, ответ должен прийти из кэша.
+        Product.objects.filter(pk=self.product.pk).update(title='Без сигнала')
+        self.assertEqual(self.product_data()['title'], 'Продукт')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Новое название'
+            self.product.save()
+        self.assertEqual(self.product_data()['title'], 'Новое название')
+
+    def test_m2m_change_invalidates(self):
+        self.assertEqual(self.product_data()['tags'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.tags.add(Tag.objects.create(name='Офис'))
+        self.assertEqual(self.product_data()['tags'], [{'name': 'Офис'}])
+
+
+class PersistedQueryTests(TestCase):
+    QUERY = '{ productBySlug(slug: "apq") { title } }'
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        persisted.document_backend._documents.clear()
+        Product.objects.create(title='Продукт', slug='apq', price=100)
+        self.extensions = {'persistedQuery': {'version': 1, 'sha256Hash': persisted.query_hash(self.QUERY)}}
+
+    @override_settings(GRAPHQL_PERSISTED_QUERIES_AUTO_REGISTER=True)
+    def test_miss_then_register(self):
+        response, body = post_graphql(self.client, None, extensions=self.extensions)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        # Клиент Apollo повторяет запрос с текстом: он выполняется и регистрируется.
+        response, body = post_graphql(self.client, self.QUERY, extensions=self.extensions)
+        self.assertEqual(body, {'data': {'productBySlug': {'title': 'Продукт'}}})
+        self.assertTrue(PersistedQuery.objects.filter(sha256=persisted.query_hash(self.QUERY)).exists())
+
+        # Хэш находится и после вытеснения документа из LRU процесса.
+        persisted.document_backend._documents.clear()
+        response_cache.get_cache().clear()
+        response, body = post_graphql(self.client, None, extensions=self.extensions)
+        self.assertEqual(body, {'data': {'productBySlug': {'title': 'Продукт'}}})
+
+    def test_not_registered_without_auto_register(self):
+        post_graphql(self.client, self.QUERY, extensions=self.extensions)
+        self.assertFalse(PersistedQuery.objects.exists())
+
+    def test_hash_mismatch(self):
+        response, _ = post_graphql(self.client, '{ __typename }', extensions=self.extensions)
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryCostTests(TestCase):
+    QUERY = '{ allProducts(first: 10) { totalCount edges { node { title tags { name } } } } }'
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def expected_cost(self):
+        return cost.estimate(schema, parse(self.QUERY)).cost
+
+    def test_cost_header(self):
+        response, body = post_graphql(self.client, self.QUERY)
+        self.assertNotIn('errors', body)
+        self.assertEqual(response['X-GraphQL-Cost'], str(self.expected_cost()))
+
+    def test_over_limit_is_rejected_before_resolvers(self):
+        with override_settings(GRAPHQL_MAX_QUERY_COST=self.expected_cost() - 1), self.assertNumQueries(0):
+            response, body = post_graphql(self.client, self.QUERY)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('data', body)
+        self.assertIn('Стоимость запроса', body['errors'][0]['message'])
+        self.assertEqual(response['X-GraphQL-Cost'], str(self.expected_cost()))
+
+    @override_settings(GRAPHQL_MAX_QUERY_DEPTH=3)
+    def test_too_deep_is_rejected(self):
+        response, body = post_graphql(self.client, self.QUERY)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Глубина запроса', body['errors'][0]['message'])
+
+
+class AsyncViewTests(TestCase):
+    QUERIES = [
+        '{ allProducts(first: 2) { totalCount pageInfo { hasNextPage endCursor } '
+        'edges { node { title company { name } tags { name } } } } }',
+        '{ productBySlug(slug: "product-1") { title operatingSystems { name } } }',
+        '{ productsSearch(query: "продукт", first: 5) { totalCount edges { node { slug } } } }',
+        '{ tagsWithCountOfProducts { name countProducts } }',
+        '{ productBySlug(slug: "нет такого") { title } }',
+        '{ noSuchField }',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        tag = Tag.objects.create(name='Офис')
+        system = OperatingSystem.objects.create(name='Linux')
+        for number in range(3):
+            product = Product.objects.create(
+                title=f'Продукт {number}', slug=f'product-{number}', price=100, publish_date=timezone.now(),
+            )
+            product.tags.add(tag)
+            product.operating_systems.add(system)
+
+    def response(self, path, query):
+        # Иначе второе представление получило бы ответ первого из кэша.
+        response_cache.get_cache().clear()
+        response, body = post_graphql(self.client, query, path=path)
+        return response.status_code, body, response.get('X-GraphQL-Cost')
+
+    def test_same_responses(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(self.response('/graphql/async', query), self.response('/graphql', query))
+
+
+class LoaderQueryCountTests(TestCase):
+    QUERY = (
+        '{ allProducts(first: 50) { edges { node { title company { name } '
+        'tags { name } operatingSystems { name } } } } }'
+    )
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def add_products(self, count):
+        tags = [Tag.objects.create(name=f'Тег {Tag.objects.count()}') for _ in range(2)]
+        system = OperatingSystem.objects.get_or_create(name='Linux')[0]
+        for _ in range(count):
+            number = Product.objects.count()
+            product = Product.objects.create(
+                title=f'Продукт {number}', slug=f'product-{number}', price=100, publish_date=timezone.now(),
+                company=Company.objects.create(name=f'Компания {number}'),
+            )
+            product.tags.set(tags)
+            product.operating_systems.add(system)
+
+    def queries(self, path):
+        response_cache.get_cache().clear()
+        with CaptureQueriesContext(connection) as captured:
+            response, body = post_graphql(self.client, self.QUERY, path=path)
+        self.assertNotIn('errors', body)
+        return len(captured)
+
+    def test_relations_do_not_multiply_queries(self):
+        for path in ('/graphql', '/graphql/async'):
+            with self.subTest(path=path):
+                self.add_products(2)
+                few = self.queries(path)
+                self.add_products(5)
+                self.assertEqual(self.queries(path), few)
+                # Страница, компании и по одному запросу на каждую связь ManyToMany.
+                self.assertLessEqual(few, 4)
+
+    def test_loader_batches_relations(self):
+        self.add_products(4)
+        products = list(Product.objects.all())
+        info = SimpleNamespace(context=SimpleNamespace())
+
+        def load(field_name):
+            # Как при выполнении запроса: загрузки внутри цепочки промисов копятся в пакет.
+            return Promise.resolve(None).then(
+                lambda _: Promise.all([load_related(product, info, field_name) for product in products])
+            ).get()
+
+        # Без select_related/prefetch_related каждая связь — один запрос на все продукты.
+        for field_name in ('company', 'tags', 'operating_systems'):
+            with self.subTest(field_name=field_name), self.assertNumQueries(1):
+                self.assertEqual(len(load(field_name)), 4)
+        # Повторные загрузки в том же запросе берутся из кэша загрузчика.
+        with self.assertNumQueries(0):
+            load('tags')
+
+
+
+class OptimizerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Компания')
+        tag = Tag.objects.create(name='Офис')
+        for number in range(3):
+            product = Product.objects.create(
+                title=f'Продукт {number}', slug=f'product-{number}', price=100, company=cls.company,
+                description='Длинное описание',
+            )
+            product.tags.add(tag)
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def run_query(self, query):
+        with CaptureQueriesContext(connection) as captured:
+            _, body = post_graphql(self.client, query)
+        self.assertNotIn('errors', body)
+        return [item['sql'] for item in captured]
+
+    def product_sql(self, queries):
+        return next(sql for sql in queries if 'FROM "core_product"' in sql)
+
+    def test_unrequested_columns_are_deferred(self):
+        sql = self.product_sql(self.run_query('{ productBySlug(slug: "product-0") { title } }'))
+        self.assertIn('"core_product"."title"', sql)
+        self.assertNotIn('"core_product"."description"', sql)
+        self.assertNotIn('"core_product"."photo"', sql)
+
+    def test_computed_field_columns_are_loaded(self):
+        sql = self.product_sql(self.run_query('{ productBySlug(slug: "product-0") { photoVariants { url } } }'))
+        self.assertIn('"core_product"."photo"', sql)
+        self.assertNotIn('"core_product"."title"', sql)
+
+    def test_foreign_key_is_joined(self):
+        queries = self.run_query('{ productBySlug(slug: "product-0") { title company { name } } }')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('JOIN "core_company"', queries[0])
+
+    def test_reverse_relations_are_prefetched(self):
+        queries = self.run_query(
+            f'{{ companyById(id: {self.company.pk}) {{ name productSet {{ title tags {{ name }} }} }} }}'
+        )
+        # Компания, ее продукты и их теги — по запросу на уровень, без запроса на продукт.
+        self.assertEqual(len(queries), 3)
+        self.assertNotIn('"core_product"."description"', self.product_sql(queries))
+
+
+class ProfilingTests(TestCase):
+    QUERY = '{ allProducts(first: 5) { edges { node { title tags { name } } } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        tag = Tag.objects.create(name='Офис')
+        for number in range(2):
+            product = Product.objects.create(
+                title=f'Продукт {number}', slug=f'product-{number}', price=100, publish_date=timezone.now(),
+            )
+            product.tags.add(tag)
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def profile(self, **headers):
+        response = self.client.post(
+            '/graphql', {'query': self.QUERY}, content_type='application/json', **headers,
+        )
+        body = response.json()
+        self.assertIn('data', body)
+        return body.get('extensions', {}).get('profile')
+
+    def test_off_by_default(self):
+        self.assertIsNone(self.profile())
+        # Без токена заголовок работает только для сотрудников.
+        self.assertIsNone(self.profile(HTTP_X_GRAPHQL_PROFILE='1'))
+        self.client.force_login(User.objects.create_user('buyer@example.com', 'password'))
+        self.assertIsNone(self.profile(HTTP_X_GRAPHQL_PROFILE='1'))
+
+    def test_header_for_staff(self):
+        self.client.force_login(User.objects.create_user('staff@example.com', 'password', is_staff=True))
+        report = self.profile(HTTP_X_GRAPHQL_PROFILE='1')
+
+        self.assertGreater(report['duration_ms'], 0)
+        self.assertGreaterEqual(report['queries'], 2)
+        self.assertEqual(report['queries'], sum(item['queries'] for item in report['resolvers']))
+        paths = {item['path']: item for item in report['resolvers']}
+        self.assertGreaterEqual(paths['allProducts']['queries'], 1)
+        self.assertEqual(paths['allProducts.edges.node.title']['calls'], 2)
+        self.assertEqual(report['duplicates'], [])
+
+    @override_settings(GRAPHQL_PROFILE_TOKEN='secret')
+    def test_header_with_token(self):
+        self.assertIsNone(self.profile(HTTP_X_GRAPHQL_PROFILE='wrong'))
+        self.assertIsNotNone(self.profile(HTTP_X_GRAPHQL_PROFILE='secret'))
+
+    @override_settings(GRAPHQL_PROFILE_SAMPLE_RATE=1.0)
+    def test_sampled_profile_is_only_logged(self):
+        with self.assertLogs('core.profiling', 'INFO') as logs:
+            self.assertIsNone(self.profile())
+        self.assertIn('"queries"', logs.output[0])
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(title='Продукт, "новый"', slug='product', price=100)
+        cls.keys = [ProductKey.objects.create(product=cls.product) for _ in range(3)]
+        ProductKey.objects.filter(pk=cls.keys[0].pk).update(is_deleted=True)
+
+    def test_csv(self):
+        lines = list(csv.reader(io.StringIO(b''.join(exporter.export('products')).decode())))
+        self.assertEqual(lines[0], exporter.columns('products'))
+        row = dict(zip(lines[0], lines[1]))
+        self.assertEqual(row['title'], 'Продукт, "новый"')
+        self.assertEqual((row['used_keys'], row['unused_keys']), ('1', '2'))
+
+    def test_jsonl(self):
+        lines = b''.join(exporter.export('keys', 'jsonl', chunk_size=1)).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['product_key'] for row in rows], [str(key.product_key) for key in self.keys])
+        self.assertEqual([row['is_deleted'] for row in rows], [True, False, False])
+
+    def test_gzip(self):
+        self.assertEqual(
+            gzip.decompress(b''.join(exporter.export('products', 'csv', compress=True))),
+            b''.join(exporter.export('products', 'csv')),
+        )
+
+    def export_response(self, user, **params):
+        self.client.force_login(user)
+        return self.client.get(reverse('admin:core_product_export'), params)
+
+    def staff(self, *codenames):
+        user = User.objects.create_user(f'{len(codenames)}@example.com', 'password', is_staff=True)
+        user.user_permissions.set(Permission.objects.filter(content_type__app_label='core', codename__in=codenames))
+        return user
+
+    def test_keys_require_key_permission(self):
+        catalog_only = self.staff('view_product')
+        self.assertEqual(self.export_response(catalog_only, kind='products').status_code, 200)
+        self.assertEqual(self.export_response(catalog_only, kind='keys').status_code, 403)
+        self.assertNotContains(self.client.get(reverse('admin:core_product_changelist')), 'kind=keys')
+
+        response = self.export_response(self.staff('view_product', 'view_productkey'), kind='keys', gzip='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="keys.csv.gz"')
+        self.assertIn(str(self.keys[1].product_key), gzip.decompress(b''.join(response.streaming_content)).decode())
+
+    def test_unknown_kind(self):
+        self.assertEqual(self.export_response(self.staff('view_product'), kind='users').status_code, 404)
+
+
+class SuggestIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for year in range(2010, 2022):
+            Product.objects.create(title=f'Microsoft Office {year}', slug=f'office-{year}', price=100)
+        Product.objects.create(title='Office', slug='office', price=100)
+        Product.objects.create(title='Office Zeta', slug='office-zeta', price=100)
+        Product.objects.create(title='Скрытый Office', slug='hidden', price=100, published=False)
+
+    def setUp(self):
+        self.index = SuggestIndex()
+
+    def texts(self, prefix, limit=10):
+        return [suggestion.text for suggestion in self.index.suggest(prefix, limit)]
+
+    def test_whole_title_matches_rank_first(self):
+        self.assertEqual(self.texts('office', 5)[:2], ['Office', 'Office Zeta'])
+        self.assertEqual(
+            [suggestion.score for suggestion in self.index.suggest('office', 5)], [2.0, 2.0, 1.0, 1.0, 1.0],
+        )
+        self.assertEqual(self.texts('office 2021')[0], 'Microsoft Office 2021')
+
+    def test_upsert_and_remove(self):
+        self.assertEqual(self.texts('visio'), [])
+        self.index.upsert('product', 1000, 'Visio 2021', 'visio')
+        self.assertEqual(self.texts('visio'), ['Visio 2021'])
+        # Переименование заменяет старые ключи.
+        self.index.upsert('product', 1000, 'Project 2021', 'project')
+        self.assertEqual(self.texts('visio'), [])
+        self.assertEqual(set(self.texts('2021')[:2]), {'Project 2021', 'Microsoft Office 2021'})
+        self.index.remove('product', 1000)
+        self.assertEqual(self.texts('project'), [])
+
+    def test_fuzzy_fallback(self):
+        suggestions = self.index.suggest('ofice zeta')
+        self.assertEqual(suggestions[0].text, 'Office Zeta')
+        self.assertLess(suggestions[0].score, 1.0)
+        # Короткие запросы с опечатками не ищутся.
+        self.assertEqual(self.texts('ofi'), [])
+
+    # schema читает backend.settings напрямую, override_settings его не меняет.
+    @mock.patch('core.schema.settings.SUGGEST_MAX_LIMIT', 3)
+    def test_limit_is_clamped(self):
+        response_cache.get_cache().clear()
+        suggest_index.rebuild()
+        for limit, expected in ((100, 3), (2, 2), (-1, 0)):
+            with self.subTest(limit=limit):
+                _, body = post_graphql(self.client, f'{{ productSuggest(prefix: "office", limit: {limit}) {{ text }} }}')
+                self.assertEqual(len(body['data']['productSuggest']), expected)
+
+
+class MediaServeTests(SimpleTestCase):
+    CONTENT = b'0123456789'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = os.path.join(directory.name, 'media')
+        os.makedirs(os.path.join(self.root, 'docs'))
+        with open(os.path.join(self.root, 'docs', 'file.txt'), 'wb') as file:
+            file.write(self.CONTENT)
+        with open(os.path.join(directory.name, 'secret.txt'), 'wb') as file:
+            file.write(b'secret')
+        settings_override = override_settings(MEDIA_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(media.stat_cache._items.clear)
+        self.factory = RequestFactory()
+
+    def serve(self, path='docs/file.txt', method='get', **headers):
+        response = media.serve(getattr(self.factory, method)(f'/media/{path}', **headers), path)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_full_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.CONTENT)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'])
+
+    def test_single_range(self):
+        response = self.serve(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+    def test_suffix_range(self):
+        response = self.serve(HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b'789')
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range_mismatch_returns_full_file(self):
+        response = self.serve(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"другой"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.CONTENT)
+
+    def test_if_none_match(self):
+        etag = self.serve()['ETag']
+        response = self.serve(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_head(self):
+        response = self.serve(method='head')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), b'')
+
+    def test_path_traversal(self):
+        for path in ('../secret.txt', 'docs/../../secret.txt', 'docs', 'missing.txt'):
+            with self.subTest(path=path), self.assertRaises(Http404):
+                self.serve(path)
+
+
+class ImageVariantTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(images._generated.clear)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 400), (200, 30, 30)).save(buffer, 'PNG')
+        field = Product._meta.get_field('photo')
+        name = field.storage.save('product_images/photo.png', ContentFile(buffer.getvalue()))
+        self.photo = field.attr_class(None, field, name)
+
+    def test_original_until_variants_exist(self):
+        urls = images.variant_urls(self.photo)
+        self.assertEqual([size for size, *_ in urls], list(settings.IMAGE_VARIANTS))
+        self.assertEqual({(width, height, url) for _, width, height, url in urls}, {(None, None, self.photo.url)})
+        self.assertFalse(images.has_variants(self.photo))
+
+    def test_generated_variants(self):
+        count = images.generate_variants(self.photo.storage, self.photo.name)
+        self.assertEqual(count, len(settings.IMAGE_VARIANTS) * len(settings.IMAGE_VARIANT_FORMATS))
+        self.assertTrue(images.has_variants(self.photo, 'jpeg'))
+
+        with self.photo.storage.open(images.variant_name(self.photo.name, 'thumb', 'webp')) as file:
+            with Image.open(file) as thumb:
+                self.assertEqual((thumb.format, thumb.size), ('WEBP', (160, 80)))
+        urls = images.variant_urls(self.photo, 'jpeg')
+        self.assertEqual(urls[0], ('thumb', 160, 160, self.photo.storage.url(
+            images.variant_name(self.photo.name, 'thumb', 'jpeg'),
+        )))
+
+    def test_existing_variants_are_found_in_storage(self):
+        images.generate_variants(self.photo.storage, self.photo.name)
+        images._generated.clear()
+        self.assertTrue(images.has_variants(self.photo, 'webp'))
+        self.assertNotEqual(images.variant_urls(self.photo)[0][3], self.photo.url)
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save('product_images/photo.JPG', ContentFile(b'image'))
+        with mock.patch.object(self.storage, '_write', wraps=self.storage._write) as write:
+            second = self.storage.save('product_images/other.jpg', ContentFile(b'image'))
+        write.assert_not_called()
+
+        digest = hashlib.sha256(b'image').hexdigest()
+        self.assertEqual(first, f'product_images/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(second, first)
+        self.assertEqual(storage.parse_name(first), (digest, False))
+        with self.storage.open(first) as file:
+            self.assertEqual(file.read(), b'image')
+
+    def test_different_content_gets_different_names(self):
+        first = self.storage.save('product_images/photo.jpg', ContentFile(b'image'))
+        second = self.storage.save('product_images/photo.jpg', ContentFile(b'another image'))
+        self.assertNotEqual(first, second)
+        for name, content in ((first, b'image'), (second, b'another image')):
+            with self.storage.open(name) as file:
+                self.assertEqual(file.read(), content)
+
+    def test_save_as_keeps_name(self):
+        name = self.storage.save('product_images/photo.jpg', ContentFile(b'image'))
+        variant = images.variant_name(name, 'thumb', 'webp')
+        self.assertEqual(self.storage.save_as(variant, ContentFile(b'thumb')), variant)
+        self.assertEqual(self.storage.save_as(variant, ContentFile(b'new thumb')), variant)
+        with self.storage.open(variant) as file:
+            self.assertEqual(file.read(), b'new thumb')
+        self.assertEqual(storage.parse_name(variant)[1], True)
@@ -1,3 +1,192 @@
-from django.shortcuts import render
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+from graphql.execution.executors.asyncio import AsyncioExecutor
+
+from core import persisted, profiling, response_cache, routers
+from core.aio import SyncFallbackMiddleware, call_or_offload
+
+
+class CachedGraphQLView(GraphQLView):
+    """
+    GraphQLView с кэшем ответов на анонимные запросы чтения.
+
+    Ключ строится по нормализованному тексту запроса, переменным и версиям
+    моделей, от которых зависит ответ (core.response_cache). Сигналы моделей
+    повышают версии, поэтому устаревшие ответы просто перестают находиться и
+    вытесняются кэшем по LRU.
+
+    Запросы разбираются через общий LRU документов, а клиенты могут
+    присылать вместо текста хэш persisted query (core.persisted).
+    Выбранные запросы профилируются (core.profiling). Запросы чтения
+    выполняются с реплики базы, если она настроена (core.routers).
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(request, 'graphql_cost'):
+            # Оценка стоимости запроса (core.cost) для метрик и отладки клиентов.
+            response['X-GraphQL-Cost'] = request.graphql_cost
+        return response
+
+    def get_backend(self, request):
+        return persisted.document_backend
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        return persisted.resolve_query(self.schema, query, extensions), variables, operation_name, id
+
+    def cache_extra(self, request, id):
+        # Параметры представления, влияющие на текст ответа.
+        return [id, bool(self.batch), bool(self.pretty or request.GET.get('pretty'))]
+
+    def reads_from_replica(self, query, operation_name):
+        '''
+        Можно ли выполнить операцию с реплики: это чтение (query) без полей,
+        которые пишут или должны видеть только что записанные данные.
+        '''
+        if not query or not routers.replica_configured():
+            return False
+        try:
+            document = response_cache.analyze(self.schema, query)
+        except Exception:
+            return False
+        return document.operation_type(operation_name) == 'query' and not document.root_fields & routers.PRIMARY_FIELDS
+
+    def get_response(self, request, data, show_graphiql=False):
+        replica = False
+        key = profile = operation_name = None
+        if not show_graphiql:
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+            replica = self.reads_from_replica(query, operation_name)
+            profile = profiling.start(request)
+            if profile is None or not profile.respond:
+                key = response_cache.response_key(
+                    self.schema, request, query, variables, operation_name, extra=self.cache_extra(request, id),
+                )
+        cache = response_cache.get_cache()
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached, 200
+
+        with routers.replica_reads(replica):
+            if profile is None:
+                result, status_code = super().get_response(request, data, show_graphiql)
+            else:
+                result, status_code = self._profiled_response(request, data, profile, operation_name)
+        if key is not None and status_code == 200 and result and 'errors' not in json.loads(result):
+            cache.set(key, result, timeout=settings.GRAPHQL_CACHE_TIMEOUT)
+        return result, status_code
+
+    def _profiled_response(self, request, data, profile, operation_name):
+        request.graphql_profile = profile
+        try:
+            with profile.capture():
+                result, status_code = super().get_response(request, data)
+        finally:
+            del request.graphql_profile
+        report = profiling.emit(profile, operation_name, getattr(request, 'graphql_cost', None))
+        if profile.respond and result:
+            response = json.loads(result)
+            response.setdefault('extensions', {})['profile'] = report
+            result = self.json_encode(request, response)
+        return result, status_code
+
+
+class AsyncGraphQLView(CachedGraphQLView):
+    """
+    Асинхронное представление GraphQL для ASGI.
+
+    Запросы чтения выполняются graphql-core с AsyncioExecutor в цикле событий:
+    корневые резолверы возвращают корутины async ORM (aget, acount, async for)
+    и выполняются конкурентно, поля уже загруженных объектов разрешаются без
+    переключения потоков, а резолверы, которым нужна синхронная база, уходят в
+    поток (core.aio.SyncFallbackMiddleware). Мутации, пакетные запросы,
+    GraphiQL и профилирование идут синхронным путем CachedGraphQLView в потоке.
+    """
+
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ('get', 'post'):
+                raise HttpError(
+                    HttpResponseNotAllowed(['GET', 'POST'], 'GraphQL only supports GET and POST requests.')
+                )
+            data = self.parse_body(request)
+            if self.batch or (self.graphiql and self.can_display_graphiql(request, data)):
+                return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+            result, status_code = await self.aget_response(request, data)
+            response = HttpResponse(status=status_code, content=result, content_type='application/json')
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+        if hasattr(request, 'graphql_cost'):
+            response['X-GraphQL-Cost'] = request.graphql_cost
+        return response
+
+    async def aget_response(self, request, data):
+        query, variables, operation_name, id = await call_or_offload(self.get_graphql_params, request, data)
+        try:
+            operation_type = response_cache.analyze(self.schema, query).operation_type(operation_name)
+        except Exception:
+            operation_type = None
+        if operation_type != 'query' or request.META.get(profiling.PROFILE_HEADER):
+            # Ошибки разбора и запросы вне асинхронного пути обрабатывает синхронное представление.
+            return await sync_to_async(self.get_response)(request, data)
+
+        key = await call_or_offload(
+            response_cache.response_key,
+            self.schema, request, query, variables, operation_name, extra=self.cache_extra(request, id),
+        )
+        cache = response_cache.get_cache()
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached, 200
+
+        with routers.replica_reads(self.reads_from_replica(query, operation_name)):
+            execution_result = await self.aexecute_graphql_request(request, query, variables, operation_name)
+        response = {}
+        status_code = 200
+        if execution_result.errors:
+            response['errors'] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.invalid:
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        result = self.json_encode(request, response)
+
+        if key is not None and status_code == 200 and 'errors' not in response:
+            cache.set(key, result, timeout=settings.GRAPHQL_CACHE_TIMEOUT)
+        return result, status_code
+
+    async def aexecute_graphql_request(self, request, query, variables, operation_name):
+        try:
+            document = self.get_backend(request).document_from_string(self.schema, query)
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+
+        request.graphql_async = True
+        result = document.execute(
+            root_value=self.get_root_value(request),
+            variable_values=variables,
+            operation_name=operation_name,
+            context_value=self.get_context(request),
+            # Последний middleware — внешний: он перехватывает и обращения к базе из middleware JWT.
+            middleware=[*self.get_middleware(request), SyncFallbackMiddleware()],
+            executor=AsyncioExecutor(loop=asyncio.get_running_loop()),
+            return_promise=True,
+        )
+        if not isinstance(result, ExecutionResult):
+            result = await result
+        return result
 
-# Create your views here.